@@ -0,0 +1,273 @@
+"""
+Benchmarks the feed, profile, search and like endpoints (REST and GraphQL).
+
+Seeds a fresh SQLite database with `populate_db`, then times each scenario
+through Django's test client, recording latency percentiles, the number of
+SQL queries and the size of the response. Results are written as JSON, and
+can be compared with those of another commit:
+
+    cd backend
+    python -m benchmarks.run --output before.json
+    git checkout my-branch
+    python -m benchmarks.run --output after.json --baseline before.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import contextlib
+import subprocess
+from datetime import datetime, timezone
+
+os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client
+from graphql_jwt.shortcuts import get_token
+from rest_framework_simplejwt.tokens import AccessToken
+
+import populate_db
+from core.metrics import registry
+from core.models import Post, Profile, TimelineEntry
+
+GRAPHQL_FEED = """
+query Feed($after: String) {
+  feed(first: 20, after: $after) {
+    edges { node { id caption likeCount createdAt srcset user { username profile { profileimg } } } }
+    pageInfo { endCursor hasNextPage }
+  }
+}
+"""
+GRAPHQL_PROFILE = """
+query Profile($username: String!) {
+  profile(username: $username) {
+    bio location followersCount followingCount isFollowing
+    user { username firstName lastName posts { id caption likeCount createdAt } }
+  }
+}
+"""
+GRAPHQL_SUGGESTIONS = """
+query { suggestions { bio followersCount user { username } } }
+"""
+
+
+def percentile(ordered, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(values):
+    ordered = sorted(values)
+    return {
+        'mean': round(sum(ordered) / len(ordered), 3),
+        'p50': round(percentile(ordered, 0.50), 3),
+        'p90': round(percentile(ordered, 0.90), 3),
+        'p99': round(percentile(ordered, 0.99), 3),
+        'max': round(ordered[-1], 3),
+    }
+
+
+def git_revision():
+    """
+    The checked-out commit, and whether the tree has uncommitted changes.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain'], capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def seed(args):
+    """
+    Creates a fresh database and fills it with the generated data set.
+    """
+    shutil.rmtree(settings.BENCHMARK_DIR, ignore_errors=True)
+    os.makedirs(settings.BENCHMARK_DIR)
+    call_command('migrate', verbosity=0)
+    # Keep stdout for the JSON results.
+    with contextlib.redirect_stdout(sys.stderr):
+        populate_db.run(
+            num_users=args.users, posts_per_user=args.posts, follows_per_user=args.follows,
+            likes_per_user=args.likes, seed=args.seed, clear=False,
+        )
+
+
+def scenarios():
+    """
+    Returns `{name: request function}`, each calling the test client once.
+
+    The viewer is the user following the most accounts (the biggest feed), and
+    the profile is the most followed user's.
+    """
+    viewer = Profile.objects.select_related('user').order_by('-following_count', 'user__username').first().user
+    star = Profile.objects.select_related('user').order_by('-followers_count', 'user__username').first().user
+    term = viewer.last_name[:3].lower()
+    post_id = str(
+        TimelineEntry.objects.filter(owner=viewer).order_by('-created_at').values_list('post_id', flat=True).first()
+        or Post.objects.order_by('-created_at').values_list('id', flat=True).first()
+    )
+
+    client = Client()
+    rest = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(viewer)}'}
+    graphql_headers = {'HTTP_AUTHORIZATION': f'JWT {get_token(viewer)}'}
+
+    def graphql(query, variables=None):
+        return lambda: client.post(
+            '/graphql', json.dumps({'query': query, 'variables': variables or {}}),
+            content_type='application/json', **graphql_headers,
+        )
+
+    return {
+        'rest_feed': lambda: client.get('/', **rest),
+        'rest_feed_top': lambda: client.get('/', {'order': 'top'}, **rest),
+        'rest_profile': lambda: client.get(f'/profile/{star.username}', **rest),
+        'rest_search': lambda: client.get(f'/search/{term}/', **rest),
+        # Alternates between liking and unliking the same post.
+        'rest_like': lambda: client.post('/like-post', {'post_id': post_id}, content_type='application/json', **rest),
+        'graphql_feed': graphql(GRAPHQL_FEED),
+        'graphql_profile': graphql(GRAPHQL_PROFILE, {'username': star.username}),
+        'graphql_suggestions': graphql(GRAPHQL_SUGGESTIONS),
+    }
+
+
+def queries_run():
+    """
+    SQL queries counted by `core.metrics` so far. Unlike CaptureQueriesContext,
+    this includes those run on other threads (see `core.concurrency`).
+    """
+    with registry.lock:
+        return sum(value for (name, _), value in registry.counters.items() if name == 'db_queries_total')
+
+
+def measure(request, iterations, warmup, cold):
+    """
+    Runs one scenario and summarizes its latency (ms), queries and response bytes.
+    """
+    latencies, queries, sizes, statuses = [], [], [], set()
+    for index in range(warmup + iterations):
+        if cold:
+            cache.clear()
+        before = queries_run()
+        started = time.perf_counter()
+        response = request()
+        elapsed = time.perf_counter() - started
+        if index < warmup:
+            continue
+        latencies.append(elapsed * 1000)
+        queries.append(queries_run() - before)
+        sizes.append(len(response.content))
+        statuses.add(response.status_code)
+    return {
+        'requests': iterations,
+        'status': sorted(statuses),
+        'latency_ms': summarize(latencies),
+        'queries': summarize(queries),
+        'bytes': summarize(sizes),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints how each scenario moved against `baseline` and returns the names of
+    those whose median latency or query count grew by more than `threshold`.
+    """
+    regressions = []
+    print(f"\n{'scenario':<22}{'p50 ms':>24}{'queries':>16}{'bytes':>20}", file=sys.stderr)
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            print(f"{name:<22}{'(new)':>24}", file=sys.stderr)
+            continue
+        old_p50, new_p50 = before['latency_ms']['p50'], result['latency_ms']['p50']
+        old_queries, new_queries = before['queries']['max'], result['queries']['max']
+        change = (new_p50 - old_p50) / old_p50 if old_p50 else 0.0
+        if change > threshold or new_queries > old_queries:
+            regressions.append(name)
+        old_bytes, new_bytes = before['bytes']['mean'], result['bytes']['mean']
+        print(
+            f"{name:<22}{f'{old_p50:.2f} -> {new_p50:.2f} ({change:+.0%})':>24}"
+            f"{f'{old_queries:g} -> {new_queries:g}':>16}{f'{old_bytes:g} -> {new_bytes:g}':>20}",
+            file=sys.stderr,
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the main read and write endpoints against seeded data.")
+    parser.add_argument('--users', type=int, default=1000, help="Size of the generated data set.")
+    parser.add_argument('--posts', type=float, default=populate_db.POSTS_PER_USER)
+    parser.add_argument('--follows', type=float, default=populate_db.FOLLOWS_PER_USER)
+    parser.add_argument('--likes', type=float, default=populate_db.LIKES_PER_USER)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--iterations', type=int, default=50, help="Timed requests per scenario.")
+    parser.add_argument('--warmup', type=int, default=5, help="Untimed requests per scenario first.")
+    parser.add_argument('--cold', action='store_true', help="Clear the cache before every request.")
+    parser.add_argument('--only', nargs='*', help="Only run these scenarios.")
+    parser.add_argument('--output', help="Write the results to this JSON file instead of stdout.")
+    parser.add_argument('--baseline', help="Compare with the results of an earlier run.")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="Median latency growth counted as a regression when comparing (default 25%%).")
+    args = parser.parse_args()
+
+    seed(args)
+    cache.clear()
+    commit, dirty = git_revision()
+    report = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'dataset': {
+                'users': args.users, 'posts': args.posts, 'follows': args.follows,
+                'likes': args.likes, 'seed': args.seed,
+            },
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            'cold': args.cold,
+        },
+        'results': {},
+    }
+
+    for name, request in scenarios().items():
+        if args.only and name not in args.only:
+            continue
+        result = measure(request, args.iterations, args.warmup, args.cold)
+        report['results'][name] = result
+        print(
+            f"{name}: p50 {result['latency_ms']['p50']:.2f} ms, p99 {result['latency_ms']['p99']:.2f} ms, "
+            f"{result['queries']['max']:g} queries, {result['bytes']['mean']:g} bytes",
+            file=sys.stderr,
+        )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report['results'], json.load(f), args.threshold)
+        if regressions:
+            print(f"\nRegressed: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import os
+import tempfile
+
+from social_book.settings import *  # noqa: F401,F403
+
+# Self-contained settings for the benchmarks: a throwaway SQLite database, an
+# in-process cache instead of Redis, and Celery tasks run inline, so a run
+# needs no other service and no network.
+
+BENCHMARK_DIR = os.environ.get('BENCHMARK_DIR', os.path.join(tempfile.gettempdir(), 'social_book_benchmarks'))
+
+DEBUG = False
+ALLOWED_HOSTS = ['testserver']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCHMARK_DIR, 'db.sqlite3'),
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+
+CELERY_TASK_ALWAYS_EAGER = True
+CELERY_BROKER_URL = 'memory://'
+CELERY_RESULT_BACKEND = 'cache+memory://'
+
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+MEDIA_ROOT = os.path.join(BENCHMARK_DIR, 'media')
+UPLOAD_STAGING_ROOT = os.path.join(BENCHMARK_DIR, 'staging')
@@ -0,0 +1,272 @@
+import math
+import random
+import time
+import uuid
+
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from .metrics import record_cache
+from .payloads import StalePayload, decode, encode
+
+
+# Every cached entry records the generation of the tags it depends on. Bumping a
+# tag's generation makes every entry recorded against an older one a miss, in a
+# single cache write and without having to know which keys exist.
+#
+# Generations are numbers drawn from one sequence shared by all tags, so a
+# rebuild can tell whether any of its tags was invalidated after it started
+# (and its value may predate that write) by comparing them with the sequence
+# as it was when the rebuild started.
+TAG_PREFIX = 'tag:'
+SEQUENCE_KEY = 'tag-sequence'
+
+# Bumped when usernames/names change, i.e. whenever search results may change.
+SEARCH_TAG = 'search'
+
+LOCK_PREFIX = 'lock:'
+# How long a rebuild may hold the lock before another worker may take over.
+LOCK_TIMEOUT = 30
+# How long a request that missed waits for another worker's rebuild before
+# computing the value itself.
+LOCK_WAIT = 2.0
+LOCK_POLL_INTERVAL = 0.05
+# Larger values start refreshing earlier before the entry expires (XFetch beta).
+EARLY_EXPIRY_BETA = 1.0
+
+
+def user_tag(user_id):
+    """
+    A user's own data: user row, profile, their posts and the likes/counts on them.
+    """
+    return f'user:{user_id}'
+
+
+def post_tag(post_id):
+    """
+    A single post and its likes.
+    """
+    return f'post:{post_id}'
+
+
+def follows_tag(user_id):
+    """
+    The set of users `user_id` follows (feeds and suggestions depend on it).
+    """
+    return f'follows:{user_id}'
+
+
+def _sequence():
+    """
+    The last generation handed out, i.e. a snapshot of every tag: a tag
+    invalidated after it was taken has a greater generation.
+
+    The sequence starts from the current time rather than 1, so if it is
+    evicted it can't come back below the generations already handed out.
+    """
+    sequence = cache.get(SEQUENCE_KEY)
+    if sequence is None:
+        cache.add(SEQUENCE_KEY, time.time_ns(), timeout=None)
+        sequence = cache.get(SEQUENCE_KEY, 0)
+    return sequence
+
+
+def _next_generation():
+    try:
+        return cache.incr(SEQUENCE_KEY)
+    except ValueError:
+        # Evicted (or never used): start again from the current time.
+        cache.add(SEQUENCE_KEY, time.time_ns(), timeout=None)
+        return cache.incr(SEQUENCE_KEY)
+
+
+def _tag_versions(tags, snapshot):
+    """
+    Returns the current generation of each tag. Missing ones (never
+    invalidated, or evicted) are created with the `snapshot` generation,
+    which is newer than any entry stored before it was taken.
+    """
+    keys = {TAG_PREFIX + tag: tag for tag in tags}
+    versions = cache.get_many(list(keys))
+    for key in keys.keys() - versions.keys():
+        if not cache.add(key, snapshot, timeout=None):
+            versions[key] = cache.get(key, snapshot)
+        else:
+            versions[key] = snapshot
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def _is_current(versions):
+    """
+    True if none of the tags an entry was stored with has been invalidated since.
+    """
+    current = cache.get_many([TAG_PREFIX + tag for tag in versions])
+    return all(current.get(TAG_PREFIX + tag) == version for tag, version in versions.items())
+
+
+def _store(key, value, tags, snapshot, timeout, stale_timeout=0, delta=0.0):
+    """
+    Stores an entry that is fresh for `timeout` seconds and kept for another
+    `stale_timeout` seconds so it can be served while it is being rebuilt.
+    `snapshot` is the `_sequence()` taken before `value` was computed, and
+    `delta` is how long that took.
+
+    Returns False, storing nothing, if one of `tags` was invalidated since
+    the snapshot: `value` may not include the write behind it.
+    """
+    versions = _tag_versions(tags, snapshot)
+    if any(version > snapshot for version in versions.values()):
+        return False
+    entry = [versions, value, time.time() + timeout, delta]
+    cache.set(key, encode(entry), timeout + stale_timeout)
+    return True
+
+
+def _load(key):
+    """
+    Returns the `[versions, value, expires_at, delta]` entry stored under `key`, or None.
+    """
+    payload = cache.get(key)
+    if payload is None:
+        return None
+    try:
+        return decode(payload)
+    except StalePayload:
+        return None
+
+
+def get_tagged(key, default=None):
+    """
+    Returns the value cached under `key`, or `default` if it is missing or any
+    of the tags it was stored with has been invalidated since.
+    """
+    entry = _load(key)
+    if entry is None or not _is_current(entry[0]):
+        record_cache(hit=False)
+        return default
+    record_cache(hit=True)
+    return entry[1]
+
+
+def set_tagged(key, value, tags, timeout, snapshot=None):
+    """
+    Caches `value` under `key`, depending on `tags`. Pass the `_sequence()`
+    taken before computing `value` as `snapshot`, so it isn't cached if a tag
+    is invalidated in the meantime.
+    """
+    _store(key, value, tags, _sequence() if snapshot is None else snapshot, timeout)
+
+
+def _acquire(key):
+    """
+    Takes the rebuild lock for `key` (a Redis `SET NX EX`), returning its token or None.
+    """
+    token = uuid.uuid4().hex
+    if cache.add(LOCK_PREFIX + key, token, LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def _release(key, token):
+    """
+    Releases the rebuild lock for `key`, unless it expired and someone else took it.
+    """
+    if cache.get(LOCK_PREFIX + key) == token:
+        cache.delete(LOCK_PREFIX + key)
+
+
+def _should_refresh_early(expires_at, delta):
+    """
+    Probabilistic early expiration (XFetch): the closer an entry is to expiring,
+    and the longer it takes to rebuild, the likelier one request refreshes it
+    ahead of time, so popular keys are not all rebuilt the moment they expire.
+    """
+    return time.time() - delta * EARLY_EXPIRY_BETA * math.log(1.0 - random.random()) >= expires_at
+
+
+def refresh(key, loader, args, timeout, stale_timeout, token=None):
+    """
+    Rebuilds the entry for `key` with `loader(*args)` and releases its lock.
+
+    `loader` is the dotted path of a function returning `(value, tags)`.
+    """
+    try:
+        snapshot = _sequence()
+        start = time.monotonic()
+        value, tags = import_string(loader)(*args)
+        _store(key, value, tags, snapshot, timeout, stale_timeout, time.monotonic() - start)
+        return value
+    finally:
+        if token is not None:
+            _release(key, token)
+
+
+def _refresh_in_background(key, loader, args, timeout, stale_timeout, token):
+    from .tasks import refresh_cache_entry
+
+    try:
+        refresh_cache_entry.delay(key, loader, list(args), timeout, stale_timeout, token)
+    except Exception as e:
+        # Broker unavailable: rebuild in this request rather than keep serving stale data.
+        print(f"Could not queue refresh of {key}, refreshing inline: {e}")
+        refresh(key, loader, args, timeout, stale_timeout, token)
+
+
+def get_or_refresh(key, loader, args=(), timeout=60 * 15, stale_timeout=None):
+    """
+    Cache-aside read of `key`, rebuilt with `loader(*args)` when needed.
+
+    `loader` is the dotted path of a module-level function returning
+    `(value, tags)`; `args` must be JSON serializable so a Celery worker can
+    rebuild the entry, and `value` must be made of primitives (see
+    `core.payloads`) since that is what is cached.
+
+    - A fresh entry is returned as is, but may be refreshed in the background
+      slightly before it expires.
+    - An expired entry is kept for another `stale_timeout` seconds (defaults to
+      `timeout`) and returned while a single background task rebuilds it.
+    - A missing or invalidated entry is rebuilt by a single request; others wait
+      for it briefly rather than all running the same query at once.
+    """
+    if stale_timeout is None:
+        stale_timeout = timeout
+
+    entry = _load(key)
+    current = entry is not None and _is_current(entry[0])
+    record_cache(hit=current)
+    if current:
+        versions, value, expires_at, delta = entry
+        if _should_refresh_early(expires_at, delta):
+            token = _acquire(key)
+            if token is not None:
+                _refresh_in_background(key, loader, args, timeout, stale_timeout, token)
+        return value
+
+    # Missing or invalidated: an invalidated value is never served, so users see their own writes.
+    token = _acquire(key)
+    if token is not None:
+        return refresh(key, loader, args, timeout, stale_timeout, token)
+
+    missing = object()
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        value = get_tagged(key, default=missing)
+        if value is not missing:
+            return value
+        if cache.get(LOCK_PREFIX + key) is None:
+            break
+
+    # The rebuild is taking too long (or failed): compute without caching.
+    return import_string(loader)(*args)[0]
+
+
+def invalidate_tags(*tags):
+    """
+    Invalidates every entry stored with any of `tags`, in two cache round
+    trips however many tags there are.
+    """
+    if not tags:
+        return
+    generation = _next_generation()
+    cache.set_many({TAG_PREFIX + tag: generation for tag in set(tags)}, timeout=None)
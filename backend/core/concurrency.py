@@ -0,0 +1,43 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .metrics import instrument_connections
+
+# Independent blocking reads of one request (e.g. the profile, the feed page
+# and the suggestions of the home feed) run side by side on this pool instead
+# of one after the other. Each pool thread has its own database connection,
+# kept for CONN_MAX_AGE like a request's.
+_executor = ThreadPoolExecutor(max_workers=settings.PARALLEL_READ_THREADS, thread_name_prefix='reads')
+
+
+def _run(context, call):
+    # Drop a connection that expired or broke since this thread last used it.
+    close_old_connections()
+    instrument_connections()
+    try:
+        # In a copy of the caller's context, so queries count towards its request's metrics.
+        return context.run(call)
+    finally:
+        close_old_connections()
+
+
+def _submit(call):
+    return _executor.submit(_run, contextvars.copy_context(), call)
+
+
+def run_reads(*calls):
+    """
+    Runs the argument-less `calls` (e.g. `functools.partial`s) concurrently
+    and returns their results in order. The first exception raised by a call
+    is re-raised.
+
+    Only for reads. Inside a transaction they run here, one after the other:
+    the pool's connections wouldn't see its uncommitted writes.
+    """
+    if connection.in_atomic_block:
+        return [call() for call in calls]
+    futures = [_submit(call) for call in calls]
+    return [future.result() for future in futures]
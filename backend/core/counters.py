@@ -0,0 +1,99 @@
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import FollowersCount, LikePost, Post, Profile
+from .ranking import rescore, score_change
+
+
+def _add(queryset, field, delta, **extra):
+    if delta < 0:
+        # Never let a missed increment push the counter below zero.
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta}, **extra)
+
+
+def _by_delta(deltas):
+    """
+    Groups `{key: delta}` into `{delta: [keys]}`, leaving out the keys that net to zero.
+    """
+    grouped = defaultdict(list)
+    for key, delta in deltas.items():
+        if delta:
+            grouped[delta].append(key)
+    return grouped
+
+
+def add_likes(post_ids, delta):
+    """
+    Atomically adds `delta` to the like counters of `post_ids`, and moves their
+    ranking scores accordingly, in a single UPDATE.
+    """
+    _add(Post.objects.filter(pk__in=post_ids), 'like_count', delta, score=F('score') + score_change(delta))
+
+
+def apply_like_deltas(deltas):
+    """
+    Applies `{post_id: delta}` with one UPDATE per distinct delta (usually one).
+    """
+    for delta, post_ids in _by_delta(deltas).items():
+        add_likes(post_ids, delta)
+
+
+def apply_follow_deltas(deltas):
+    """
+    Applies `{(follower_id, user_id): delta}` to the follower/following counters
+    on both ends, with one UPDATE per counter and distinct delta.
+    """
+    followers, following = Counter(), Counter()
+    for (follower_id, user_id), delta in deltas.items():
+        followers[user_id] += delta
+        following[follower_id] += delta
+    for delta, user_ids in _by_delta(followers).items():
+        _add(Profile.objects.filter(user_id__in=user_ids), 'followers_count', delta)
+    for delta, user_ids in _by_delta(following).items():
+        _add(Profile.objects.filter(user_id__in=user_ids), 'following_count', delta)
+
+
+def add_follows(follower_id, user_ids, delta):
+    """
+    Atomically updates the follower/following counters on both ends of the
+    follows from `follower_id` to each of `user_ids`.
+    """
+    apply_follow_deltas({(follower_id, user_id): delta for user_id in user_ids})
+
+
+def _count_of(queryset, group_field):
+    """
+    Correlated `COUNT(*)` subquery over `queryset` grouped by `group_field`.
+    """
+    counts = queryset.values(group_field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts[:1]), Value(0))
+
+
+def reconcile_like_counts():
+    """
+    Recomputes `Post.like_count` (and the score derived from it) from the
+    LikePost rows for every post that drifted. Returns the number of posts fixed.
+    """
+    actual = _count_of(LikePost.objects.filter(post=OuterRef('pk')), 'post')
+    drifted = list(Post.objects.annotate(actual=actual).filter(~Q(like_count=F('actual'))).values_list('pk', flat=True))
+    fixed = Post.objects.filter(pk__in=drifted).update(like_count=actual)
+    rescore(drifted)
+    return fixed
+
+
+def reconcile_follow_counts():
+    """
+    Recomputes `Profile.followers_count`/`following_count` for every profile that drifted.
+    Returns the number of profiles fixed.
+    """
+    followers = _count_of(FollowersCount.objects.filter(user=OuterRef('user')), 'user')
+    following = _count_of(FollowersCount.objects.filter(follower=OuterRef('user')), 'follower')
+    drifted = Profile.objects.annotate(actual_followers=followers, actual_following=following).filter(
+        ~Q(followers_count=F('actual_followers')) | ~Q(following_count=F('actual_following'))
+    )
+    return Profile.objects.filter(pk__in=drifted.values('pk')).update(
+        followers_count=followers, following_count=following,
+    )
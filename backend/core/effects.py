@@ -0,0 +1,253 @@
+import threading
+import weakref
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+
+from .cache import invalidate_tags, user_tag
+from .counters import apply_follow_deltas, apply_like_deltas
+from .models import Post
+
+
+# The side effects of writes (counter updates, cache invalidations, Celery
+# tasks) are not run by the signal handlers that notice them. They are queued
+# on the transaction, merged with the others it queues (the same tag
+# invalidated ten times is invalidated once, ten likes on a post are one
+# UPDATE) and run once, after it commits. Outside a transaction, they run
+# right away.
+#
+# Counters are updated in the committing thread, so a request reads its own
+# likes and follows. The rest runs there too, on a background thread or in a
+# Celery task, depending on `SIDE_EFFECTS` ('inline', 'thread' or 'celery').
+# Counters a crash leaves behind between the commit and its effects are fixed
+# by the `reconcile_counters` command.
+#
+# Effects queued inside a savepoint that is rolled back are dropped, like
+# Django drops its on_commit() callbacks: each savepoint's effects ride on an
+# on_commit() callback of their own (a `_Level`) and are only held weakly
+# otherwise, so the ones Django drops disappear from their batch too.
+
+_local = threading.local()
+# One thread, so effects handed off run in commit order.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='effects')
+
+
+class Effects:
+    """
+    The side effects queued by a transaction (or part of one), merged.
+    """
+    def __init__(self):
+        self.likes = Counter()
+        self.follows = Counter()
+        self.tags = set()
+        # Posts whose author's tag must be invalidated; looked up once on flush.
+        self.post_authors = set()
+        # `{(task, args): None}`: tasks to queue, deduplicated, in order.
+        self.tasks = {}
+        # `{(owner_id, author_id): followed}`: the last follow change wins.
+        self.timelines = {}
+
+    def update(self, other):
+        self.likes.update(other.likes)
+        self.follows.update(other.follows)
+        self.tags |= other.tags
+        self.post_authors |= other.post_authors
+        self.tasks.update(other.tasks)
+        self.timelines.update(other.timelines)
+
+    def calls(self):
+        """
+        The tasks to queue, with the timeline changes grouped by owner.
+        """
+        calls = list(self.tasks)
+        grouped = defaultdict(list)
+        for (owner_id, author_id), followed in self.timelines.items():
+            grouped[owner_id, followed].append(author_id)
+        # Imported here: the tasks module imports this one.
+        from .tasks import backfill_timeline, remove_author_from_timeline
+
+        for (owner_id, followed), author_ids in grouped.items():
+            task = backfill_timeline if followed else remove_author_from_timeline
+            calls.append((task, (owner_id, author_ids)))
+        return calls
+
+
+class _Level(Effects):
+    """
+    The effects queued at one savepoint depth of a transaction. Django calls
+    it after the commit unless that savepoint was rolled back.
+    """
+    def __init__(self, batch):
+        super().__init__()
+        self.batch = batch
+        self.registered = False
+        self.settled = False
+
+    def __call__(self):
+        self.batch.settle(self)
+
+
+class _Batch:
+    """
+    Everything a transaction queued, flushed once when it commits.
+    """
+    def __init__(self, using):
+        self.using = using
+        self.levels = weakref.WeakValueDictionary()
+        self.effects = Effects()
+
+    def level(self):
+        """
+        The `_Level` for the current savepoint, registered on first use.
+        """
+        key = frozenset(connections[self.using].savepoint_ids)
+        level = self.levels.get(key)
+        if level is None or level.settled:
+            level = self.levels[key] = _Level(self)
+        return level
+
+    def settle(self, level):
+        level.settled = True
+        self.effects.update(level)
+        # Levels still waiting to be called are alive in Django's list; the
+        # ones it dropped on a rollback are gone.
+        if any(not other.settled for other in self.levels.values()):
+            return
+        # Effects queued from here on (e.g. by the flush) start a new batch.
+        if _current(self.using) is self:
+            _local.batches.pop(self.using)
+        flush(self.effects)
+
+
+def _current(using):
+    """
+    The batch of the transaction in progress on `using`, if it queued anything.
+    """
+    if not hasattr(_local, 'batches'):
+        _local.batches = {}
+    ref = _local.batches.get(using)
+    return ref() if ref is not None else None
+
+
+def _queue(using, add):
+    """
+    Calls `add(effects)` on the effects pending for the current transaction on `using`.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    batch = _current(using)
+    if batch is None:
+        batch = _Batch(using)
+        _local.batches[using] = weakref.ref(batch)
+    level = batch.level()
+    add(level)
+    if not level.registered:
+        level.registered = True
+        # Runs `level` right away outside a transaction.
+        transaction.on_commit(level, using=using)
+
+
+def count_likes(post_ids, delta, using=None):
+    """
+    Adds `delta` to the like counters of `post_ids` once the transaction commits.
+    """
+    def add(effects):
+        for post_id in post_ids:
+            effects.likes[post_id] += delta
+    _queue(using, add)
+
+
+def count_follows(follower_id, user_ids, delta, using=None):
+    """
+    Adds `delta` to the counters of the follows from `follower_id` to each of `user_ids`.
+    """
+    def add(effects):
+        for user_id in user_ids:
+            effects.follows[follower_id, user_id] += delta
+    _queue(using, add)
+
+
+def invalidate(*tags, using=None):
+    """
+    Invalidates `tags` once the transaction commits.
+    """
+    _queue(using, lambda effects: effects.tags.update(tags))
+
+
+def invalidate_authors(post_ids, using=None):
+    """
+    Invalidates the user tag of the authors of `post_ids`, looked up once for the
+    whole transaction. Posts deleted in it are skipped (deleting a post
+    invalidates its author already).
+    """
+    _queue(using, lambda effects: effects.post_authors.update(post_ids))
+
+
+def delay(task, *args, using=None):
+    """
+    Queues the Celery `task` once the transaction commits; the same task with
+    the same (hashable) arguments is queued once.
+    """
+    _queue(using, lambda effects: effects.tasks.setdefault((task, args)))
+
+
+def sync_timeline(owner_id, author_ids, followed, using=None):
+    """
+    Adds the posts of `author_ids` to the timeline of `owner_id` (or removes
+    them if not `followed`) once the transaction commits. Only the last change
+    for an author counts, and one task is queued per owner.
+    """
+    def add(effects):
+        for author_id in author_ids:
+            effects.timelines[owner_id, author_id] = followed
+    _queue(using, add)
+
+
+def dispatch(tags, post_ids, calls):
+    """
+    Runs the invalidations and queues the tasks of a flushed batch.
+    `calls` are `(task, args)`.
+    """
+    tags = set(tags)
+    if post_ids:
+        author_ids = Post.objects.filter(id__in=post_ids).values_list('user_id', flat=True).distinct()
+        tags.update(user_tag(author_id) for author_id in author_ids)
+    invalidate_tags(*tags)
+    for task, args in calls:
+        task.delay(*args)
+
+
+def _dispatch_in_background(tags, post_ids, calls):
+    close_old_connections()
+    try:
+        dispatch(tags, post_ids, calls)
+    except Exception as e:
+        print(f"Could not apply side effects: {e}")
+    finally:
+        close_old_connections()
+
+
+def flush(effects):
+    """
+    Applies `effects`: counters here, the rest as `SIDE_EFFECTS` says.
+    """
+    apply_like_deltas(effects.likes)
+    apply_follow_deltas(effects.follows)
+    calls = effects.calls()
+    if not (effects.tags or effects.post_authors or calls):
+        return
+
+    mode = settings.SIDE_EFFECTS
+    if mode == 'thread':
+        _executor.submit(_dispatch_in_background, effects.tags, effects.post_authors, calls)
+    elif mode == 'celery':
+        from .tasks import apply_side_effects
+
+        apply_side_effects.delay(
+            sorted(effects.tags),
+            [str(post_id) for post_id in effects.post_authors],
+            [[task.name, list(args)] for task, args in calls],
+        )
+    else:
+        dispatch(effects.tags, effects.post_authors, calls)
@@ -0,0 +1,54 @@
+from django.db.models import prefetch_related_objects
+
+from .models import FollowersCount
+from .pagination import Page, clamp_page_size, decode_offset_cursor, encode_offset_cursor, paginate_by_rank
+from .ranking import ranked_timeline, trending_post_ids, trending_posts
+from .timeline import read_timeline
+
+
+# Feed orders: newest first, or ranked by engagement (see `core.ranking`).
+LATEST = 'latest'
+TOP = 'top'
+FEED_ORDERS = (LATEST, TOP)
+
+
+def get_trending_feed(limit=None, cursor=None, selected=None):
+    """
+    Returns one page of the global trending list.
+    """
+    limit = clamp_page_size(limit)
+    offset = decode_offset_cursor(cursor) if cursor else 0
+    post_ids = trending_post_ids()
+    # Only the posts of the requested page are loaded.
+    posts = trending_posts(post_ids[offset:offset + limit], selected)
+    prefetch_related_objects(posts, 'likes')
+    has_next = len(post_ids) > offset + limit
+    next_cursor = encode_offset_cursor(offset + limit) if has_next else None
+    return Page(posts, has_next, next_cursor, offset=offset)
+
+
+def get_home_feed(user, limit=None, cursor=None, order=LATEST, selected=None):
+    """
+    Returns one page of the home feed for `user`: posts from the users they
+    follow, newest first (`order=LATEST`, keyset-paginated on `(created_at, id)`)
+    or best first (`order=TOP`, keyset-paginated on `(rank, id)`).
+
+    Posts are read from the user's precomputed timeline (see `core.timeline`),
+    so the cost of a page does not depend on how many users they follow.
+
+    Users who don't follow anyone get the trending posts instead, so a new
+    account still sees something.
+
+    Posts are read with only the columns the GraphQL operation `selected`
+    (see `core.projection`) needs, or those of the REST representation if it
+    is None; never with their authors' password hashes.
+    """
+    if not FollowersCount.objects.filter(follower=user).exists():
+        return get_trending_feed(limit, cursor, selected)
+
+    if order == TOP:
+        page = paginate_by_rank(ranked_timeline(user, selected), limit, cursor)
+        prefetch_related_objects(page.items, 'likes')
+        return page
+
+    return read_timeline(user, limit, cursor, selected)
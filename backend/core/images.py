@@ -0,0 +1,78 @@
+import io
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .media import store_blob
+
+
+# Every post image is re-encoded into these widths (never upscaled), so clients
+# can pick the smallest one that fits instead of downloading the original.
+VARIANT_WIDTHS = {
+    'thumb': 320,
+    'feed': 720,
+    'full': 1600,
+}
+VARIANT_FORMAT = 'WEBP'
+VARIANT_EXTENSION = 'webp'
+VARIANT_QUALITY = 80
+# Variants are stored by `core.media` under this prefix, named after a hash of their bytes.
+VARIANT_DIR = 'variants'
+
+
+def _encode(image, width):
+    """
+    Returns `image` scaled down to `width` (if wider) and encoded as WebP.
+    No EXIF or other metadata is written.
+    """
+    if image.width > width:
+        image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+    return image.size, out.getvalue()
+
+
+def build_variants(fileobj):
+    """
+    Decodes the image in `fileobj` and stores its resized variants.
+
+    Returns `{name: {'path', 'url', 'width', 'height'}}` for each of
+    `VARIANT_WIDTHS`. Files are content-addressed (see `core.media`), so
+    variants identical to a smaller one, or to those of an image uploaded
+    before, are stored once and shared. Save them on the post in the same
+    transaction.
+    """
+    with Image.open(fileobj) as original:
+        # JPEGs can be decoded at a reduced scale, which is much cheaper than decoding in full.
+        original.draft('RGB', (max(VARIANT_WIDTHS.values()),) * 2)
+        # Apply the EXIF orientation, since the EXIF data itself is dropped.
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+        variants = {}
+        stored = {}
+        for name, width in sorted(VARIANT_WIDTHS.items(), key=lambda item: item[1]):
+            (variant_width, variant_height), data = _encode(image, width)
+            if data not in stored:
+                # Small originals give identical variants: store those once.
+                stored[data] = store_blob(data, VARIANT_EXTENSION, VARIANT_DIR)
+            path = stored[data]
+            variants[name] = {
+                'path': path,
+                'url': settings.MY_DOMAIN + default_storage.url(path),
+                'width': variant_width,
+                'height': variant_height,
+            }
+    return variants
+
+
+def srcset(variants):
+    """
+    Formats variants as an HTML `srcset` attribute, smallest first.
+    """
+    seen = {}
+    for variant in sorted((variants or {}).values(), key=lambda variant: variant['width']):
+        seen.setdefault(variant['url'], variant['width'])
+    return ', '.join(f'{url} {width}w' for url, width in seen.items())
@@ -0,0 +1,186 @@
+from collections import defaultdict
+
+from .models import FollowersCount, LikePost, Post, Profile, User
+from .projection import project, selected_fields
+
+
+class BatchLoader:
+    """
+    Per-request loader that turns many lookups by key into one `IN (...)` query.
+
+    graphene-django runs resolvers synchronously, so there is no event-loop tick
+    to collect keys on. Instead, whoever produces a list of objects `enqueue()`s
+    the keys their children are going to ask for, and the first `load()` fetches
+    every pending key at once. A `load()` for a key nobody enqueued still works,
+    it just costs a query of its own.
+    """
+    def __init__(self, loaders):
+        self.loaders = loaders
+        self._cache = {}
+        self._queue = set()
+
+    def batch_load(self, keys):
+        """
+        Returns a dict of the values found for `keys`.
+        """
+        raise NotImplementedError
+
+    def default(self):
+        return None
+
+    def prime(self, key, value):
+        self._cache.setdefault(key, value)
+        self._queue.discard(key)
+
+    def enqueue(self, keys):
+        self._queue.update(key for key in keys if key not in self._cache)
+
+    def load(self, key):
+        if key not in self._cache:
+            keys, self._queue = self._queue | {key}, set()
+            found = self.batch_load(keys)
+            for k in keys:
+                self._cache[k] = found[k] if k in found else self.default()
+        return self._cache[key]
+
+
+class UserLoader(BatchLoader):
+    def batch_load(self, keys):
+        # Profiles come along in the same query when the operation asks for them.
+        queryset, _ = project(User.objects.filter(id__in=keys), self.loaders.selected, related=('profile',))
+        users = {user.id: user for user in queryset}
+        self.loaders.expect_users(users)
+        return users
+
+
+class ProfileByUserLoader(BatchLoader):
+    def batch_load(self, keys):
+        queryset, joined = project(Profile.objects.filter(user_id__in=keys), self.loaders.selected, related=('user',))
+        profiles = {profile.user_id: profile for profile in queryset}
+        if joined:
+            self.loaders.expect_profiles(profiles.values())
+        return profiles
+
+
+class PostsByUserLoader(BatchLoader):
+    def default(self):
+        return []
+
+    def batch_load(self, keys):
+        posts = defaultdict(list)
+        queryset, _ = project(Post.objects.filter(user_id__in=keys).order_by('-created_at', '-id'), self.loaders.selected)
+        for post in queryset:
+            posts[post.user_id].append(post)
+        self.loaders.likes.enqueue(post.id for user_posts in posts.values() for post in user_posts)
+        return posts
+
+
+class LikesByPostLoader(BatchLoader):
+    def default(self):
+        return []
+
+    def batch_load(self, keys):
+        likes = defaultdict(list)
+        queryset, joined = project(LikePost.objects.filter(post_id__in=keys), self.loaders.selected, related=('user', 'post'))
+        for like in queryset:
+            likes[like.post_id].append(like)
+        if 'user' in joined:
+            self.loaders.expect_users({like.user_id: like.user for post_likes in likes.values() for like in post_likes})
+        else:
+            self.loaders.users.enqueue(like.user_id for post_likes in likes.values() for like in post_likes)
+        return likes
+
+
+class IsFollowingLoader(BatchLoader):
+    """
+    Answers "does the current user follow this user id?" for a batch of ids.
+    """
+    def default(self):
+        return False
+
+    def batch_load(self, keys):
+        user = self.loaders.user
+        if not user.is_authenticated:
+            return {}
+        followed = FollowersCount.objects.filter(follower=user, user_id__in=keys).values_list('user_id', flat=True)
+        return {user_id: True for user_id in followed}
+
+
+class Loaders:
+    """
+    The set of loaders for one GraphQL request, see `get_loaders`.
+
+    Follower/following counts are plain columns on Profile, so they come for
+    free with the profile row and need no loader of their own.
+
+    `selected` holds the fields the operation asks for (see `core.projection`),
+    and the loaders read only the columns those need.
+    """
+    def __init__(self, user, selected=None):
+        self.user = user
+        self.selected = selected if selected is not None else {}
+        self.users = UserLoader(self)
+        self.profiles = ProfileByUserLoader(self)
+        self.posts_by_user = PostsByUserLoader(self)
+        self.likes = LikesByPostLoader(self)
+        self.is_following = IsFollowingLoader(self)
+
+    def expect_users(self, users):
+        """
+        Registers already loaded users and queues the lookups their fields will need.
+        """
+        for user_id, user in users.items():
+            self.users.prime(user_id, user)
+            if User.profile.is_cached(user):
+                self.profiles.prime(user_id, getattr(user, 'profile', None))
+        self.profiles.enqueue(users)
+        self.posts_by_user.enqueue(users)
+        self.is_following.enqueue(users)
+
+    def expect_posts(self, posts):
+        """
+        Same as `expect_users`, for a list of posts about to be resolved.
+        """
+        users = {}
+        for post in posts:
+            if Post.user.is_cached(post):
+                users[post.user_id] = post.user
+            else:
+                self.users.enqueue([post.user_id])
+            prefetched = getattr(post, '_prefetched_objects_cache', {})
+            if 'likes' in prefetched:
+                self.likes.prime(post.id, list(prefetched['likes']))
+                for like in prefetched['likes']:
+                    if LikePost.user.is_cached(like):
+                        users[like.user_id] = like.user
+                    else:
+                        self.users.enqueue([like.user_id])
+            else:
+                self.likes.enqueue([post.id])
+        self.expect_users(users)
+
+    def expect_profiles(self, profiles):
+        """
+        Same as `expect_users`, for a list of profiles about to be resolved.
+        """
+        users = {}
+        for profile in profiles:
+            self.profiles.prime(profile.user_id, profile)
+            if Profile.user.is_cached(profile):
+                users[profile.user_id] = profile.user
+            else:
+                self.users.enqueue([profile.user_id])
+        self.is_following.enqueue(profile.user_id for profile in profiles)
+        self.expect_users(users)
+
+
+def get_loaders(info):
+    """
+    Returns the loaders for the current request, creating them on first use.
+    """
+    context = info.context
+    loaders = getattr(context, '_graphql_loaders', None)
+    if loaders is None:
+        loaders = Loaders(context.user, selected_fields(info))
+        context._graphql_loaders = loaders
+    return loaders
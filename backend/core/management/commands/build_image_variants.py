@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from core.models import Post
+from core.tasks import publish_post_image
+
+
+class Command(BaseCommand):
+    help = "Builds the resized image variants of posts uploaded before they existed."
+
+    def handle(self, *args, **options):
+        prefix = settings.MY_DOMAIN + settings.MEDIA_URL
+        built = skipped = 0
+        for post in Post.objects.filter(image_variants={}).exclude(image='').iterator():
+            # Post images are stored as absolute URLs into the media storage.
+            name = post.image.name
+            path = name[len(prefix):] if name.startswith(prefix) else name
+            try:
+                with default_storage.open(path, 'rb') as original:
+                    publish_post_image(post, original)
+                built += 1
+            except Exception as e:
+                self.stderr.write(f"Skipping post {post.id}: {e}")
+                skipped += 1
+        self.stdout.write(self.style.SUCCESS(f"Built variants for {built} posts, skipped {skipped}."))
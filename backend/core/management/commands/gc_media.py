@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.media import collect_garbage, reconcile_references
+
+
+class Command(BaseCommand):
+    help = "Recounts the references to stored media files and deletes the unreferenced ones."
+
+    def handle(self, *args, **options):
+        fixed = reconcile_references()
+        deleted = collect_garbage()
+        self.stdout.write(self.style.SUCCESS(
+            f"Fixed reference counts on {fixed} files and deleted {deleted} unreferenced files."
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core.models import User
+from core.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the materialized home timelines from the follow graph."
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Only rebuild these users' timelines.")
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        count = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            rebuild_timeline(user_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} timelines."))
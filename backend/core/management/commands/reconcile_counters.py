@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import reconcile_follow_counts, reconcile_like_counts
+
+
+class Command(BaseCommand):
+    help = "Recomputes the denormalized like/follower/following counters and fixes any drift."
+
+    def handle(self, *args, **options):
+        posts = reconcile_like_counts()
+        profiles = reconcile_follow_counts()
+        self.stdout.write(self.style.SUCCESS(
+            f"Fixed like counts on {posts} posts and follow counts on {profiles} profiles."
+        ))
@@ -0,0 +1,203 @@
+import hashlib
+import os
+import re
+import uuid
+import weakref
+from collections import Counter
+
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+
+from .models import MediaBlob, Post, Profile
+
+
+# Media files are content-addressed: a file's name is the SHA-256 of its bytes,
+# so the same image uploaded twice is stored once, and a name always refers to
+# the same bytes (which is what makes far-future cache headers safe).
+# `MediaBlob` rows count the posts/profiles referencing each file: the counts
+# follow `Post.image_variants` and `Profile.profileimg` through signals, so a
+# stored blob must be assigned to one of them in the same transaction.
+
+# Blobs never change, so browsers and CDNs may keep them forever without revalidating.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Older files (e.g. the default profile picture) can be replaced in place.
+MUTABLE_CACHE_CONTROL = 'public, max-age=3600'
+_BLOB_NAME = re.compile(r'^[0-9a-f]{64}\.\w+$')
+
+
+def _digest(content):
+    sha = hashlib.sha256()
+    if isinstance(content, bytes):
+        sha.update(content)
+    else:
+        content.seek(0)
+        for chunk in content.chunks():
+            sha.update(chunk)
+        content.seek(0)
+    return sha.hexdigest()
+
+
+def store_blob(content, ext, prefix):
+    """
+    Stores `content` (bytes or a File) under its hash, unless an identical file
+    already is, and returns the storage path.
+
+    Call it in a transaction that also saves the path on a post or profile:
+    the blob row stays locked until then, so it can't be collected before
+    that reference is counted.
+    """
+    digest = _digest(content)
+    path = f'{prefix}/{digest[:2]}/{digest}.{ext}'
+
+    with transaction.atomic():
+        # The row lock serializes this with `collect_garbage` deleting the same file.
+        blob, created = MediaBlob.objects.select_for_update().get_or_create(
+            path=path, defaults={'size': len(content) if isinstance(content, bytes) else content.size},
+        )
+        if created or not default_storage.exists(path):
+            file = ContentFile(content) if isinstance(content, bytes) else File(content)
+            # Written under a name of its own and moved into place on commit,
+            # so a rolled back transaction leaves no file without a row.
+            _promote_on_commit(default_storage.save(f'{path}.{uuid.uuid4().hex}.tmp', file), path)
+    return path
+
+
+def _promote_on_commit(temp_path, path):
+    """
+    Moves the file at `temp_path` to `path` once the transaction commits, or
+    deletes it if the transaction is rolled back.
+    """
+    promoted = []
+
+    def promote():
+        promoted.append(path)
+        # Replaces any copy that appeared concurrently: it has the same bytes.
+        os.replace(default_storage.path(temp_path), default_storage.path(path))
+
+    # Django drops the on_commit() callbacks of a rolled back transaction, so
+    # `promote` is then collected without having run.
+    weakref.finalize(promote, _discard_unless_promoted, temp_path, promoted)
+    transaction.on_commit(promote)
+
+
+def _discard_unless_promoted(temp_path, promoted):
+    if not promoted:
+        default_storage.delete(temp_path)
+
+
+def store_upload(upload, prefix):
+    """
+    `store_blob` for an uploaded file, keeping its extension.
+    """
+    ext = os.path.splitext(upload.name)[1].lstrip('.').lower() or 'bin'
+    return store_blob(upload, 'jpg' if ext == 'jpeg' else ext, prefix)
+
+
+def acquire(paths):
+    """
+    Takes one reference to each of `paths` that is a blob.
+    """
+    paths = set(path for path in paths if path)
+    if paths:
+        MediaBlob.objects.filter(path__in=paths).update(ref_count=F('ref_count') + 1)
+
+
+def release(paths):
+    """
+    Drops one reference to each of `paths`; files nobody references any more
+    are deleted once the transaction commits. Paths that aren't blobs (e.g. the
+    default profile picture) are ignored.
+    """
+    paths = set(path for path in paths if path)
+    if not paths:
+        return
+    MediaBlob.objects.filter(path__in=paths, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    transaction.on_commit(lambda: collect_garbage(paths))
+
+
+def collect_garbage(paths=None):
+    """
+    Deletes the unreferenced blobs among `paths` (all of them if None), file and row.
+    Returns the number deleted.
+    """
+    unreferenced = MediaBlob.objects.filter(ref_count=0)
+    if paths is not None:
+        unreferenced = unreferenced.filter(path__in=paths)
+
+    deleted = 0
+    for path in unreferenced.values_list('path', flat=True):
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(path=path, ref_count=0).first()
+            if blob is None:
+                # Referenced again in the meantime.
+                continue
+            default_storage.delete(path)
+            blob.delete()
+            deleted += 1
+    return deleted
+
+
+def variant_paths(variants):
+    """
+    The distinct storage paths used by a post's `image_variants`.
+    """
+    return {variant['path'] for variant in (variants or {}).values() if 'path' in variant}
+
+
+def referenced_paths(instance):
+    """
+    The storage paths a post or profile references, as counted in `MediaBlob`.
+    """
+    if isinstance(instance, Post):
+        return variant_paths(instance.image_variants)
+    return {instance.profileimg.name} if instance.profileimg else set()
+
+
+def stored_paths(instance):
+    """
+    `referenced_paths` of the saved version of `instance`, read from the database.
+    """
+    if isinstance(instance, Post):
+        saved = Post.objects.filter(pk=instance.pk).values_list('image_variants', flat=True).first()
+        return variant_paths(saved)
+    saved = Profile.objects.filter(pk=instance.pk).values_list('profileimg', flat=True).first()
+    return {saved} if saved else set()
+
+
+def reconcile_references():
+    """
+    Recomputes every blob's reference count from the posts and profiles, fixing
+    drift (e.g. rows changed with `update()`, which sends no signals). Returns
+    the number of blobs whose count changed.
+    """
+    counts = Counter()
+    for variants in Post.objects.exclude(image_variants={}).values_list('image_variants', flat=True).iterator():
+        counts.update(variant_paths(variants))
+    counts.update(Profile.objects.values_list('profileimg', flat=True).iterator())
+
+    fixed = []
+    for blob in MediaBlob.objects.only('id', 'path', 'ref_count').iterator():
+        if blob.ref_count != counts[blob.path]:
+            blob.ref_count = counts[blob.path]
+            fixed.append(blob)
+    MediaBlob.objects.bulk_update(fixed, ['ref_count'], batch_size=1000)
+    return len(fixed)
+
+
+def is_blob(path):
+    """
+    Whether `path` is named after the hash of its bytes, i.e. can never change.
+    """
+    return bool(_BLOB_NAME.match(os.path.basename(path)))
+
+
+def file_etag(path, stat):
+    """
+    A strong ETag for the media file at `path`: its hash for blobs, otherwise
+    its modification time and size.
+    """
+    if is_blob(path):
+        return '"%s"' % os.path.basename(path).split('.', 1)[0]
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,311 @@
+import bisect
+import contextvars
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Per-request instrumentation: `MetricsMiddleware` counts the SQL queries (and
+# their time), cache hits and misses, and timed sections such as serialization
+# of every request, and `GraphQLMetricsMiddleware` does the same per top-level
+# GraphQL field. Each request's numbers go out in a `Server-Timing` header
+# (shown in the browser's network panel) and are added to process-wide totals
+# served in Prometheus' text format at /metrics.
+#
+# The totals live in each process: behind gunicorn, every worker reports its
+# own, and Prometheus should scrape (or sum) them per instance.
+
+# Upper bounds of the request duration histogram, in seconds.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = contextvars.ContextVar('request_stats', default=None)
+# Collapses the literal lists of `IN (...)` so the same query over a different
+# number of ids counts as one shape.
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+class RequestStats:
+    """
+    What one request spent its time on.
+
+    `run_reads` workers record into their request's stats from other threads,
+    so every update goes through a method holding `lock`.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.query_shapes = Counter()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # {name: seconds} for sections measured with `timed()`
+        self.timings = defaultdict(float)
+        # {field: (seconds, queries)} for top-level GraphQL fields
+        self.fields = {}
+
+    def record_query(self, sql, duration):
+        shape = _IN_LIST.sub('IN (...)', sql)
+        with self.lock:
+            self.queries += 1
+            self.query_time += duration
+            self.query_shapes[shape] += 1
+
+    def record_cache(self, hit):
+        with self.lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def record_timing(self, name, seconds):
+        with self.lock:
+            self.timings[name] += seconds
+
+    def record_field(self, field, seconds, queries):
+        with self.lock:
+            total, count = self.fields.get(field, (0.0, 0))
+            self.fields[field] = (total + seconds, count + queries)
+
+    def repeated_queries(self, threshold):
+        """
+        Query shapes run at least `threshold` times: the signature of an N+1.
+        """
+        with self.lock:
+            return {sql: count for sql, count in self.query_shapes.items() if count >= threshold}
+
+
+def current():
+    """
+    The stats of the request being handled, or None outside of one.
+    """
+    return _current.get()
+
+
+def record_cache(hit):
+    """
+    Counts a cache lookup against the current request and the process totals.
+    """
+    stats = _current.get()
+    if stats is not None:
+        stats.record_cache(hit)
+    registry.inc('cache_requests_total', {'result': 'hit' if hit else 'miss'})
+
+
+@contextmanager
+def timed(name):
+    """
+    Adds the time spent in the block to the current request's `name` timing.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.record_timing(name, time.perf_counter() - start)
+
+
+def _query_recorder(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record_query(sql, time.perf_counter() - start)
+
+
+def instrument_connections():
+    """
+    Installs the query recorder on this thread's connections. It stays there,
+    and does nothing outside of `collect()`.
+    """
+    for connection in connections.all():
+        if _query_recorder not in connection.execute_wrappers:
+            connection.execute_wrappers.append(_query_recorder)
+
+
+@contextmanager
+def collect():
+    """
+    Records the queries, cache lookups and timings made in the block into a
+    new `RequestStats`, which it yields.
+    """
+    instrument_connections()
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+class Registry:
+    """
+    Process-wide counters and histograms, rendered in Prometheus' text format.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.help = {}
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, labels, value, buckets=DURATION_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            counts, total = self.histograms.get(key, ([0] * (len(buckets) + 1), 0.0))
+            counts[bisect.bisect_left(buckets, value)] += 1
+            self.histograms[key] = (counts, total + value)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(counts), total)) for key, (counts, total) in self.histograms.items())
+
+        def labels(pairs, extra=()):
+            pairs = list(pairs) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+            return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+        described = set()
+
+        def header(name):
+            if name not in described and name in self.help:
+                kind, text = self.help[name]
+                lines.extend([f'# HELP {name} {text}', f'# TYPE {name} {kind}'])
+            described.add(name)
+
+        for (name, pairs), value in counters:
+            header(name)
+            lines.append(f'{name}{labels(pairs)} {value:g}')
+        for (name, pairs), (counts, total) in histograms:
+            header(name)
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{labels(pairs, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{labels(pairs)} {total:g}')
+            lines.append(f'{name}_count{labels(pairs)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+registry.describe('http_requests_total', 'counter', 'Requests handled, by route, method and status.')
+registry.describe('http_request_duration_seconds', 'histogram', 'Time to handle a request, by route.')
+registry.describe('db_queries_total', 'counter', 'SQL queries run, by route.')
+registry.describe('db_query_duration_seconds_total', 'counter', 'Time spent in SQL queries, by route.')
+registry.describe('cache_requests_total', 'counter', 'Cache lookups, by result.')
+registry.describe('section_duration_seconds_total', 'counter', 'Time spent in timed sections (e.g. serialization), by route.')
+registry.describe('graphql_field_duration_seconds_total', 'counter', 'Time spent resolving top-level GraphQL fields.')
+registry.describe('graphql_field_queries_total', 'counter', 'SQL queries run by top-level GraphQL fields.')
+registry.describe('n_plus_one_total', 'counter', 'Requests that repeated a query shape N_PLUS_ONE_THRESHOLD times or more.')
+
+
+def server_timing(stats, total):
+    """
+    Formats a request's stats as a `Server-Timing` header value.
+    """
+    entries = [
+        f'db;dur={stats.query_time * 1000:.1f};desc="{stats.queries} queries"',
+        f'cache;desc="{stats.cache_hits} hits, {stats.cache_misses} misses"',
+    ]
+    entries += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in stats.timings.items()]
+    entries += [
+        f'gql.{field};dur={seconds * 1000:.1f};desc="{queries} queries"'
+        for field, (seconds, queries) in stats.fields.items()
+    ]
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class MetricsMiddleware:
+    """
+    Collects the stats of every request, adds them to the process totals and,
+    with `SERVER_TIMING` on, to the response as a `Server-Timing` header.
+
+    With `METRICS_DETECT_N_PLUS_ONE` on, requests running the same query shape
+    `N_PLUS_ONE_THRESHOLD` times or more are logged.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect() as stats:
+            response = self.get_response(request)
+        total = time.perf_counter() - stats.started
+
+        match = getattr(request, 'resolver_match', None)
+        route = '/' + match.route if match is not None else 'unmatched'
+        registry.inc('http_requests_total', {'route': route, 'method': request.method, 'status': str(response.status_code)})
+        registry.observe('http_request_duration_seconds', {'route': route}, total)
+        registry.inc('db_queries_total', {'route': route}, stats.queries)
+        registry.inc('db_query_duration_seconds_total', {'route': route}, stats.query_time)
+        for name, seconds in stats.timings.items():
+            registry.inc('section_duration_seconds_total', {'route': route, 'section': name}, seconds)
+
+        if settings.METRICS_DETECT_N_PLUS_ONE:
+            repeated = stats.repeated_queries(settings.N_PLUS_ONE_THRESHOLD)
+            if repeated:
+                registry.inc('n_plus_one_total', {'route': route})
+                for sql, count in repeated.items():
+                    print(f"[N+1] {request.method} {request.path}: {count} x {sql}")
+
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = server_timing(stats, total)
+        return response
+
+
+class GraphQLMetricsMiddleware:
+    """
+    Graphene middleware timing each top-level field, with the queries it ran.
+
+    Fields resolved through DataLoaders finish their batched queries after the
+    resolver returns, so their cost shows up on the request, not the field.
+    """
+    def resolve(self, next, root, info, **args):
+        stats = _current.get()
+        if stats is None or info.path.prev is not None:
+            return next(root, info, **args)
+
+        start, queries = time.perf_counter(), stats.queries
+        try:
+            return next(root, info, **args)
+        finally:
+            duration, ran = time.perf_counter() - start, stats.queries - queries
+            stats.record_field(info.field_name, duration, ran)
+            registry.inc('graphql_field_duration_seconds_total', {'field': info.field_name}, duration)
+            registry.inc('graphql_field_queries_total', {'field': info.field_name}, ran)
+
+
+def metrics_view(request):
+    """
+    The process totals in Prometheus' text exposition format.
+
+    With `METRICS_TOKEN` set, requires `Authorization: Bearer <token>`;
+    without it, only answers requests from `METRICS_ALLOWED_IPS`.
+    """
+    if settings.METRICS_TOKEN:
+        allowed = request.headers.get('Authorization') == f'Bearer {settings.METRICS_TOKEN}'
+    else:
+        allowed = request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
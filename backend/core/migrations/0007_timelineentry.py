@@ -0,0 +1,88 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+TIMELINE_DEPTH = 800
+
+
+def build_timelines(apps, schema_editor):
+    """
+    Materializes the timelines of existing users from the current follow graph.
+    """
+    User = apps.get_model("core", "User")
+    Post = apps.get_model("core", "Post")
+    FollowersCount = apps.get_model("core", "FollowersCount")
+    TimelineEntry = apps.get_model("core", "TimelineEntry")
+
+    for owner_id in User.objects.values_list("id", flat=True).iterator():
+        following = FollowersCount.objects.filter(follower_id=owner_id).values(
+            "user_id"
+        )
+        posts = (
+            Post.objects.filter(user_id__in=following)
+            .order_by("-created_at", "-id")
+            .values_list("id", "created_at")[:TIMELINE_DEPTH]
+        )
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(owner_id=owner_id, post_id=post_id, created_at=created_at)
+                for post_id, created_at in posts
+            ]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_alter_post_image"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TimelineEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField()),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="timeline",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "post",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="core.post",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["owner", "-created_at", "-post"],
+                        name="timeline_owner_created_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("owner", "post"), name="unique_timeline_entry"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(build_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_of(queryset, group_field):
+    counts = queryset.values(group_field).annotate(total=Count("pk")).values("total")
+    return Coalesce(Subquery(counts[:1]), Value(0))
+
+
+def populate_counters(apps, schema_editor):
+    """
+    Fills the new counter columns from the existing LikePost/FollowersCount rows.
+    """
+    Post = apps.get_model("core", "Post")
+    Profile = apps.get_model("core", "Profile")
+    LikePost = apps.get_model("core", "LikePost")
+    FollowersCount = apps.get_model("core", "FollowersCount")
+
+    Post.objects.update(
+        like_count=count_of(LikePost.objects.filter(post=OuterRef("pk")), "post")
+    )
+    Profile.objects.update(
+        followers_count=count_of(
+            FollowersCount.objects.filter(user=OuterRef("user")), "user"
+        ),
+        following_count=count_of(
+            FollowersCount.objects.filter(follower=OuterRef("user")), "follower"
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_timelineentry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="followers_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="following_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:39
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_of(queryset, group_field):
+    counts = queryset.values(group_field).annotate(total=Count("pk")).values("total")
+    return Coalesce(Subquery(counts[:1]), Value(0))
+
+
+def remove_duplicates(apps, schema_editor):
+    """
+    Drops duplicate likes/follows (keeping the oldest row) so the unique
+    constraints can be added, then recounts the denormalized counters.
+    """
+    Post = apps.get_model("core", "Post")
+    Profile = apps.get_model("core", "Profile")
+    LikePost = apps.get_model("core", "LikePost")
+    FollowersCount = apps.get_model("core", "FollowersCount")
+
+    for model, fields in (
+        (LikePost, ("post", "user")),
+        (FollowersCount, ("follower", "user")),
+    ):
+        duplicates = (
+            model.objects.values(*fields)
+            .annotate(rows=Count("pk"), keep=Min("pk"))
+            .filter(rows__gt=1)
+        )
+        for duplicate in duplicates:
+            model.objects.filter(**{f: duplicate[f] for f in fields}).exclude(
+                pk=duplicate["keep"]
+            ).delete()
+
+    Post.objects.update(
+        like_count=count_of(LikePost.objects.filter(post=OuterRef("pk")), "post")
+    )
+    Profile.objects.update(
+        followers_count=count_of(
+            FollowersCount.objects.filter(user=OuterRef("user")), "user"
+        ),
+        following_count=count_of(
+            FollowersCount.objects.filter(follower=OuterRef("user")), "follower"
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_denormalized_counters"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="followerscount",
+            index=models.Index(
+                fields=["user", "follower"], name="follow_user_follower_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["user", "-created_at"], name="post_user_created_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="followerscount",
+            constraint=models.UniqueConstraint(
+                fields=("follower", "user"), name="unique_follow"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="likepost",
+            constraint=models.UniqueConstraint(
+                fields=("post", "user"), name="unique_like"
+            ),
+        ),
+    ]
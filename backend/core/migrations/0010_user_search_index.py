@@ -0,0 +1,81 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:02
+
+from django.db import migrations
+
+# Trigram GIN indexes matching the UPPER(col::text) expressions Django emits for
+# icontains/istartswith, so substring search no longer scans core_user.
+POSTGRES_COLUMNS = ("username", "first_name", "last_name")
+
+# FTS5 table with the trigram tokenizer (SQLite >= 3.34), kept in sync with
+# core_user by triggers. It indexes the table's rowid, not the UUID primary key.
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE core_user_search USING fts5(
+        username, first_name, last_name,
+        content='core_user', content_rowid='rowid', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER core_user_search_ai AFTER INSERT ON core_user BEGIN
+        INSERT INTO core_user_search(rowid, username, first_name, last_name)
+        VALUES (new.rowid, new.username, new.first_name, new.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER core_user_search_ad AFTER DELETE ON core_user BEGIN
+        INSERT INTO core_user_search(core_user_search, rowid, username, first_name, last_name)
+        VALUES ('delete', old.rowid, old.username, old.first_name, old.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER core_user_search_au AFTER UPDATE ON core_user BEGIN
+        INSERT INTO core_user_search(core_user_search, rowid, username, first_name, last_name)
+        VALUES ('delete', old.rowid, old.username, old.first_name, old.last_name);
+        INSERT INTO core_user_search(rowid, username, first_name, last_name)
+        VALUES (new.rowid, new.username, new.first_name, new.last_name);
+    END
+    """,
+    "INSERT INTO core_user_search(core_user_search) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS core_user_search_au",
+    "DROP TRIGGER IF EXISTS core_user_search_ad",
+    "DROP TRIGGER IF EXISTS core_user_search_ai",
+    "DROP TABLE IF EXISTS core_user_search",
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for column in POSTGRES_COLUMNS:
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS core_user_{column}_trgm "
+                f"ON core_user USING gin ((UPPER({column}::text)) gin_trgm_ops)"
+            )
+    elif vendor == "sqlite":
+        for statement in SQLITE_FORWARD:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        for column in POSTGRES_COLUMNS:
+            schema_editor.execute(f"DROP INDEX IF EXISTS core_user_{column}_trgm")
+    elif vendor == "sqlite":
+        for statement in SQLITE_BACKWARD:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0009_unique_likes_follows_and_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:50
+
+import math
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+# Frozen copy of the formula in core.ranking at the time of this migration.
+SCORE_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+DECAY_SECONDS = 45000
+
+
+def populate_scores(apps, schema_editor):
+    """
+    Scores the existing posts from their like counts and creation dates.
+    """
+    Post = apps.get_model("core", "Post")
+    posts = []
+    for post in Post.objects.only("id", "like_count", "created_at").iterator(
+        chunk_size=1000
+    ):
+        post.score = (
+            math.log10(1 + post.like_count)
+            + (post.created_at - SCORE_EPOCH).total_seconds() / DECAY_SECONDS
+        )
+        posts.append(post)
+        if len(posts) == 1000:
+            Post.objects.bulk_update(posts, ["score"])
+            posts = []
+    Post.objects.bulk_update(posts, ["score"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0010_user_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="score",
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(populate_scores, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["-score"], name="post_score_idx"),
+        ),
+    ]
@@ -0,0 +1,62 @@
+from importlib import import_module
+
+from django.db import migrations
+
+# Re-keys the SQLite search index of 0010 on the users' UUIDs. The FTS5 table
+# indexed core_user's implicit rowid, which VACUUM and Django's table remakes
+# (any later AlterField on User) are free to change. Rows of the index now get
+# ids of their own, mapped to the user ids by core_user_search_ids.
+#
+# The triggers keeping the index in sync, and its contents, are created by
+# `core.search.ensure_sqlite_index` after every migrate, since a table remake
+# drops the triggers of core_user.
+SQLITE_FORWARD = [
+    "DROP TRIGGER IF EXISTS core_user_search_au",
+    "DROP TRIGGER IF EXISTS core_user_search_ad",
+    "DROP TRIGGER IF EXISTS core_user_search_ai",
+    "DROP TABLE IF EXISTS core_user_search",
+    """
+    CREATE TABLE core_user_search_ids (
+        id INTEGER PRIMARY KEY,
+        user_id char(32) NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE core_user_search USING fts5(
+        username, first_name, last_name, tokenize='trigram'
+    )
+    """,
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS core_user_search_au",
+    "DROP TRIGGER IF EXISTS core_user_search_ad",
+    "DROP TRIGGER IF EXISTS core_user_search_ai",
+    "DROP TABLE IF EXISTS core_user_search",
+    "DROP TABLE IF EXISTS core_user_search_ids",
+]
+
+
+def rekey_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        for statement in SQLITE_FORWARD:
+            schema_editor.execute(statement)
+
+
+def restore_rowid_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        for statement in SQLITE_BACKWARD:
+            schema_editor.execute(statement)
+        for statement in import_module("core.migrations.0010_user_search_index").SQLITE_FORWARD:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0013_mediablob"),
+    ]
+
+    operations = [
+        migrations.RunPython(rekey_search_index, restore_rowid_index),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal
 import uuid
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 
@@ -54,6 +56,19 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.username
 
+def save_without_counters(instance, save_kwargs):
+    """
+    Keeps a full `save()` of an existing row from writing back a stale copy of
+    its denormalized counters, which are only ever changed with F() updates.
+    """
+    if instance._state.adding or save_kwargs.get('update_fields') is not None:
+        return
+    save_kwargs['update_fields'] = [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in instance.COUNTER_FIELDS
+    ]
+
+
 # Create your models here.
 class Profile(models.Model):
     # This field creates a one-to-one relationship, ensuring each user has exactly one profile.
@@ -62,6 +77,15 @@ class Profile(models.Model):
     bio = models.TextField(blank=True, null=True)
     profileimg = models.ImageField(upload_to='profile_images', default='blank-profile-picture.png')
     location = models.CharField(max_length=100, null=True, blank=True)
+    # Denormalized counters, kept up to date by `core.counters` when follows change.
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+    COUNTER_FIELDS = ('followers_count', 'following_count')
+
+    def save(self, *args, **kwargs):
+        save_without_counters(self, kwargs)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.user.username
@@ -70,18 +94,173 @@ class Post(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     user = models.ForeignKey(User, on_delete=models.CASCADE,related_name="posts")
     image = models.ImageField(upload_to='post_images',default="")
+    # Resized WebP copies of `image`, see `core.images`: {name: {url, width, height}}
+    image_variants = models.JSONField(default=dict, blank=True)
     description = models.TextField(null=True,blank=True)
     caption = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized number of likes, kept up to date by `core.counters`.
+    like_count = models.PositiveIntegerField(default=0)
+    # Ranking score, see `core.ranking`. Moved by `core.counters` along with `like_count`.
+    score = models.FloatField(default=0)
+
+    COUNTER_FIELDS = ('like_count', 'score')
+
+    def save(self, *args, **kwargs):
+        save_without_counters(self, kwargs)
+        super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            # Serves "latest posts of these users" for profiles, timelines and the feed.
+            models.Index(fields=['user', '-created_at'], name='post_user_created_idx'),
+            # Serves the trending list: the highest scoring posts.
+            models.Index(fields=['-score'], name='post_score_idx'),
+        ]
 
     def __str__(self):
         # We need to return a string, not the User object itself.
         return self.user.username
 
+
+# Sent by `ToggleManager.set_many()` once per batch, instead of a post_save or
+# post_delete per row, with `actor_id`, the `target_ids` whose row was added or
+# removed and `present` (True if added). Receivers update counters and caches
+# for the whole batch at once.
+bulk_toggled = Signal()
+
+
+class ToggleManager(models.Manager):
+    """
+    Manager for "A relates to B" rows (likes, follows) that can be switched on and off.
+
+    `toggle()` deletes the row if it exists and inserts it otherwise, using
+    `DELETE ... RETURNING` and `INSERT ... ON CONFLICT DO NOTHING RETURNING`, so a
+    toggle is one statement per step instead of get-then-create, and concurrent
+    toggles can't create duplicates. Both statements are supported by Postgres
+    and SQLite >= 3.35. Since the rows bypass the ORM, `post_save`/`post_delete`
+    are sent by hand so the counters and caches hooked on them stay in sync.
+    """
+    # The two foreign keys identifying a row, e.g. ('post', 'user').
+    toggle_fields = ()
+    # Which of them is the user acting, for `set_many()`.
+    actor_field = None
+    # Rows written per statement by `set_many()`.
+    batch_size = 500
+
+    def toggle(self, first_id, second_id):
+        """
+        Flips the row for `(first_id, second_id)`. Returns True if it now exists.
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        fields = [self.model._meta.get_field(name) for name in self.toggle_fields]
+        columns = [quote(field.column) for field in fields]
+        params = [field.get_db_prep_value(value, connection) for field, value in zip(fields, (first_id, second_id))]
+        table = quote(self.model._meta.db_table)
+        pk = quote(self.model._meta.pk.column)
+        values = {field.attname: value for field, value in zip(fields, (first_id, second_id))}
+
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {table} WHERE {columns[0]} = %s AND {columns[1]} = %s RETURNING {pk}",
+                params,
+            )
+            row = cursor.fetchone()
+            if row:
+                instance = self.model(pk=row[0], **values)
+                post_delete.send(sender=self.model, instance=instance, using=self.db, origin=instance)
+                return False
+
+            cursor.execute(
+                f"INSERT INTO {table} ({columns[0]}, {columns[1]}) VALUES (%s, %s) "
+                f"ON CONFLICT DO NOTHING RETURNING {pk}",
+                params,
+            )
+            row = cursor.fetchone()
+            if row:
+                instance = self.model(pk=row[0], **values)
+                instance._state.adding = False
+                post_save.send(
+                    sender=self.model, instance=instance, created=True,
+                    update_fields=None, raw=False, using=self.db,
+                )
+        # If the insert hit a conflict, a concurrent request liked/followed first.
+        return True
+
+    def set_many(self, actor_id, target_ids, present=True):
+        """
+        Adds (`present`) or removes the rows between `actor_id` and each of
+        `target_ids` in one transaction, e.g. likes synced by an offline client.
+
+        Unlike `toggle()`, it is idempotent: rows already in the requested state
+        are left alone. Targets that don't exist are skipped. Returns
+        `(changed, missing)`: the ids of the targets whose row was added or
+        removed, and of those that don't exist. `bulk_toggled` is sent once for
+        the changed ones.
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        actor = self.model._meta.get_field(self.actor_field)
+        target = next(self.model._meta.get_field(name) for name in self.toggle_fields if name != self.actor_field)
+        table = quote(self.model._meta.db_table)
+        actor_column, target_column = quote(actor.column), quote(target.column)
+        target_pk = target.related_model._meta.pk
+
+        changed = []
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            requested = list(dict.fromkeys(target_pk.to_python(pk) for pk in target_ids))
+            existing = list(
+                target.related_model._default_manager.using(self.db)
+                .filter(pk__in=requested).values_list('pk', flat=True)
+            )
+            actor_param = actor.get_db_prep_value(actor_id, connection)
+            for start in range(0, len(existing), self.batch_size):
+                batch = [target.get_db_prep_value(pk, connection) for pk in existing[start:start + self.batch_size]]
+                if present:
+                    rows = ', '.join(['(%s, %s)'] * len(batch))
+                    cursor.execute(
+                        f"INSERT INTO {table} ({actor_column}, {target_column}) VALUES {rows} "
+                        f"ON CONFLICT DO NOTHING RETURNING {target_column}",
+                        [param for pk in batch for param in (actor_param, pk)],
+                    )
+                else:
+                    placeholders = ', '.join(['%s'] * len(batch))
+                    cursor.execute(
+                        f"DELETE FROM {table} WHERE {actor_column} = %s AND {target_column} IN ({placeholders}) "
+                        f"RETURNING {target_column}",
+                        [actor_param, *batch],
+                    )
+                changed += [target_pk.to_python(row[0]) for row in cursor.fetchall()]
+            if changed:
+                bulk_toggled.send(
+                    sender=self.model, actor_id=actor_id, target_ids=changed, present=present, using=self.db,
+                )
+        found = set(existing)
+        return changed, [pk for pk in requested if pk not in found]
+
+
+class LikePostManager(ToggleManager):
+    toggle_fields = ('post', 'user')
+    actor_field = 'user'
+
+
+class FollowersCountManager(ToggleManager):
+    toggle_fields = ('follower', 'user')
+    actor_field = 'follower'
+
+
 class LikePost(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE,related_name="likes")
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    objects = LikePostManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'user'], name='unique_like'),
+        ]
+
     def __str__(self):
         # We need to return a descriptive string. Returning `self.username` would cause an error.
         return f'{self.user.username} liked {self.post.caption[:20]}...'
@@ -92,6 +271,56 @@ class FollowersCount(models.Model):
     follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followers')
 
+    objects = FollowersCountManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['follower', 'user'], name='unique_follow'),
+        ]
+        indexes = [
+            # The unique constraint serves lookups by follower; this serves lookups by followed user.
+            models.Index(fields=['user', 'follower'], name='follow_user_follower_idx'),
+        ]
+
     def __str__(self):
         # This string representation is much more informative.
         return f'{self.follower.username} follows {self.user.username}'
+
+
+class TimelineEntry(models.Model):
+    """
+    A post materialized into a follower's home timeline (fan-out-on-write).
+
+    `created_at` is copied from the post so a timeline page can be read with a
+    single keyset query on `(owner, created_at, post)` without joining posts.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-post'], name='timeline_owner_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.post_id} in timeline of {self.owner_id}'
+
+
+class MediaBlob(models.Model):
+    """
+    A stored media file, named after the SHA-256 of its bytes (see `core.media`).
+
+    Identical files are stored once; `ref_count` is the number of posts and
+    profiles using the file, and it is deleted once that drops to zero.
+    """
+    path = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.path} ({self.ref_count} refs)'
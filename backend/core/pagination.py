@@ -0,0 +1,176 @@
+import base64
+import json
+import math
+import uuid
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a client sends a cursor we did not issue (or cannot decode).
+    """
+
+
+def clamp_page_size(limit):
+    """
+    Returns a page size between 1 and MAX_PAGE_SIZE, falling back to the default.
+    """
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def clamp_offset(offset):
+    """
+    Returns a non-negative offset, falling back to 0.
+    """
+    try:
+        return max(0, int(offset))
+    except (TypeError, ValueError):
+        return 0
+
+
+def encode_cursor(created_at, pk):
+    """
+    Encodes the keyset position `(created_at, id)` of a row into an opaque string.
+    """
+    raw = json.dumps([created_at.isoformat(), str(pk)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor produced by `encode_cursor` back into `(created_at, id)`.
+    """
+    try:
+        created_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = parse_datetime(created_at)
+        pk = uuid.UUID(pk)
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor('Invalid cursor.')
+    if created_at is None:
+        raise InvalidCursor('Invalid cursor.')
+    return created_at, pk
+
+
+def encode_offset_cursor(offset):
+    """
+    Encodes a position in a ranked list, whose order can't be expressed as a keyset.
+    """
+    raw = json.dumps(['offset', offset])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_offset_cursor(cursor):
+    """
+    Decodes a cursor produced by `encode_offset_cursor` back into an offset.
+    """
+    try:
+        kind, offset = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor('Invalid cursor.')
+    if kind != 'offset' or not isinstance(offset, int) or offset < 0:
+        raise InvalidCursor('Invalid cursor.')
+    return offset
+
+
+def encode_rank_cursor(rank, pk):
+    """
+    Encodes the keyset position `(rank, id)` of a row of a ranked list.
+    """
+    raw = json.dumps(['rank', rank, str(pk)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_rank_cursor(cursor):
+    """
+    Decodes a cursor produced by `encode_rank_cursor` back into `(rank, id)`.
+    """
+    try:
+        kind, rank, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        pk = uuid.UUID(pk)
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor('Invalid cursor.')
+    if kind != 'rank' or not isinstance(rank, (int, float)) or not math.isfinite(rank):
+        raise InvalidCursor('Invalid cursor.')
+    return rank, pk
+
+
+def keyset_filter(queryset, cursor, created_field='created_at', id_field='id'):
+    """
+    Orders a queryset newest first on `(created_field, id_field)` and, if a cursor
+    is given, keeps only the rows that come strictly after it.
+
+    The row-value comparison is spelled out with `Q` objects so it works on both
+    SQLite and Postgres, and is answered by an index on `(created_at, id)`.
+    """
+    queryset = queryset.order_by(f'-{created_field}', f'-{id_field}')
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(**{f'{created_field}__lt': created_at}) |
+            Q(**{created_field: created_at, f'{id_field}__lt': pk})
+        )
+    return queryset
+
+
+class Page:
+    """
+    A single page of keyset-paginated results, or of a ranked list when
+    `offset` (the position of the first item) is given.
+    """
+    def __init__(self, items, has_next, next_cursor, offset=None, cursor_of=None):
+        self.items = items
+        self.has_next = has_next
+        self.next_cursor = next_cursor
+        self.offset = offset
+        # Returns the cursor of an item, for orders other than `(created_at, id)`.
+        self.cursor_of = cursor_of
+
+    def cursor_for(self, item):
+        if self.cursor_of is not None:
+            return self.cursor_of(item)
+        if self.offset is not None:
+            return encode_offset_cursor(self.offset + self.items.index(item) + 1)
+        return encode_cursor(item.created_at, item.pk)
+
+
+def paginate_by_rank(queryset, limit=None, cursor=None):
+    """
+    Fetches one page of `queryset`, annotated with a numeric `rank`, best first.
+    Keyset-paginated on `(rank, id)` like `paginate` is on `(created_at, id)`,
+    so only `limit + 1` rows are read whatever the page.
+    """
+    limit = clamp_page_size(limit)
+    queryset = queryset.order_by('-rank', '-id')
+    if cursor:
+        rank, pk = decode_rank_cursor(cursor)
+        queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=pk))
+    rows = list(queryset[:limit + 1])
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_rank_cursor(rows[-1].rank, rows[-1].pk) if has_next else None
+    return Page(rows, has_next, next_cursor, cursor_of=lambda row: encode_rank_cursor(row.rank, row.pk))
+
+
+def paginate(queryset, limit=None, cursor=None):
+    """
+    Fetches one page of `queryset` ordered by `(created_at, id)` descending.
+
+    Only `limit + 1` rows are ever read: the extra row tells us whether there
+    is a next page without running a COUNT(*).
+    """
+    limit = clamp_page_size(limit)
+    rows = list(keyset_filter(queryset, cursor)[:limit + 1])
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1].created_at, rows[-1].pk) if has_next else None
+    return Page(rows, has_next, next_cursor)
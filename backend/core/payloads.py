@@ -0,0 +1,179 @@
+import struct
+import zlib
+from functools import cache
+
+import orjson
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import LikePost, Post, Profile, User
+
+
+# Cached values are stored as orjson-encoded primitives rather than pickled
+# model graphs: they are several times smaller, load without importing model
+# state, and can't break when a model changes between deploys.
+#
+# A payload is a small header followed by the (optionally zlib-compressed) JSON:
+#   format version (1 byte) | flags (1 byte) | schema fingerprint (4 bytes)
+# Payloads written by another format version or against other `ROW_FIELDS`
+# are treated as cache misses.
+FORMAT_VERSION = 1
+FLAG_ZLIB = 1
+HEADER = struct.Struct('>BBI')
+# Payloads larger than this are compressed.
+COMPRESS_THRESHOLD = 1024
+
+# The columns cached for each model, in the order they are stored in a row.
+# Anything else (e.g. the password hash) is left deferred on rehydrated instances.
+ROW_FIELDS = {
+    User: ('id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'date_joined'),
+    Profile: ('id', 'user_id', 'bio', 'profileimg', 'location', 'followers_count', 'following_count'),
+    Post: ('id', 'user_id', 'image', 'image_variants', 'caption', 'description', 'created_at', 'like_count'),
+    LikePost: ('id', 'post_id', 'user_id'),
+}
+
+
+class StalePayload(ValueError):
+    """
+    Raised for payloads written by another format version or model layout.
+    """
+
+
+@cache
+def schema_fingerprint():
+    """
+    A checksum of `ROW_FIELDS`, so rows cached before a deploy that changed them are ignored.
+    """
+    layout = ';'.join(f"{model._meta.label}:{','.join(fields)}" for model, fields in ROW_FIELDS.items())
+    return zlib.crc32(layout.encode())
+
+
+def _default(value):
+    # orjson handles UUIDs and datetimes itself; file fields are stored by name.
+    if hasattr(value, 'name'):
+        return value.name
+    raise TypeError
+
+
+def encode(value):
+    """
+    Packs a structure of primitives (dicts, lists, rows) into a payload.
+    """
+    data = orjson.dumps(value, default=_default)
+    flags = 0
+    if len(data) > COMPRESS_THRESHOLD:
+        data = zlib.compress(data)
+        flags |= FLAG_ZLIB
+    return HEADER.pack(FORMAT_VERSION, flags, schema_fingerprint()) + data
+
+
+def decode(payload):
+    """
+    Unpacks a payload produced by `encode`.
+    """
+    if not isinstance(payload, bytes) or len(payload) < HEADER.size:
+        raise StalePayload('Not a payload.')
+    version, flags, fingerprint = HEADER.unpack_from(payload)
+    if version != FORMAT_VERSION or fingerprint != schema_fingerprint():
+        raise StalePayload('Payload written by another version.')
+    data = payload[HEADER.size:]
+    if flags & FLAG_ZLIB:
+        data = zlib.decompress(data)
+    return orjson.loads(data)
+
+
+def row_columns(model, relation=None):
+    """
+    The `ROW_FIELDS` of `model` as arguments to `.only()`, for loading rows that
+    are only going to be cached. Pass `relation` for a model joined through it.
+    """
+    fields = ROW_FIELDS[model]
+    return [f'{relation}__{field}' for field in fields] if relation else list(fields)
+
+
+def dump(instance):
+    """
+    Returns the `ROW_FIELDS` of a model instance as a list of primitives.
+    """
+    return [getattr(instance, attname) for attname in ROW_FIELDS[type(instance)]]
+
+
+def load(model, row):
+    """
+    Rehydrates a model instance from a row produced by `dump`, without a query.
+    """
+    values = {
+        attname: model._meta.get_field(attname).to_python(value)
+        for attname, value in zip(ROW_FIELDS[model], row)
+    }
+    # from_db() expects the values in the model's field order, not ours.
+    attnames = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+    return model.from_db(DEFAULT_DB_ALIAS, attnames, [values[attname] for attname in attnames])
+
+
+def set_prefetched(instance, name, objects):
+    """
+    Attaches `objects` as if they had been loaded by `prefetch_related(name)`.
+    """
+    queryset = getattr(instance, name).all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    instance._prefetched_objects_cache = getattr(instance, '_prefetched_objects_cache', {})
+    instance._prefetched_objects_cache[name] = queryset
+
+
+def dump_profiles(profiles):
+    """
+    Profiles with their users, e.g. search results or suggestions.
+    """
+    return [[dump(profile), dump(profile.user)] for profile in profiles]
+
+
+def load_profiles(rows):
+    """
+    Rehydrates the profiles returned by `dump_profiles`, with their users attached.
+    """
+    profiles = []
+    for profile_row, user_row in rows:
+        profile = load(Profile, profile_row)
+        profile.user = load(User, user_row)
+        profiles.append(profile)
+    return profiles
+
+
+def dump_profile_page(user):
+    """
+    A user's profile page: profile, user, posts and the posts' likes with their users.
+    `user` must have been loaded with its profile and prefetched posts/likes.
+    """
+    posts = list(user.posts.all())
+    return {
+        'profile': dump(user.profile),
+        'user': dump(user),
+        'posts': [dump(post) for post in posts],
+        'likes': [[dump(like), dump(like.user)] for post in posts for like in post.likes.all()],
+    }
+
+
+def load_profile_page(data):
+    """
+    Rehydrates a profile returned by `dump_profile_page`, with everything it was
+    cached with attached as if loaded with select_related/prefetch_related.
+    """
+    user = load(User, data['user'])
+    profile = load(Profile, data['profile'])
+    profile.user = user
+
+    likes_by_post = {}
+    for like_row, liker_row in data['likes']:
+        like = load(LikePost, like_row)
+        like.user = load(User, liker_row)
+        likes_by_post.setdefault(like.post_id, []).append(like)
+
+    posts = []
+    for row in data['posts']:
+        post = load(Post, row)
+        post.user = user
+        set_prefetched(post, 'likes', likes_by_post.get(post.id, []))
+        posts.append(post)
+    set_prefetched(user, 'posts', posts)
+    return profile
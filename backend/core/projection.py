@@ -0,0 +1,167 @@
+from collections import defaultdict
+from functools import cache
+
+from django.core.exceptions import FieldDoesNotExist
+from graphene.utils.str_converters import to_camel_case
+from graphene_django.registry import get_global_registry
+from graphql import FieldNode, FragmentSpreadNode, InlineFragmentNode, get_named_type
+
+from .models import LikePost, Post, Profile, User
+
+
+# Rows the GraphQL loaders fetch from the database are limited to the columns
+# of the fields the operation selects, e.g. a query asking for posts' `id` and
+# `srcset` reads neither their caption nor their description, and users are
+# never read with their password hash.
+#
+# Model fields exposed under their own name need nothing declared. A field with
+# a custom resolver lists the columns it reads in its type's `column_dependencies`
+# (fields read by none, e.g. resolved by a loader, can be left out). A column
+# missing from both is loaded by Django with a query of its own per row.
+
+# Columns loaded whatever the selection: keys the loaders and resolvers use.
+KEY_COLUMNS = {
+    User: ('id',),
+    Profile: ('id', 'user'),
+    Post: ('id', 'user'),
+    LikePost: ('id', 'post', 'user'),
+}
+
+
+def _collect(schema, parent_type, selection_set, fragments, selected, visited):
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            name = selection.name.value
+            selected[parent_type.name].add(name)
+            field = getattr(parent_type, 'fields', {}).get(name)
+            if field is not None and selection.selection_set is not None:
+                _collect(schema, get_named_type(field.type), selection.selection_set, fragments, selected, visited)
+        elif isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            if name in visited or name not in fragments:
+                continue
+            visited.add(name)
+            fragment = fragments[name]
+            fragment_type = schema.get_type(fragment.type_condition.name.value)
+            _collect(schema, fragment_type, fragment.selection_set, fragments, selected, visited)
+        elif isinstance(selection, InlineFragmentNode):
+            condition = selection.type_condition
+            fragment_type = schema.get_type(condition.name.value) if condition is not None else parent_type
+            _collect(schema, fragment_type, selection.selection_set, fragments, selected, visited)
+
+
+def selected_fields(info):
+    """
+    The fields the operation selects on each type, anywhere in it, as
+    `{type name: {field name, ...}}` (names as written in GraphQL).
+    """
+    selected = defaultdict(set)
+    root_type = info.schema.get_root_type(info.operation.operation)
+    _collect(info.schema, root_type, info.operation.selection_set, info.fragments, selected, set())
+    return selected
+
+
+@cache
+def _field_columns(model):
+    """
+    Returns the GraphQL type name of `model` and `{field name: columns it reads}`.
+    """
+    graphene_type = get_global_registry().get_type_for_model(model)
+    dependencies = getattr(graphene_type, 'column_dependencies', {})
+    columns = {}
+    for name in graphene_type._meta.fields:
+        if name in dependencies:
+            columns[to_camel_case(name)] = tuple(dependencies[name])
+            continue
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        # Reverse relations are resolved by loaders, from the primary key.
+        if field.concrete:
+            columns[to_camel_case(name)] = (field.name,)
+    return graphene_type._meta.name, columns
+
+
+def columns(model, selected):
+    """
+    The columns of `model` needed for the fields in `selected`, or None to load
+    all of them (the operation doesn't select its type, so the rows are used
+    for something else).
+    """
+    type_name, field_columns = _field_columns(model)
+    fields = selected.get(type_name)
+    if fields is None:
+        return None
+    needed = dict.fromkeys(KEY_COLUMNS[model])
+    for name in fields:
+        needed.update(dict.fromkeys(field_columns.get(name, ())))
+    return list(needed)
+
+
+def is_selected(model, field_name, selected):
+    """
+    Whether the operation selects `field_name` (a model attribute) on the type of `model`.
+    """
+    type_name, _ = _field_columns(model)
+    return to_camel_case(field_name) in selected.get(type_name, ())
+
+
+def project(queryset, selected, related=()):
+    """
+    Restricts `queryset` to the columns the operation needs, and joins the
+    one-to-one/foreign key relations in `related` it selects (with their
+    columns restricted too). Returns the relations joined along with it.
+    """
+    model = queryset.model
+    only = columns(model, selected)
+    joined = []
+    for name in related:
+        related_columns = columns(model._meta.get_field(name).related_model, selected)
+        if related_columns is None or not is_selected(model, name, selected):
+            continue
+        joined.append(name)
+        if only is not None:
+            only += [f'{name}__{column}' for column in related_columns]
+    if joined:
+        queryset = queryset.select_related(*joined)
+    if only is not None:
+        queryset = queryset.only(*only)
+    return queryset, joined
+
+
+# The post columns the REST feed reads (see `core.representations.POST`).
+REST_POST_COLUMNS = ('id', 'user', 'image', 'image_variants', 'caption', 'created_at')
+
+
+def feed_columns(selected, prefix=''):
+    """
+    For the posts of a feed page, found at `prefix` (e.g. 'post__' from
+    timeline entries), returns the `.only()` arguments and the relations to
+    join: the columns the operation `selected` asks for, with the authors
+    joined if it selects them, or those the REST feed reads if `selected` is
+    None. No `.only()` arguments means every column.
+    """
+    if selected is None:
+        return [prefix + column for column in REST_POST_COLUMNS], []
+    post_columns = columns(Post, selected)
+    user_columns = columns(User, selected) if is_selected(Post, 'user', selected) else None
+    joined = [f'{prefix}user'] if user_columns is not None else []
+    if post_columns is None:
+        return [], joined
+    # Cursors and the merging of timelines are keyed on `created_at`.
+    only = [prefix + column for column in dict.fromkeys([*post_columns, 'created_at'])]
+    only += [f'{prefix}user__{column}' for column in user_columns or ()]
+    return only, joined
+
+
+def project_feed(queryset, selected):
+    """
+    Restricts a queryset of posts to the columns of `feed_columns`.
+    """
+    only, joined = feed_columns(selected)
+    if joined:
+        queryset = queryset.select_related(*joined)
+    if only:
+        queryset = queryset.only(*only)
+    return queryset
@@ -0,0 +1,118 @@
+import math
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db.models import Case, Count, F, FloatField, Q, Value, When
+from django.db.models.functions import Log
+
+from .models import FollowersCount, LikePost, Post, TimelineEntry
+from .projection import project_feed
+from .timeline import celebrity_ids
+
+
+# Every post carries a "hot" score, log10(1 + likes) + age / DECAY_SECONDS:
+# a post needs ten times the likes to outrank one posted DECAY_SECONDS later.
+# Because time only enters through the creation date, scores never have to be
+# recomputed as posts age; a like only adds the change in its log term.
+SCORE_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+DECAY_SECONDS = 45000
+
+# How far back the ranked home feed looks: the newest entries of the timeline.
+RANKED_WINDOW = 300
+# Bonus per order of magnitude of likes the viewer gave the author before.
+AFFINITY_WEIGHT = 0.5
+
+# The global trending list, used as the feed of users who follow nobody.
+TRENDING_KEY = 'trending:posts'
+TRENDING_SIZE = 500
+TRENDING_TIMEOUT = 60 * 60
+
+
+def base_score(created_at):
+    """
+    The score of a post without any likes.
+    """
+    return (created_at - SCORE_EPOCH).total_seconds() / DECAY_SECONDS
+
+
+def hot_score(like_count, created_at):
+    return math.log10(1 + like_count) + base_score(created_at)
+
+
+def score_change(delta):
+    """
+    SQL expression for how much a post's score changes when `delta` is added to
+    its `like_count`, evaluated against the row's current like count.
+    """
+    return Log(Value(10.0), F('like_count') + 1 + delta) - Log(Value(10.0), F('like_count') + 1)
+
+
+def rescore(post_ids):
+    """
+    Recomputes the score of the given posts from scratch, e.g. after their like counts were fixed.
+    """
+    posts = list(Post.objects.filter(pk__in=post_ids).only('id', 'like_count', 'created_at'))
+    for post in posts:
+        post.score = hot_score(post.like_count, post.created_at)
+    Post.objects.bulk_update(posts, ['score'], batch_size=1000)
+
+
+def refresh_trending():
+    """
+    Stores the ids of the highest scoring posts, read off the score index.
+    """
+    post_ids = [str(post_id) for post_id in Post.objects.order_by('-score').values_list('id', flat=True)[:TRENDING_SIZE]]
+    cache.set(TRENDING_KEY, post_ids, TRENDING_TIMEOUT)
+    return post_ids
+
+
+def trending_post_ids():
+    """
+    The trending list refreshed by the `refresh_trending` job, computed on
+    the spot if the job hasn't run yet.
+    """
+    post_ids = cache.get(TRENDING_KEY)
+    if post_ids is None:
+        post_ids = refresh_trending()
+    return post_ids
+
+
+def trending_posts(post_ids, selected=None):
+    """
+    Loads the given posts, in the same order, skipping any deleted since.
+    Only the columns the GraphQL operation `selected` (or the REST feed) needs are read.
+    """
+    posts = project_feed(Post.objects.all(), selected).in_bulk(post_ids)
+    return [posts[post_id] for post_id in map(Post._meta.pk.to_python, post_ids) if post_id in posts]
+
+
+def ranked_timeline(user, selected=None):
+    """
+    The newest `RANKED_WINDOW` posts of `user`'s home timeline (including the
+    followed celebrity accounts), as a queryset annotated with their `rank`,
+    to be read best first with `core.pagination.paginate_by_rank`.
+
+    A post's rank is its score plus the viewer's affinity for the author,
+    measured by how many of the author's posts the viewer has liked. The
+    affinities are looked up first and passed in as constants, so the ranking
+    and paging happen in SQL and only the rows of a page are loaded, with the
+    columns the GraphQL operation `selected` (or the REST feed) needs.
+    """
+    candidates = Q(id__in=TimelineEntry.objects.filter(owner=user).order_by('-created_at', '-post_id')
+                   .values('post_id')[:RANKED_WINDOW])
+    following_ids = list(FollowersCount.objects.filter(follower=user).values_list('user_id', flat=True))
+    celebrities = celebrity_ids(following_ids)
+    if celebrities:
+        candidates |= Q(id__in=Post.objects.filter(user_id__in=celebrities).order_by('-created_at', '-id')
+                        .values('id')[:RANKED_WINDOW])
+
+    affinity = (
+        LikePost.objects.filter(user=user, post__user_id__in=[*following_ids, user.id])
+        .values('post__user_id').annotate(n=Count('id')).values_list('post__user_id', 'n')
+    )
+    bonus = Case(
+        *(When(user_id=author_id, then=Value(AFFINITY_WEIGHT * math.log10(1 + n))) for author_id, n in affinity),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    return project_feed(Post.objects.filter(candidates), selected).annotate(rank=F('score') + bonus)
@@ -0,0 +1,36 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+from .metrics import timed
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    `JSONRenderer` encoding with orjson, several times faster on large responses.
+
+    The output decodes to the same JSON: compact, UTF-8, with \\u2028 and
+    \\u2029 escaped. Datetimes, decimals and anything else orjson doesn't
+    write the way DRF does go through DRF's encoder. It is not always byte
+    for byte the same: orjson writes some floats differently (`1e16` rather
+    than `1e+16`), and NaN and infinities as `null` where DRF refuses them.
+    Data orjson can't encode at all (e.g. integers wider than 64 bits),
+    indented output (the browsable API, `Accept: application/json; indent=4`)
+    and non-default `UNICODE_JSON`/`COMPACT_JSON` settings are left to
+    `JSONRenderer`.
+    """
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.ensure_ascii or not self.compact or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        with timed('render'):
+            try:
+                ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+            except orjson.JSONEncodeError:
+                return super().render(data, accepted_media_type, renderer_context)
+            if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+                ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
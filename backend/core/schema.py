@@ -1,23 +1,53 @@
 import graphene
+from django.conf import settings
 from graphene_django.types import DjangoObjectType
 from .models import Profile, FollowersCount, Post, LikePost, User
 from graphql_jwt.decorators import login_required
 import graphql_jwt
-import random
-from django.db.models import Count
-from django.utils import timezone
-from datetime import timedelta
+from graphql import GraphQLError
+from django.db import IntegrityError, transaction
 from django.db.models import Prefetch
-from django.core.cache import cache
+from graphene_file_upload.scalars import Upload
 from social_book.utils.rabbitmq import publish_to_queue
+from .cache import SEARCH_TAG, get_or_refresh, user_tag
+from .feed import LATEST, TOP, get_home_feed
+from .images import srcset
+from .loaders import get_loaders
+from .media import store_upload
+from .payloads import dump_profile_page, load_profile_page, row_columns
+from .pagination import InvalidCursor, clamp_offset, clamp_page_size
+from .projection import project
+from .search import cached_search_profiles
+from .suggestions import cached_suggestions
+from .uploads import InvalidUpload, decode_base64, stage_base64, stage_upload
 
 # --- Object Types ---
 # These classes define the GraphQL types for your Django models.
 
+def prefetched(instance, name):
+    """
+    Returns the objects `prefetch_related(name)` already loaded on `instance`, or None.
+    """
+    cache = getattr(instance, '_prefetched_objects_cache', {})
+    return list(cache[name]) if name in cache else None
+
+
 class UserType(DjangoObjectType):
     class Meta:
         model = User
         fields = ('id', 'username', 'email','first_name','last_name','profile','posts','date_joined')
+
+    def resolve_profile(self, info):
+        if User.profile.is_cached(self):
+            return self.profile
+        return get_loaders(info).profiles.load(self.id)
+
+    def resolve_posts(self, info):
+        posts = prefetched(self, 'posts')
+        if posts is not None:
+            get_loaders(info).expect_posts(posts)
+            return posts
+        return get_loaders(info).posts_by_user.load(self.id)
         
 class ProfileType(DjangoObjectType):
     followers_count = graphene.Int()
@@ -28,29 +58,83 @@ class ProfileType(DjangoObjectType):
         model = Profile
         fields = ('id', 'user', 'bio','profileimg','location','followers_count','following_count','is_following','location')
         
+    # followers_count and following_count are denormalized columns on Profile,
+    # so the default resolvers read them straight off the row.
 
-    def resolve_followers_count(self, info):
-        return FollowersCount.objects.filter(user=self.user).count()
+    def resolve_user(self, info):
+        if Profile.user.is_cached(self):
+            return self.user
+        return get_loaders(info).users.load(self.user_id)
 
-    def resolve_following_count(self, info):
-        return FollowersCount.objects.filter(follower=self.user).count()
-        
     @login_required
     def resolve_is_following(self, info):
-        current_user = info.context.user
-        return FollowersCount.objects.filter(follower=current_user, user=self.user).exists()
+        return get_loaders(info).is_following.load(self.user_id)
+
+class ImageVariantType(graphene.ObjectType):
+    name = graphene.String()
+    url = graphene.String()
+    width = graphene.Int()
+    height = graphene.Int()
 
 class PostType(DjangoObjectType):
+    srcset = graphene.String(description="Resized WebP variants of the image, as an HTML srcset attribute.")
+    variants = graphene.List(ImageVariantType)
+
     class Meta:
         model = Post
-        fields = ('id', 'user','image', 'caption','description', 'created_at', 'likes')
+        fields = ('id', 'user','image', 'caption','description', 'created_at', 'likes', 'like_count', 'srcset', 'variants')
         ordering = ['-created_at']  # Default ordering for all queries
+
+    # Columns read by the custom resolvers, see `core.projection`
+    column_dependencies = {
+        'srcset': ('image_variants',),
+        'variants': ('image_variants',),
+    }
+
+    def resolve_srcset(self, info):
+        return srcset(self.image_variants)
+
+    def resolve_variants(self, info):
+        return [
+            ImageVariantType(name=name, url=variant['url'], width=variant['width'], height=variant['height'])
+            for name, variant in (self.image_variants or {}).items()
+        ]
+
+    def resolve_user(self, info):
+        if Post.user.is_cached(self):
+            return self.user
+        return get_loaders(info).users.load(self.user_id)
+
+    def resolve_likes(self, info):
+        likes = prefetched(self, 'likes')
+        if likes is not None:
+            return likes
+        return get_loaders(info).likes.load(self.id)
         
+class PostConnection(graphene.relay.Connection):
+    """
+    Relay-style connection used to page through the feed with `first`/`after`.
+    """
+    class Meta:
+        node = PostType
+
+class FeedOrder(graphene.Enum):
+    """
+    LATEST: newest first. TOP: ranked by engagement and affinity with the author.
+    """
+    LATEST = LATEST
+    TOP = TOP
+
 class LikePostType(DjangoObjectType):
     class Meta:
         model = LikePost
         fields = ('id', 'post', 'user')
 
+    def resolve_user(self, info):
+        if LikePost.user.is_cached(self):
+            return self.user
+        return get_loaders(info).users.load(self.user_id)
+
 class FollowersCountType(DjangoObjectType):
     class Meta:
         model = FollowersCount
@@ -58,15 +142,27 @@ class FollowersCountType(DjangoObjectType):
 
 class CreatePost(graphene.Mutation):
     class Arguments:
-        image = graphene.String(required=True)  # Base64 string
+        image_file = Upload(required=False)  # Multipart upload (preferred)
+        image = graphene.String(required=False)  # Base64 data URL, kept for older clients
         caption = graphene.String(required=False)
         description = graphene.String(required=False)
     
     post = graphene.Field(PostType)
 
     @login_required
-    def mutate(self, info, image, caption, description=None):
+    def mutate(self, info, caption, image_file=None, image=None, description=None):
         user = info.context.user
+
+        # Write the image to the staging area first: only its path goes on the queue.
+        try:
+            if image_file is not None:
+                staged_path = stage_upload(image_file)
+            elif image:
+                staged_path = stage_base64(image)
+            else:
+                raise GraphQLError("An image is required.")
+        except InvalidUpload as e:
+            raise GraphQLError(str(e))
         
         # Create the post
         post = Post(
@@ -79,7 +175,7 @@ class CreatePost(graphene.Mutation):
 
         message_payload = {
             'post_id':str(post.id),
-            'image_base64_data':image
+            'staged_path':staged_path,
         }
 
         publish_to_queue("image_processing_queue", message_payload)
@@ -92,7 +188,7 @@ class CreatePost(graphene.Mutation):
 class UpdateProfile(graphene.Mutation):
     class Arguments:
         bio = graphene.String()
-        profile_img = graphene.String()
+        profile_img = graphene.String()  # Base64 data URL
         
     profile = graphene.Field(ProfileType)
 
@@ -102,9 +198,15 @@ class UpdateProfile(graphene.Mutation):
         profile = user.profile
         if bio is not None:
             profile.bio = bio
-        if profile_img is not None:
-            profile.profileimg = profile_img
-        profile.save()
+        # Stored by content hash and counted, like uploads to the profile settings endpoint.
+        try:
+            with transaction.atomic():
+                if profile_img is not None:
+                    with decode_base64(profile_img) as decoded:
+                        profile.profileimg = store_upload(decoded, 'profile_images')
+                profile.save()
+        except InvalidUpload as e:
+            raise GraphQLError(str(e))
         return UpdateProfile(profile=profile)
 
 class FollowUser(graphene.Mutation):
@@ -122,22 +224,11 @@ class FollowUser(graphene.Mutation):
         except User.DoesNotExist:
             raise Exception("user with username doesn't exist")
         
-        is_following = FollowersCount.objects.filter(follower=follower, user=followedUser).exists()
-
-        if is_following:
-            FollowersCount.objects.get(follower=follower, user=followedUser).delete()
-            # Invalidate the caches after unfollowing
-            cache.delete(f'graphql_profile_{username}')
-            cache.delete(f'graphql_profile_{follower.username}')
-            cache.delete(f'graphql_suggestions_{follower.id}')
-            return FollowUser(followed=False, message=f"Successfully unfollowed {username}.")
-        else:
-            FollowersCount.objects.create(follower=follower, user=followedUser)
-            # Invalidate the caches after following
-            cache.delete(f'graphql_profile_{username}')
-            cache.delete(f'graphql_profile_{follower.username}')
-            cache.delete(f'graphql_suggestions_{follower.id}')
+        # The follow signals invalidate both profiles and the follower's suggestions.
+        followed = FollowersCount.objects.toggle(follower.id, followedUser.id)
+        if followed:
             return FollowUser(followed=True, message=f"Successfully followed {username}.")
+        return FollowUser(followed=False, message=f"Successfully unfollowed {username}.")
         
         
 class LikePostMutation(graphene.Mutation):
@@ -152,21 +243,69 @@ class LikePostMutation(graphene.Mutation):
     def mutate(self, info, post_id):
         user = info.context.user
         try:
-            post = Post.objects.get(id=post_id)
-        except Post.DoesNotExist:
+            liked = LikePost.objects.toggle(post_id, user.id)
+        except IntegrityError:
             return LikePostMutation(liked=False, likes=[], message="Post not found.")
-        
-        try:
-            LikePost.objects.get(post=post, user=user).delete()
-            liked = False
-        except LikePost.DoesNotExist:
-            LikePost.objects.create(post=post, user=user)
-            liked = True
 
-        likes = LikePost.objects.filter(post_id=post_id)
+        likes, _ = project(LikePost.objects.filter(post_id=post_id), get_loaders(info).selected, related=('user', 'post'))
+        likes = list(likes)
         return LikePostMutation(liked=liked, likes=likes,message="changed successfully")
 
 
+class LikePosts(graphene.Mutation):
+    """
+    Likes (or unlikes, with `liked: false`) many posts at once, e.g. likes made
+    offline. Sets the like instead of toggling it, so replaying a batch is harmless.
+    """
+    class Arguments:
+        post_ids = graphene.List(graphene.NonNull(graphene.UUID), required=True)
+        liked = graphene.Boolean(default_value=True)
+
+    liked = graphene.Boolean()
+    changed = graphene.List(graphene.UUID, description="Posts whose like was added or removed.")
+    not_found = graphene.List(graphene.UUID, description="Posts that don't exist (anymore).")
+
+    @login_required
+    def mutate(self, info, post_ids, liked=True):
+        if len(post_ids) > settings.MAX_BULK_ACTIONS:
+            raise GraphQLError(f"At most {settings.MAX_BULK_ACTIONS} posts per request.")
+        try:
+            changed, not_found = LikePost.objects.set_many(info.context.user.id, post_ids, present=liked)
+        except IntegrityError:
+            raise GraphQLError("A post was deleted while liking it, try again.")
+        return LikePosts(liked=liked, changed=changed, not_found=not_found)
+
+
+class FollowUsers(graphene.Mutation):
+    """
+    Follows (or unfollows, with `followed: false`) many users at once, e.g.
+    follows made offline. Sets the follow instead of toggling it.
+    """
+    class Arguments:
+        usernames = graphene.List(graphene.NonNull(graphene.String), required=True)
+        followed = graphene.Boolean(default_value=True)
+
+    followed = graphene.Boolean()
+    changed = graphene.List(graphene.String, description="Users whose follow was added or removed.")
+    not_found = graphene.List(graphene.String, description="Usernames nobody has.")
+
+    @login_required
+    def mutate(self, info, usernames, followed=True):
+        if len(usernames) > settings.MAX_BULK_ACTIONS:
+            raise GraphQLError(f"At most {settings.MAX_BULK_ACTIONS} users per request.")
+        ids = dict(User.objects.filter(username__in=usernames).values_list('id', 'username'))
+        try:
+            changed, _ = FollowersCount.objects.set_many(info.context.user.id, list(ids), present=followed)
+        except IntegrityError:
+            raise GraphQLError("A user was deleted while following them, try again.")
+        found = set(ids.values())
+        return FollowUsers(
+            followed=followed,
+            changed=[ids[user_id] for user_id in changed],
+            not_found=[username for username in dict.fromkeys(usernames) if username not in found],
+        )
+
+
 class Mutation(graphene.ObjectType):
     token_auth = graphql_jwt.ObtainJSONWebToken.Field()
     verify_token = graphql_jwt.Verify.Field()
@@ -177,130 +316,105 @@ class Mutation(graphene.ObjectType):
     update_profile = UpdateProfile.Field()
     follow_user = FollowUser.Field()
     like_post = LikePostMutation.Field()
+    like_posts = LikePosts.Field()
+    follow_users = FollowUsers.Field()
    
 
+# --- Cache loaders ---
+# Module-level so a Celery worker can rebuild the entries; see `cache.get_or_refresh`.
+
+def load_profile(username):
+    """
+    A profile with its user, posts and the posts' likes, and the tags it depends on.
+    """
+    try:
+        # Use select_related and prefetch_related to optimize queries, and
+        # read only the columns that are cached (no password hashes)
+        user = User.objects.select_related('profile').only(
+            *row_columns(User), *row_columns(Profile, 'profile')
+        ).prefetch_related(
+            Prefetch(
+                'posts',
+                queryset=Post.objects.only(*row_columns(Post)).prefetch_related(
+                    Prefetch(
+                        'likes',
+                        queryset=LikePost.objects.select_related('user').only(
+                            *row_columns(LikePost), *row_columns(User, 'user')
+                        )
+                    )
+                ).order_by('-created_at')
+            )
+        ).get(username=username)
+    except User.DoesNotExist:
+        # Until a user takes this username
+        return None, [SEARCH_TAG]
+    return dump_profile_page(user), [user_tag(user.id)]
+
+
 # --- Queries ---
 # These classes define how to retrieve data.
 
 class Query(graphene.ObjectType):
     profile = graphene.Field(ProfileType, username=graphene.String())
     my_profile = graphene.Field(ProfileType)
-    search_profiles = graphene.List(ProfileType, username=graphene.String())
-    feed = graphene.List(PostType)
+    search_profiles = graphene.List(ProfileType, username=graphene.String(), limit=graphene.Int(), offset=graphene.Int())
+    feed = graphene.relay.ConnectionField(PostConnection, order=FeedOrder(default_value=LATEST))
     suggestions = graphene.List(ProfileType)
 
     @login_required
     def resolve_my_profile(self,info):
         current_user = info.context.user
-        profile = Profile.objects.select_related('user').get(user=current_user)
+        loaders = get_loaders(info)
+        profiles, _ = project(Profile.objects.filter(user=current_user), loaders.selected, related=('user',))
+        profile = profiles.get()
+        loaders.expect_profiles([profile])
         return profile
 
     @login_required
     def resolve_profile(self, info, username):
-        cache_key = f'graphql_profile_{username}'
-        cached_profile = cache.get(cache_key)
-        # cached_profile = None
-        
-        if cached_profile:
-            print("Fetching profile from cache.")
-            return cached_profile
-        
-        print("Fetching profile from DB and setting cache.")
-
-        try:
-            # Use select_related and prefetch_related to optimize queries
-            user = User.objects.select_related('profile').prefetch_related(
-                Prefetch(
-                    'posts',
-                    queryset=Post.objects.select_related('user').prefetch_related(
-                        Prefetch(
-                            'likes',
-                            queryset=LikePost.objects.select_related('user')
-                        )
-                    ).order_by('-created_at')
-                )
-            ).get(username=username)
-            profile = user.profile
-            cache.set(cache_key, profile, 60 * 60 * 2) # Cache for 2 hours
-            return profile
-        except User.DoesNotExist:
+        # Cached for 2 hours, or until anything about this user changes
+        data = get_or_refresh(f'graphql_profile_{username}', 'core.schema.load_profile', (username,), timeout=60 * 60 * 2)
+        if data is None:
             return None
+        profile = load_profile_page(data)
+        get_loaders(info).expect_profiles([profile])
+        return profile
 
     @login_required
-    def resolve_search_profiles(self, info, username):
+    def resolve_search_profiles(self, info, username, limit=None, offset=None):
         if not username:
             return []
         
-        cache_key = f'graphql_search_profiles_{username}'
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            print("Fetching from cache.")
-            return cached_data
-        
-        print("Fetching from DB and setting cache.")
-        users = User.objects.filter(username__icontains=username)
-        profiles = list(Profile.objects.filter(user__in=users))
-        
-        cache.set(cache_key, profiles, 60 * 60) # Cache for 1 hour
+        # Cached for 1 hour, or until a username changes or one of the results is updated
+        profiles = cached_search_profiles(username, limit=clamp_page_size(limit), offset=clamp_offset(offset))
+        get_loaders(info).expect_profiles(profiles)
         return profiles
 
     @login_required
-    def resolve_feed(self, info):
+    def resolve_feed(self, info, first=None, after=None, order=LATEST, **kwargs):
         current_user = info.context.user
-        
-        # Get following user IDs
-        following_user_ids = FollowersCount.objects.filter(
-            follower=current_user
-        ).values_list('user__id', flat=True)
-        
-        if not following_user_ids:
-            # Show popular posts or posts from suggested users for exploration
-            return Post.objects.all().select_related('user').prefetch_related('likes')\
-                    .annotate(like_count=Count('likes'))\
-                    .order_by('-like_count', '?')[:8]  # Popular posts first, then random
-    
-        
-        # Get recent posts (last 7 days) ordered by engagement
-        recent_posts = Post.objects.filter(
-            user__id__in=following_user_ids,
-            created_at__gte=timezone.now() - timedelta(days=7)
-        ).select_related('user').prefetch_related('likes')
-        
-        # Get older posts for filling the feed
-        older_posts = Post.objects.filter(
-            user__id__in=following_user_ids,
-            created_at__lt=timezone.now() - timedelta(days=7)
-        ).select_related('user').prefetch_related('likes')
-        
-        # Convert to lists and shuffle within categories
-        recent_posts_list = list(recent_posts)
-        older_posts_list = list(older_posts)
-        
-        random.shuffle(recent_posts_list)
-        random.shuffle(older_posts_list)
-        
-        # Combine with priority for recent posts
-        feed_posts = recent_posts_list + older_posts_list
-        
-        return feed_posts
+
+        try:
+            page = get_home_feed(current_user, limit=first, cursor=after, order=order, selected=get_loaders(info).selected)
+        except InvalidCursor as e:
+            raise GraphQLError(str(e))
+
+        get_loaders(info).expect_posts(page.items)
+        edges = [PostConnection.Edge(node=post, cursor=page.cursor_for(post)) for post in page.items]
+        return PostConnection(
+            edges=edges,
+            page_info=graphene.relay.PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_next_page=page.has_next,
+                has_previous_page=bool(after),
+            ),
+        )
 
     @login_required
     def resolve_suggestions(self, info):
         current_user = info.context.user
-        cache_key = f'graphql_suggestions_{current_user.id}'
-        cached_suggestions = cache.get(cache_key)
-
-        if cached_suggestions:
-            print("Fetching suggestions from cache.")
-            return cached_suggestions
-
-        print("Fetching suggestions from DB and setting cache.")
-        following_user_ids = FollowersCount.objects.filter(follower=current_user).values_list('user__id', flat=True)
-        exclude_ids = list(following_user_ids) + [current_user.id]
-        
-        suggestions_users = list(User.objects.exclude(id__in=exclude_ids).order_by('?')[:4])
-        
-        profiles = list(Profile.objects.filter(user__in=suggestions_users))
-        cache.set(cache_key, profiles, 60 * 15) # Cache for 15 minutes
+        profiles = cached_suggestions(current_user.id)
+        get_loaders(info).expect_profiles(profiles)
         return profiles
 
@@ -0,0 +1,225 @@
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, connections, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .cache import SEARCH_TAG, get_or_refresh, user_tag
+from .models import Profile, User
+from .payloads import dump_profiles, load_profiles
+
+
+# Name of the SQLite FTS5 table created by migration 0014, and of the table
+# mapping its rows to user ids.
+FTS_TABLE = 'core_user_search'
+FTS_IDS_TABLE = 'core_user_search_ids'
+# The trigram tokenizer can't match anything shorter than one trigram.
+MIN_TRIGRAM_LENGTH = 3
+
+# Keep the FTS table in sync with core_user. Logins and other saves that leave
+# the names alone don't touch it.
+SQLITE_TRIGGERS = {
+    'core_user_search_ai': f"""
+        CREATE TRIGGER core_user_search_ai AFTER INSERT ON core_user BEGIN
+            INSERT INTO {FTS_IDS_TABLE}(user_id) VALUES (new.id);
+            INSERT INTO {FTS_TABLE}(rowid, username, first_name, last_name)
+            VALUES ((SELECT id FROM {FTS_IDS_TABLE} WHERE user_id = new.id),
+                    new.username, new.first_name, new.last_name);
+        END
+    """,
+    'core_user_search_ad': f"""
+        CREATE TRIGGER core_user_search_ad AFTER DELETE ON core_user BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = (SELECT id FROM {FTS_IDS_TABLE} WHERE user_id = old.id);
+            DELETE FROM {FTS_IDS_TABLE} WHERE user_id = old.id;
+        END
+    """,
+    'core_user_search_au': f"""
+        CREATE TRIGGER core_user_search_au AFTER UPDATE OF username, first_name, last_name ON core_user BEGIN
+            UPDATE {FTS_TABLE} SET username = new.username, first_name = new.first_name, last_name = new.last_name
+            WHERE rowid = (SELECT id FROM {FTS_IDS_TABLE} WHERE user_id = new.id);
+        END
+    """,
+}
+
+
+def ensure_sqlite_index(using=DEFAULT_DB_ALIAS):
+    """
+    Creates the triggers of the SQLite search index, and rebuilds it, if any
+    of them is missing: Django drops them whenever it remakes core_user to
+    alter one of its columns. Run after every migrate.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        existing = {row[0] for row in cursor.fetchall()}
+        if not {FTS_TABLE, FTS_IDS_TABLE} <= existing or SQLITE_TRIGGERS.keys() <= existing:
+            return
+        print('Rebuilding the user search index.')
+        with transaction.atomic(using=using):
+            for name, statement in SQLITE_TRIGGERS.items():
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+                cursor.execute(statement)
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(f'DELETE FROM {FTS_IDS_TABLE}')
+            cursor.execute(f'INSERT INTO {FTS_IDS_TABLE}(user_id) SELECT id FROM core_user')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE}(rowid, username, first_name, last_name) '
+                f'SELECT m.id, u.username, u.first_name, u.last_name '
+                f'FROM {FTS_IDS_TABLE} m JOIN core_user u ON u.id = m.user_id'
+            )
+
+
+@contextmanager
+def time_budget(milliseconds):
+    """
+    Aborts the queries run inside the block once they take longer than `milliseconds`.
+
+    Postgres gets a `statement_timeout` set in a savepoint of its own and put
+    back when the block ends, so it doesn't outlive the block in an enclosing
+    transaction; SQLite gets a progress handler that interrupts the statement
+    once the deadline passes. Either way the query fails with a DatabaseError
+    the caller can handle.
+    """
+    if connection.vendor == 'postgresql':
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT current_setting('statement_timeout')")
+                previous = cursor.fetchone()[0]
+                cursor.execute("SELECT set_config('statement_timeout', %s, true)", [f'{int(milliseconds)}ms'])
+            # On an error, rolling back the savepoint restores the setting.
+            yield
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT set_config('statement_timeout', %s, true)", [previous])
+    elif connection.vendor == 'sqlite':
+        connection.ensure_connection()
+        deadline = time.monotonic() + milliseconds / 1000
+        connection.connection.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        try:
+            yield
+        finally:
+            connection.connection.set_progress_handler(None, 0)
+    else:
+        yield
+
+
+def _ranked(users, query):
+    """
+    Orders users by how well their username matches: exact, then prefix, then the rest.
+    """
+    return users.annotate(
+        match_rank=Case(
+            When(username__iexact=query, then=Value(2)),
+            When(username__istartswith=query, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    )
+
+
+def _postgres_user_ids(query, limit, offset):
+    """
+    Substring search answered by the `pg_trgm` GIN indexes on
+    UPPER(username/first_name/last_name), ranked by trigram similarity.
+    """
+    users = _ranked(User.objects.filter(
+        Q(username__icontains=query) | Q(first_name__icontains=query) | Q(last_name__icontains=query)
+    ), query).annotate(
+        similarity=Greatest(
+            TrigramSimilarity('username', query),
+            TrigramSimilarity('first_name', query),
+            TrigramSimilarity('last_name', query),
+        )
+    ).order_by('-match_rank', '-similarity', 'username')
+    return list(users.values_list('id', flat=True)[offset:offset + limit])
+
+
+def _sqlite_user_ids(query, limit, offset):
+    """
+    Substring search answered by the FTS5 trigram table, ranked by bm25.
+    """
+    phrase = '"{}"'.format(query.replace('"', '""'))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT u.id FROM {FTS_TABLE} s JOIN {FTS_IDS_TABLE} m ON m.id = s.rowid '
+            f'JOIN core_user u ON u.id = m.user_id '
+            f'WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY (u.username = %s COLLATE NOCASE) DESC, (u.username LIKE %s) DESC, '
+            f'bm25({FTS_TABLE}), u.username LIMIT %s OFFSET %s',
+            [phrase, query, query + '%', limit, offset],
+        )
+        return [User._meta.pk.to_python(row[0]) for row in cursor.fetchall()]
+
+
+def _fallback_user_ids(query, limit, offset, prefix_only=False):
+    """
+    Used for queries too short for trigrams, for databases without a search index
+    and when the indexed search runs over budget: short queries (or `prefix_only`)
+    match username prefixes, longer ones fall back to a substring scan.
+    """
+    if prefix_only or len(query) < MIN_TRIGRAM_LENGTH:
+        users = User.objects.filter(username__istartswith=query)
+    else:
+        users = User.objects.filter(username__icontains=query)
+    users = _ranked(users, query).order_by('-match_rank', 'username')
+    return list(users.values_list('id', flat=True)[offset:offset + limit])
+
+
+def search_user_ids(query, limit=20, offset=0):
+    """
+    Returns the ids of the users matching `query`, best match first.
+
+    The query runs under `SEARCH_TIME_BUDGET_MS`; if the indexed search can't
+    answer in time, the cheaper prefix search is used instead.
+    """
+    query = query.strip()
+    if not query:
+        return []
+
+    if len(query) >= MIN_TRIGRAM_LENGTH and connection.vendor in ('postgresql', 'sqlite'):
+        search = _postgres_user_ids if connection.vendor == 'postgresql' else _sqlite_user_ids
+        try:
+            with time_budget(settings.SEARCH_TIME_BUDGET_MS):
+                return search(query, limit, offset)
+        except DatabaseError:
+            # Over budget, or the search index is missing: answer with a prefix search.
+            return _fallback_user_ids(query, limit, offset, prefix_only=True)
+
+    return _fallback_user_ids(query, limit, offset)
+
+
+def search_profiles(query, limit=20, offset=0):
+    """
+    Returns the profiles of the users matching `query`, best match first.
+    """
+    user_ids = search_user_ids(query, limit, offset)
+    profiles = Profile.objects.filter(user_id__in=user_ids).select_related('user')
+    position = {user_id: index for index, user_id in enumerate(user_ids)}
+    return sorted(profiles, key=lambda profile: position[profile.user_id])
+
+
+def load_search_profiles(query, limit, offset):
+    """
+    Cache loader for `cached_search_profiles`: the results and the tags they depend on.
+    """
+    profiles = search_profiles(query, limit, offset)
+    # Stale once a username changes or one of the results is updated
+    return dump_profiles(profiles), [SEARCH_TAG] + [user_tag(profile.user_id) for profile in profiles]
+
+
+def cached_search_profiles(query, limit=20, offset=0):
+    """
+    `search_profiles`, cached for 1 hour and shared by the REST and GraphQL APIs.
+    """
+    query = query.strip().lower()
+    rows = get_or_refresh(
+        f'search_profiles_{query}_{limit}_{offset}',
+        'core.search.load_search_profiles',
+        (query, limit, offset),
+        timeout=60 * 60,
+    )
+    return load_profiles(rows)
@@ -1,18 +1,29 @@
+from django.conf import settings
 from rest_framework import serializers
+from .images import srcset
 from .models import Post, Profile, User
 
 class PostSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = Post
-        fields = ['id', 'user', 'image', 'caption', 'created_at']
+        fields = ['id', 'user', 'image', 'image_variants', 'srcset', 'caption', 'created_at']
+        read_only_fields = ['image_variants']
+
+    def get_srcset(self, post):
+        return srcset(post.image_variants)
         
-class ProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(serializers.ModelSerializer):
+    """
+    A profile nested in its user (`UserSerializer`, `ProfileResponseSerializer`).
+    """
     class Meta:
         model = Profile
         fields = ['user', 'bio', 'profileimg']
 
 class UserSerializer(serializers.ModelSerializer):
-    profile = ProfileSerializer(read_only=True)
+    profile = UserProfileSerializer(read_only=True)
     
     class Meta:
         model = User
@@ -20,14 +31,14 @@ class UserSerializer(serializers.ModelSerializer):
 
 class ProfileResponseSerializer(serializers.Serializer):
     user_object = UserSerializer()
-    user_profile = ProfileSerializer()
+    user_profile = UserProfileSerializer()
     user_posts = PostSerializer(many=True)
     followed = serializers.BooleanField()
     user_followers = serializers.IntegerField()
     user_following = serializers.IntegerField()
 
 class LikePostResponseSerializer(serializers.Serializer):
-    likes = UserSerializer()
+    likes = serializers.IntegerField()
     liked = serializers.BooleanField()
 
 class LikePostSerializer(serializers.Serializer):
@@ -38,7 +49,28 @@ class FollowSerializer(serializers.Serializer):
     followed = serializers.BooleanField()
     message = serializers.CharField()
 
+class BulkLikeSerializer(serializers.Serializer):
+    post_ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=settings.MAX_BULK_ACTIONS)
+    liked = serializers.BooleanField(default=True)
+
+class BulkLikeResponseSerializer(serializers.Serializer):
+    liked = serializers.BooleanField()
+    changed = serializers.ListField(child=serializers.UUIDField())
+    not_found = serializers.ListField(child=serializers.UUIDField())
+
+class BulkFollowSerializer(serializers.Serializer):
+    users = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=settings.MAX_BULK_ACTIONS)
+    followed = serializers.BooleanField(default=True)
+
+class BulkFollowResponseSerializer(serializers.Serializer):
+    followed = serializers.BooleanField()
+    changed = serializers.ListField(child=serializers.UUIDField())
+    not_found = serializers.ListField(child=serializers.UUIDField())
+
 class ProfileSerializer(serializers.ModelSerializer):
+    """
+    A profile on its own: the feed, suggestions, search and profile settings.
+    """
     class Meta:
         model = Profile
         fields = ['bio', 'location', 'profileimg']
@@ -80,6 +112,8 @@ class SignupSerializer(serializers.Serializer):
 
 class FeedSerializer(serializers.Serializer):
      posts_serializer = PostSerializer(many=True)
+     next_cursor = serializers.CharField(allow_null=True)
+     has_next = serializers.BooleanField()
      user_profile_serializer = ProfileSerializer()
      suggestions_serializer = ProfileSerializer(many=True)
         
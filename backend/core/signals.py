@@ -1,13 +1,20 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_migrate, post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
-from django.core.cache import cache
-from .models import Post, FollowersCount, LikePost, User, Profile
-from .tasks import send_welcome_email 
+from django.utils import timezone
+from .models import Post, FollowersCount, LikePost, User, Profile, bulk_toggled
+from .tasks import send_welcome_email, fan_out_post
+from .ranking import hot_score
+from . import effects, media, search
+from .cache import SEARCH_TAG, follows_tag, post_tag, user_tag
+from .payloads import ROW_FIELDS
+
+# Counters, cache invalidations and tasks are queued with `core.effects`, which
+# merges them and runs them once the transaction commits.
 
 # This signal handler creates a Profile only when a new User is created.
 # We use the 'created' flag to ensure it doesn't run on every user save.
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
+def create_user_profile(sender, instance, created, using, **kwargs):
     """
     Handles the creation of a user's profile.
     
@@ -19,8 +26,8 @@ def create_user_profile(sender, instance, created, **kwargs):
     """
     if created:
         Profile.objects.create(user=instance)
-        # Asynchronously send the welcome email
-        send_welcome_email.delay(user_email=instance.email)
+        # Asynchronously send the welcome email, once the user is committed
+        effects.delay(send_welcome_email, instance.email, using=using)
 
 
 # This signal handler will be called every time a User object is deleted.
@@ -41,77 +48,234 @@ def delete_user_profile(sender, instance, **kwargs):
 
 
 
+# The User columns the search index matches on (see `core.search`).
+SEARCH_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(pre_save, sender=User)
+def remember_cached_user_fields(sender, instance, update_fields=None, **kwargs):
+    """
+    Notes the saved values of the user's cached columns, so
+    `invalidate_user_caches` can tell whether this save changes any. Saves
+    of other columns only (e.g. `last_login` on every login) skip the query.
+    """
+    if instance._state.adding:
+        return
+    fields = [field for field in ROW_FIELDS[User] if update_fields is None or field in update_fields]
+    if not fields:
+        instance._cached_fields = {}
+        return
+    saved = User.objects.using(kwargs.get('using')).filter(pk=instance.pk).values(*fields).first()
+    if saved is not None:
+        instance._cached_fields = saved
+
+
 @receiver(post_save, sender=User)
-def clear_search_cache_on_user_update(sender, instance, **kwargs):
+def invalidate_user_caches(sender, instance, created, using, **kwargs):
     """
-    Clears the search cache for a specific user when their profile or user object is saved.
+    Invalidates what is cached about a user if this save changed it, and
+    search results if a new user or name may now match them.
     """
-    cache_key = f'search_results_{instance.username}'
-    cache.delete(cache_key)
+    saved = instance.__dict__.pop('_cached_fields', None)
+    if created or saved is None:
+        effects.invalidate(user_tag(instance.id), SEARCH_TAG, using=using)
+        return
+    changed = {field for field, value in saved.items() if getattr(instance, field) != value}
+    if changed & set(SEARCH_FIELDS):
+        effects.invalidate(user_tag(instance.id), SEARCH_TAG, using=using)
+    elif changed:
+        effects.invalidate(user_tag(instance.id), using=using)
 
 @receiver(post_save, sender=Profile)
-def clear_search_cache_on_profile_update(sender, instance, **kwargs):
+def invalidate_profile_caches(sender, instance, using, **kwargs):
     """
-    Clears the search cache for a user when their profile is updated.
+    Invalidates the cached profile of a user when it is updated.
     """
-    cache_key = f'search_results_{instance.user.username}'
-    cache.delete(cache_key)
+    effects.invalidate(user_tag(instance.user_id), using=using)
 
 
 @receiver(post_save, sender=Post)
 @receiver(post_delete, sender=Post)
-def invalidate_post_caches(sender, instance, **kwargs):
+def invalidate_post_caches(sender, instance, using, **kwargs):
     """
     Invalidates caches when a post is created, updated, or deleted.
     """
-    # Invalidate the cache for the specific post
-    # The key for a single post is likely based on its ID.
-    cache_key_post_retrieve = f"views.decorators.cache.cache_page./posts/{instance.id}/"
-    cache.delete(cache_key_post_retrieve)
-    
-    # Invalidate the cache for the list of all posts
-    cache_key_post_list = "views.decorators.cache.cache_page./posts/"
-    cache.delete(cache_key_post_list)
+    # The post itself, and the author's profile which lists their posts
+    effects.invalidate(post_tag(instance.id), user_tag(instance.user_id), using=using)
 
+@receiver(pre_save, sender=Post)
+def score_new_post(sender, instance, **kwargs):
+    """
+    Gives a new post its initial ranking score; likes move it from there.
+    """
+    if instance._state.adding:
+        instance.score = hot_score(instance.like_count, instance.created_at or timezone.now())
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, using, **kwargs):
+    """
+    Pushes a new post into the followers' timelines once the transaction commits.
+    """
+    if created:
+        effects.delay(fan_out_post, str(instance.id), using=using)
+
+
+@receiver(post_save, sender=FollowersCount)
+def backfill_timeline_on_follow(sender, instance, created, using, **kwargs):
+    """
+    Adds the followed user's recent posts to the follower's timeline.
+    """
+    if created:
+        effects.sync_timeline(str(instance.follower_id), [str(instance.user_id)], True, using=using)
+
+
+@receiver(post_delete, sender=FollowersCount)
+def prune_timeline_on_unfollow(sender, instance, using, **kwargs):
+    """
+    Removes the unfollowed user's posts from the follower's timeline.
+    """
+    effects.sync_timeline(str(instance.follower_id), [str(instance.user_id)], False, using=using)
 
-    # Invalidate the cache for the user's profile, since a post was changed
-    invalidate_profile_cache(instance.user)
 
 @receiver(post_save, sender=LikePost)
+def increment_like_count(sender, instance, created, using, **kwargs):
+    """
+    Bumps the post's denormalized like counter when a like is created.
+    """
+    if created:
+        effects.count_likes([instance.post_id], 1, using=using)
+
+
 @receiver(post_delete, sender=LikePost)
-def invalidate_post_caches_on_like_change(sender, instance, **kwargs):
+def decrement_like_count(sender, instance, using, **kwargs):
     """
-    Invalidates the cache for a specific post when it is liked or unliked.
+    Lowers the post's denormalized like counter when a like is removed.
     """
-    # Invalidate the cache for the specific post
-    cache_key = f"views.decorators.cache.cache_page./posts/{instance.post.id}/"
-    cache.delete(cache_key)
+    effects.count_likes([instance.post_id], -1, using=using)
+
 
 @receiver(post_save, sender=FollowersCount)
-@receiver(post_delete, sender=FollowersCount)
-def invalidate_profile_caches_on_follow(sender, instance, **kwargs):
+def increment_follow_counts(sender, instance, created, using, **kwargs):
     """
-    Invalidates the cache for both the follower and the followed user's profiles.
+    Bumps the follower/following counters on both profiles when a follow is created.
     """
-    # Invalidate the cache of the person who was followed/unfollowed
-    invalidate_profile_cache(User.objects.get(username=instance.user))
+    if created:
+        effects.count_follows(instance.follower_id, [instance.user_id], 1, using=using)
+
 
-    # Invalidate the cache of the person who performed the follow/unfollow action
-    invalidate_profile_cache(User.objects.get(username=instance.follower))
+@receiver(post_delete, sender=FollowersCount)
+def decrement_follow_counts(sender, instance, using, **kwargs):
+    """
+    Lowers the follower/following counters on both profiles when a follow is removed.
+    """
+    effects.count_follows(instance.follower_id, [instance.user_id], -1, using=using)
 
 
-def invalidate_profile_cache(user_or_post):
+@receiver(post_save, sender=LikePost)
+@receiver(post_delete, sender=LikePost)
+def invalidate_post_caches_on_like_change(sender, instance, using, **kwargs):
     """
-    Helper function to invalidate the cache for a given user's profile view.
-    It works for a User object or a Post object.
+    Invalidates the cache for a specific post, and its author's profile, when it
+    is liked or unliked.
     """
-    if isinstance(user_or_post, User):
-        username = user_or_post.username
-    elif isinstance(user_or_post, Post):
-        username = user_or_post.user.username
+    if LikePost.post.is_cached(instance):
+        effects.invalidate(post_tag(instance.post_id), user_tag(instance.post.user_id), using=using)
     else:
-        return # Do nothing if it's not a User or a Post
+        # The authors of all the posts liked in the transaction are looked up at once.
+        effects.invalidate(post_tag(instance.post_id), using=using)
+        effects.invalidate_authors([instance.post_id], using=using)
+
+@receiver(post_save, sender=FollowersCount)
+@receiver(post_delete, sender=FollowersCount)
+def invalidate_profile_caches_on_follow(sender, instance, using, **kwargs):
+    """
+    Invalidates the cache for both the follower and the followed user's profiles,
+    and everything that depends on who the follower follows.
+    """
+    effects.invalidate(
+        user_tag(instance.user_id),
+        user_tag(instance.follower_id),
+        follows_tag(instance.follower_id),
+        using=using,
+    )
 
 
-    cache_key = f'graphql_profile_{username}'
-    cache.delete(cache_key)
\ No newline at end of file
+@receiver(bulk_toggled, sender=LikePost)
+def apply_bulk_likes(sender, actor_id, target_ids, present, using, **kwargs):
+    """
+    Everything the per-like handlers do, for a batch of likes added or removed
+    by `set_many()`.
+    """
+    effects.count_likes(target_ids, 1 if present else -1, using=using)
+    effects.invalidate(*(post_tag(post_id) for post_id in target_ids), using=using)
+    effects.invalidate_authors(target_ids, using=using)
+
+
+@receiver(bulk_toggled, sender=FollowersCount)
+def apply_bulk_follows(sender, actor_id, target_ids, present, using, **kwargs):
+    """
+    Everything the per-follow handlers do, for a batch of follows added or
+    removed by `set_many()`.
+    """
+    effects.count_follows(actor_id, target_ids, 1 if present else -1, using=using)
+    effects.invalidate(
+        *(user_tag(user_id) for user_id in target_ids), user_tag(actor_id), follows_tag(actor_id), using=using,
+    )
+    effects.sync_timeline(str(actor_id), [str(user_id) for user_id in target_ids], present, using=using)
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Profile)
+def remember_stored_media(sender, instance, update_fields=None, **kwargs):
+    """
+    Notes the media files the saved row references, so `count_media_references`
+    can tell which ones this save adds or drops.
+    """
+    media_field = 'image_variants' if sender is Post else 'profileimg'
+    if instance._state.adding:
+        instance._stored_media = set()
+    elif update_fields is None or media_field in update_fields:
+        instance._stored_media = media.stored_paths(instance)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Profile)
+def count_media_references(sender, instance, **kwargs):
+    """
+    Keeps the reference counts of the media blobs in step with the saved row.
+    """
+    stored = instance.__dict__.pop('_stored_media', None)
+    if stored is None:
+        return
+    current = media.referenced_paths(instance)
+    media.acquire(current - stored)
+    media.release(stored - current)
+
+
+@receiver(pre_delete, sender=Post)
+@receiver(pre_delete, sender=Profile)
+def remember_deleted_media(sender, instance, **kwargs):
+    """
+    Notes the media files a post or profile references before it is deleted;
+    the instance being deleted may be older than the row.
+    """
+    instance._stored_media = media.stored_paths(instance)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Profile)
+def release_media(sender, instance, **kwargs):
+    """
+    Drops a deleted post's or profile's references to its media blobs.
+    """
+    media.release(instance.__dict__.pop('_stored_media', set()))
+
+
+@receiver(post_migrate)
+def repair_search_index(sender, using, **kwargs):
+    """
+    Puts back the SQLite search index's triggers after a migration that
+    remade core_user (see `core.search.ensure_sqlite_index`).
+    """
+    if sender.name == 'core':
+        search.ensure_sqlite_index(using)
@@ -0,0 +1,165 @@
+import uuid
+from collections import Counter
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from .cache import follows_tag, get_or_refresh, user_tag
+from .models import FollowersCount, LikePost, Profile, User
+from .payloads import dump_profiles, load_profiles
+
+
+# "Who to follow" candidates are precomputed per user by the periodic
+# `refresh_all_suggestions` task and stored as a ranked list of user ids, so
+# serving them is a cache read plus one query on at most a few dozen ids.
+SUGGESTIONS_KEY = 'suggestions:{}'
+# Kept for two refresh periods, so a late refresh never leaves users without candidates.
+SUGGESTIONS_TIMEOUT = 60 * 60 * 48
+# Number of ranked candidates stored per user.
+MAX_CANDIDATES = 50
+# Only the user's most recent likes are used to find people with similar taste.
+RECENT_LIKES = 200
+
+# How much each kind of connection counts towards a candidate's score.
+FRIEND_OF_FRIEND_WEIGHT = 3   # followed by someone the user follows (per such person)
+LIKED_AUTHOR_WEIGHT = 2       # wrote a post the user liked (per like)
+CO_LIKER_WEIGHT = 1           # liked a post the user liked too (per post)
+
+
+def suggestions_key(user_id):
+    return SUGGESTIONS_KEY.format(user_id)
+
+
+def compute_candidates(user_id, limit=MAX_CANDIDATES):
+    """
+    Ranks the users `user_id` might want to follow, best first.
+
+    Candidates are friends of friends, authors of posts the user liked and
+    people who liked the same posts. Each is a single aggregate query bounded
+    by `limit`, so the cost doesn't depend on the total number of users.
+    """
+    following = FollowersCount.objects.filter(follower_id=user_id).values('user_id')
+    recent_likes = LikePost.objects.filter(user_id=user_id).order_by('-id').values('post_id')[:RECENT_LIKES]
+    scores = Counter()
+
+    friends_of_friends = (
+        FollowersCount.objects.filter(follower_id__in=following)
+        .exclude(user_id__in=following).exclude(user_id=user_id)
+        .values('user_id').annotate(n=Count('id')).order_by('-n')[:limit]
+    )
+    for row in friends_of_friends:
+        scores[row['user_id']] += FRIEND_OF_FRIEND_WEIGHT * row['n']
+
+    liked_authors = (
+        LikePost.objects.filter(user_id=user_id)
+        .exclude(post__user_id__in=following).exclude(post__user_id=user_id)
+        .values('post__user_id').annotate(n=Count('id')).order_by('-n')[:limit]
+    )
+    for row in liked_authors:
+        scores[row['post__user_id']] += LIKED_AUTHOR_WEIGHT * row['n']
+
+    co_likers = (
+        LikePost.objects.filter(post_id__in=recent_likes)
+        .exclude(user_id__in=following).exclude(user_id=user_id)
+        .values('user_id').annotate(n=Count('id')).order_by('-n')[:limit]
+    )
+    for row in co_likers:
+        scores[row['user_id']] += CO_LIKER_WEIGHT * row['n']
+
+    return [str(candidate_id) for candidate_id, score in scores.most_common(limit)]
+
+
+def refresh_candidates(user_ids):
+    """
+    Recomputes and stores the ranked candidates of each of `user_ids`.
+    """
+    cache.set_many(
+        {suggestions_key(user_id): compute_candidates(user_id) for user_id in user_ids},
+        SUGGESTIONS_TIMEOUT,
+    )
+
+
+def _followed_among(user_id, candidate_ids):
+    """
+    The subset of `candidate_ids` that `user_id` already follows.
+    """
+    followed = FollowersCount.objects.filter(follower_id=user_id, user_id__in=candidate_ids)
+    return {str(followed_id) for followed_id in followed.values_list('user_id', flat=True)}
+
+
+def random_user_ids(user_id, count):
+    """
+    Up to `count` random users `user_id` doesn't follow.
+
+    Ids are random UUIDs, so starting a range scan of the primary key at a
+    random UUID picks an unbiased starting point at the cost of an index
+    lookup, instead of sorting the whole table with ORDER BY RANDOM().
+    """
+    sample_size = count * 4
+    pivot = uuid.uuid4()
+    users = User.objects.filter(is_active=True).order_by('id').values_list('id', flat=True)
+    sample = list(users.filter(id__gte=pivot)[:sample_size])
+    if len(sample) < sample_size:
+        # Wrap around to the start of the id space.
+        sample += list(users.filter(id__lt=pivot)[:sample_size - len(sample)])
+    sample = [str(sample_id) for sample_id in sample if str(sample_id) != str(user_id)]
+    followed = _followed_among(user_id, sample)
+    return [sample_id for sample_id in sample if sample_id not in followed][:count]
+
+
+def _schedule_refresh(user_id):
+    from .tasks import refresh_suggestions
+
+    # Once per user until the job has run, however many requests come in meanwhile.
+    if not cache.add(f'lock:{suggestions_key(user_id)}', 1, 60):
+        return
+    try:
+        refresh_suggestions.delay([str(user_id)])
+    except Exception as e:
+        print(f"Could not queue suggestions for user {user_id}: {e}")
+
+
+def suggest_user_ids(user_id, count=4):
+    """
+    Returns the ids of `count` users to suggest to `user_id`, best first.
+
+    Candidates the user has followed since they were computed are skipped.
+    Users without candidates yet (new users, or before the first job run) get
+    theirs computed in the background, and random users meanwhile.
+    """
+    candidates = cache.get(suggestions_key(user_id))
+    if candidates is None:
+        _schedule_refresh(user_id)
+        candidates = []
+
+    window = candidates[:count * 3]
+    followed = _followed_among(user_id, window) if window else set()
+    picked = [candidate_id for candidate_id in window if candidate_id not in followed][:count]
+    if len(picked) < count:
+        extra = [random_id for random_id in random_user_ids(user_id, count) if random_id not in picked]
+        picked += extra[:count - len(picked)]
+    return picked
+
+
+def load_suggestions(user_id):
+    """
+    Cache loader for `cached_suggestions`: the suggested profiles and the tags they depend on.
+    """
+    user_ids = suggest_user_ids(user_id)
+    profiles = Profile.objects.filter(user_id__in=user_ids).select_related('user')
+    position = {str(suggested_id): index for index, suggested_id in enumerate(user_ids)}
+    profiles = sorted(profiles, key=lambda profile: position[str(profile.user_id)])
+    return dump_profiles(profiles), [follows_tag(user_id)] + [user_tag(profile.user_id) for profile in profiles]
+
+
+def cached_suggestions(user_id):
+    """
+    The profiles to suggest to `user_id`, cached for 15 minutes, or until the
+    user follows someone or a suggested profile changes.
+    """
+    return load_profiles(get_or_refresh(
+        f'suggested_profiles_{user_id}',
+        'core.suggestions.load_suggestions',
+        (str(user_id),),
+        timeout=60 * 15,
+    ))
@@ -1,18 +1,34 @@
 import base64
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
-import uuid
-import datetime
+import io
 from django.conf import settings
-from celery import shared_task
+from django.db import transaction
+from celery import current_app, shared_task
 from django.core.mail import send_mail
-from .models import Post
+from .models import Post, User
+from .uploads import staging_storage
+from . import cache, effects, images, ranking, suggestions, timeline
+
+
+def publish_post_image(post, fileobj):
+    """
+    Builds the resized variants of the image in `fileobj` and points the Post at them.
+    """
+    # The post's signals count the references to the new variants (and drop
+    # those to any old ones) in the same transaction that stored them.
+    with transaction.atomic():
+        variants = images.build_variants(fileobj)
+        post.image = variants['full']['url']
+        post.image_variants = variants
+        post.save(update_fields=['image', 'image_variants'])
 
 
 @shared_task
 def process_image_and_update_post(post_id, image_base64_data):
     """
     Processes a base64 encoded image and updates a Post.
+
+    Only used for messages queued before images were staged by `CreatePost`;
+    see `process_staged_image`.
     """
     try:
         post = Post.objects.get(id=post_id)
@@ -23,17 +39,7 @@ def process_image_and_update_post(post_id, image_base64_data):
     try:
         if ';base64,' in image_base64_data:
             format, imgstr = image_base64_data.split(';base64,')
-            ext = format.split('/')[-1]
-
-            timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-            filename = f"{post.user.id}_{timestamp}_{uuid.uuid4().hex}.{ext}"
-            data = ContentFile(base64.b64decode(imgstr), name=filename)
-
-            file_path = default_storage.save(filename, data)
-            image_url = settings.MY_DOMAIN + default_storage.url(file_path)
-
-            post.image = image_url
-            post.save()
+            publish_post_image(post, io.BytesIO(base64.b64decode(imgstr)))
 
             print(f"Successfully processed image for post {post_id} and updated URL.")
             return True
@@ -45,6 +51,30 @@ def process_image_and_update_post(post_id, image_base64_data):
         print(f"Error processing image for post {post_id}: {e}")
         return False
 
+
+@shared_task
+def process_staged_image(post_id, staged_path):
+    """
+    Turns an image staged by `CreatePost` (see `core.uploads`) into resized
+    variants and updates the Post. The staged file is read straight from the
+    staging area and deleted once the Post points at its variants. Errors
+    propagate with the file left in place, so the image consumer can retry
+    the message or dead-letter it.
+    """
+    try:
+        post = Post.objects.get(id=post_id)
+    except Post.DoesNotExist:
+        print(f"Post with ID {post_id} not found. Aborting.")
+        staging_storage.delete(staged_path)
+        return
+
+    with staging_storage.open(staged_path, 'rb') as staged:
+        publish_post_image(post, staged)
+    staging_storage.delete(staged_path)
+
+    print(f"Successfully processed image for post {post_id} and updated URL.")
+    return True
+
 @shared_task
 def send_welcome_email(user_email):
     """
@@ -59,4 +89,97 @@ def send_welcome_email(user_email):
         send_mail(subject, message, from_email, recipient_list, fail_silently=False)
         print(f"Welcome email sent to {user_email}.")
     except Exception as e:
-        print(f"Failed to send welcome email to {user_email}: {e}")
\ No newline at end of file
+        print(f"Failed to send welcome email to {user_email}: {e}")
+
+
+@shared_task
+def fan_out_post(post_id):
+    """
+    Writes a newly created post into the timelines of its author's followers.
+    """
+    try:
+        post = Post.objects.get(id=post_id)
+    except Post.DoesNotExist:
+        return 0
+    return timeline.fan_out_post(post)
+
+
+@shared_task
+def backfill_timeline(owner_id, author_ids):
+    """
+    Adds the recent posts of newly followed users to the follower's timeline.
+    """
+    # Messages queued by older versions carry a single author id.
+    if isinstance(author_ids, str):
+        author_ids = [author_ids]
+    timeline.backfill_timeline(owner_id, author_ids)
+
+
+@shared_task
+def remove_author_from_timeline(owner_id, author_ids):
+    """
+    Removes unfollowed users' posts from the follower's timeline.
+    """
+    if isinstance(author_ids, str):
+        author_ids = [author_ids]
+    timeline.remove_author_from_timeline(owner_id, author_ids)
+
+
+@shared_task
+def apply_side_effects(tags, post_ids, calls):
+    """
+    Runs the invalidations and queues the tasks of a committed transaction,
+    handed off by `core.effects` with `SIDE_EFFECTS=celery`. `calls` are
+    `[task name, args]`.
+    """
+    effects.dispatch(tags, post_ids, [(current_app.tasks[name], args) for name, args in calls])
+
+
+@shared_task
+def refresh_cache_entry(key, loader, args, timeout, stale_timeout, token):
+    """
+    Rebuilds a cache entry served stale by `cache.get_or_refresh`.
+    """
+    cache.refresh(key, loader, args, timeout, stale_timeout, token)
+
+
+@shared_task
+def refresh_suggestions(user_ids):
+    """
+    Recomputes the "who to follow" candidates of the given users.
+    """
+    suggestions.refresh_candidates(user_ids)
+
+
+@shared_task
+def refresh_all_suggestions(batch_size=500):
+    """
+    Periodic job (see CELERY_BEAT_SCHEDULE): queues `refresh_suggestions` for
+    every active user, `batch_size` users per task.
+    """
+    user_ids = User.objects.filter(is_active=True).order_by('id').values_list('id', flat=True)
+    batch = []
+    for user_id in user_ids.iterator(chunk_size=batch_size):
+        batch.append(str(user_id))
+        if len(batch) == batch_size:
+            refresh_suggestions.delay(batch)
+            batch = []
+    if batch:
+        refresh_suggestions.delay(batch)
+
+
+@shared_task
+def refresh_trending():
+    """
+    Periodic job (see CELERY_BEAT_SCHEDULE): recomputes the trending list.
+    """
+    ranking.refresh_trending()
+
+
+@shared_task
+def trim_timelines():
+    """
+    Periodic job (see CELERY_BEAT_SCHEDULE): cuts the timelines fan-out has
+    grown past `TIMELINE_MAX_DEPTH` back to it.
+    """
+    return timeline.trim_overflowing_timelines()
@@ -1,3 +1,367 @@
-from django.test import TestCase
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.http import FileResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from graphql_jwt.shortcuts import get_token
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .cache import SEARCH_TAG, get_or_refresh, get_tagged, invalidate_tags, set_tagged, user_tag
+from .metrics import RequestStats
+from .models import FollowersCount, LikePost, Post, Profile, TimelineEntry, User
+from .renderers import ORJSONRenderer
+from .timeline import trim_overflowing_timelines
+
+# Run with the self-contained benchmark settings (SQLite, in-process cache,
+# Celery tasks run inline):
+#   python manage.py test core --settings=benchmarks.settings
+
+
+class APITestCase(TestCase):
+    """
+    A few users following each other, with posts, and helpers to query the APIs as `self.me`.
+
+    The test's transaction never commits: wrap writes in `self.committed()` to
+    apply their side effects (counters, invalidations, timelines) as a commit would.
+    """
+    def setUp(self):
+        cache.clear()
+        with self.committed():
+            self.users = [
+                User.objects.create_user(username=f'user{i}', password='x', email=f'user{i}@example.com')
+                for i in range(4)
+            ]
+            self.me = self.users[0]
+            for user in self.users[1:]:
+                FollowersCount.objects.create(follower=self.me, user=user)
+            self.posts = [
+                Post.objects.create(user=user, caption=f'{user.username} {i}')
+                for user in self.users[1:] for i in range(3)
+            ]
+
+    def committed(self):
+        return self.captureOnCommitCallbacks(execute=True)
+
+    def get(self, path, user=None):
+        token = AccessToken.for_user(user or self.me)
+        return self.client.get(path, HTTP_AUTHORIZATION=f'JWT {token}')
+
+    def post_json(self, path, data, user=None):
+        token = AccessToken.for_user(user or self.me)
+        return self.client.post(path, data, content_type='application/json', HTTP_AUTHORIZATION=f'JWT {token}')
+
+    def graphql(self, query, variables=None, user=None):
+        """
+        Runs `query` as `user` (`self.me` by default). Returns the response data
+        and the number of SQL queries it took.
+        """
+        token = get_token(user or self.me)
+        with self.committed(), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/graphql', json.dumps({'query': query, 'variables': variables or {}}),
+                content_type='application/json', HTTP_AUTHORIZATION=f'JWT {token}',
+            )
+        data = response.json()
+        self.assertNotIn('errors', data)
+        return data['data'], len(queries)
+
+
+class LoaderTests(APITestCase):
+    PROFILE_WITH_LIKERS = '''
+        query($username: String!) {
+          profile(username: $username) {
+            user { posts { id likes { user { username profile { followersCount isFollowing } } } } }
+          }
+        }
+    '''
+
+    def profile_queries(self, likers):
+        for post in self.posts[:3]:
+            for liker in likers:
+                LikePost.objects.get_or_create(post=post, user=liker)
+        cache.clear()
+        data, queries = self.graphql(self.PROFILE_WITH_LIKERS, {'username': 'user1'})
+        likes = [like for post in data['profile']['user']['posts'] for like in post['likes']]
+        self.assertEqual(len(likes), 3 * len(likers))
+        return queries
+
+    def test_nested_likers_cost_constant_queries(self):
+        self.assertEqual(self.profile_queries(self.users[:1]), self.profile_queries(self.users))
+
+
+class ToggleTests(APITestCase):
+    def like_count(self, post):
+        return Post.objects.values_list('like_count', flat=True).get(id=post.id)
+
+    def test_like_post_toggles(self):
+        post = self.posts[0]
+        with self.committed():
+            response = self.post_json('/like-post', {'post_id': str(post.id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['liked'])
+        self.assertEqual(self.like_count(post), 1)
+
+        with self.committed():
+            response = self.post_json('/like-post', {'post_id': str(post.id)})
+        self.assertFalse(response.json()['liked'])
+        self.assertEqual(self.like_count(post), 0)
+        self.assertFalse(LikePost.objects.filter(post=post).exists())
+
+    def test_setting_likes_twice_is_idempotent(self):
+        post_ids = [post.id for post in self.posts[:3]]
+        with self.committed():
+            changed, missing = LikePost.objects.set_many(self.me.id, post_ids)
+        self.assertCountEqual(changed, post_ids)
+        self.assertEqual(missing, [])
+        with self.committed():
+            changed, _ = LikePost.objects.set_many(self.me.id, post_ids)
+        self.assertEqual(changed, [])
+        self.assertEqual([self.like_count(post) for post in self.posts[:4]], [1, 1, 1, 0])
+
+    def test_follow_toggles_counters(self):
+        followed = self.users[1]
+        counts = lambda: (
+            Profile.objects.values_list('following_count', flat=True).get(user=self.me),
+            Profile.objects.values_list('followers_count', flat=True).get(user=followed),
+        )
+        self.assertEqual(counts(), (3, 1))
+        with self.committed():
+            self.assertFalse(FollowersCount.objects.toggle(self.me.id, followed.id))
+        self.assertEqual(counts(), (2, 0))
+        with self.committed():
+            self.assertTrue(FollowersCount.objects.toggle(self.me.id, followed.id))
+        self.assertEqual(counts(), (3, 1))
+
+
+class FeedPaginationTests(APITestCase):
+    def feed_ids(self, query=''):
+        """
+        The ids of every post of the REST feed, following the cursors from page to page.
+        """
+        ids, cursor = [], None
+        while True:
+            response = self.get(f'/?limit=4{query}' + (f'&cursor={cursor}' if cursor else ''))
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids += [post['id'] for post in data['posts']]
+            if not data['has_next']:
+                return ids
+            cursor = data['next_cursor']
+
+    def test_cursors_walk_the_whole_feed(self):
+        newest_first = sorted(self.posts, key=lambda post: (post.created_at, post.id), reverse=True)
+        self.assertEqual(self.feed_ids(), [str(post.id) for post in newest_first])
+
+    def test_top_cursors_walk_the_whole_feed(self):
+        ids = self.feed_ids('&order=top')
+        self.assertCountEqual(ids, [str(post.id) for post in self.posts])
+
+    def test_graphql_cursor_round_trip(self):
+        query = '''
+            query($after: String) {
+              feed(first: 5, after: $after) { edges { node { id } } pageInfo { endCursor hasNextPage } }
+            }
+        '''
+        first, _ = self.graphql(query)
+        second, _ = self.graphql(query, {'after': first['feed']['pageInfo']['endCursor']})
+        ids = [edge['node']['id'] for page in (first, second) for edge in page['feed']['edges']]
+        self.assertCountEqual(ids, [str(post.id) for post in self.posts])
+        self.assertFalse(second['feed']['pageInfo']['hasNextPage'])
+
+    def test_invalid_cursor(self):
+        for query in ('?cursor=garbage', '?cursor=garbage&order=top', '?order=sideways'):
+            self.assertEqual(self.get(f'/{query}').status_code, 400)
+
+
+# Counts calls of `load_tagged_value`, which `get_or_refresh` finds by its dotted path.
+loads = []
+
+
+def load_tagged_value(user_id):
+    loads.append(user_id)
+    return len(loads), [user_tag(user_id)]
+
+
+class CacheTagTests(APITestCase):
+    def test_invalidating_a_tag_drops_its_entries_only(self):
+        set_tagged('mine', 'a', [user_tag(self.me.id)], 60)
+        set_tagged('theirs', 'b', [user_tag(self.users[1].id)], 60)
+        invalidate_tags(user_tag(self.me.id))
+        self.assertIsNone(get_tagged('mine'))
+        self.assertEqual(get_tagged('theirs'), 'b')
+
+    def test_get_or_refresh_reloads_after_invalidation(self):
+        loads.clear()
+        args = (str(self.me.id),)
+        self.assertEqual(get_or_refresh('value', 'core.tests.load_tagged_value', args), 1)
+        self.assertEqual(get_or_refresh('value', 'core.tests.load_tagged_value', args), 1)
+        invalidate_tags(user_tag(self.me.id))
+        self.assertEqual(get_or_refresh('value', 'core.tests.load_tagged_value', args), 2)
+
+    def test_saving_a_user_invalidates_only_on_cached_changes(self):
+        set_tagged('mine', 'a', [user_tag(self.me.id)], 60)
+        set_tagged('search', 'b', [SEARCH_TAG], 60)
+        with self.committed():
+            self.me.last_login = timezone.now()
+            self.me.save(update_fields=['last_login'])
+            self.me.save()
+        self.assertEqual(get_tagged('mine'), 'a')
+        self.assertEqual(get_tagged('search'), 'b')
+        with self.committed():
+            self.me.email = 'renamed@example.com'
+            self.me.save()
+        self.assertIsNone(get_tagged('mine'))
+        self.assertEqual(get_tagged('search'), 'b')
+        with self.committed():
+            self.me.first_name = 'Renamed'
+            self.me.save(update_fields=['first_name'])
+        self.assertIsNone(get_tagged('search'))
+
+    def test_liking_refreshes_the_cached_profile(self):
+        query = 'query($username: String!) { profile(username: $username) { user { posts { likes { id } } } } }'
+        data, _ = self.graphql(query, {'username': 'user1'})
+        self.assertEqual(sum(len(post['likes']) for post in data['profile']['user']['posts']), 0)
+        with self.committed():
+            LikePost.objects.toggle(self.posts[0].id, self.me.id)
+        data, _ = self.graphql(query, {'username': 'user1'})
+        self.assertEqual(sum(len(post['likes']) for post in data['profile']['user']['posts']), 1)
+
+
+class QueryCountTests(APITestCase):
+    FEED = '''
+        {
+          feed(first: 10) {
+            edges { node { id caption user { username profile { followersCount } } likes { user { username } } } }
+          }
+        }
+    '''
+    PROFILE = '''
+        query($username: String!) {
+          profile(username: $username) {
+            followersCount isFollowing
+            user { username posts { id caption likes { user { username } } } }
+          }
+        }
+    '''
+
+    def like_all_posts(self, likers):
+        with self.committed():
+            for post in self.posts:
+                for user in likers:
+                    LikePost.objects.get_or_create(post=post, user=user)
+        cache.clear()
+
+    def test_feed_queries(self):
+        with self.assertNumQueries(6):
+            self.graphql(self.FEED)
+        # The likers are loaded in one query, however many there are.
+        self.like_all_posts(self.users[:1])
+        with self.assertNumQueries(7):
+            self.graphql(self.FEED)
+        self.like_all_posts(self.users)
+        with self.assertNumQueries(7):
+            self.graphql(self.FEED)
+
+    def test_profile_queries(self):
+        with self.assertNumQueries(5):
+            self.graphql(self.PROFILE, {'username': 'user1'})
+        # The profile page itself comes from the cache.
+        with self.assertNumQueries(2):
+            self.graphql(self.PROFILE, {'username': 'user1'})
+        self.like_all_posts(self.users[:1])
+        with self.assertNumQueries(5):
+            self.graphql(self.PROFILE, {'username': 'user1'})
+        self.like_all_posts(self.users)
+        with self.assertNumQueries(5):
+            self.graphql(self.PROFILE, {'username': 'user1'})
+
+
+class RendererTests(SimpleTestCase):
+    def test_same_json_as_drf(self):
+        data = {'text': 'line\u2028separator é', 'number': 3, 'nested': [None, True, 0.5], 1: 'key'}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_falls_back_to_drf_for_wide_integers(self):
+        data = {'big': 2 ** 70}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class TimelineTests(APITestCase):
+    def timeline(self, user):
+        return list(
+            TimelineEntry.objects.filter(owner=user).order_by('-created_at', '-post_id').values_list('post_id', flat=True)
+        )
+
+    def test_trimming_keeps_the_newest_entries(self):
+        newest_first = self.timeline(self.me)
+        self.assertEqual(len(newest_first), len(self.posts))
+        with self.settings(TIMELINE_MAX_DEPTH=4):
+            # Fan-out leaves the trimming to the periodic job.
+            with self.committed():
+                Post.objects.create(user=self.users[1], caption='new')
+            self.assertEqual(len(self.timeline(self.me)), len(self.posts) + 1)
+            self.assertEqual(trim_overflowing_timelines(), len(self.posts) + 1 - 4)
+            self.assertEqual(self.timeline(self.me)[1:], newest_first[:3])
+            self.assertEqual(trim_overflowing_timelines(), 0)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), MEDIA_SENDFILE='')
+class MediaTests(SimpleTestCase):
+    def setUp(self):
+        self.content = bytes(range(256)) * 1024
+        default_storage.save('photo.png', ContentFile(self.content))
+        self.addCleanup(default_storage.delete, 'photo.png')
+
+    def test_wsgi_serves_a_file_response(self):
+        response = self.client.get('/media/photo.png', HTTP_RANGE='bytes=10-19')
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+
+    async def test_asgi_streams_in_chunks(self):
+        response = await self.async_client.get('/media/photo.png')
+        self.assertTrue(response.is_async)
+        self.assertEqual(int(response['Content-Length']), len(self.content))
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), self.content)
+
+        response = await self.async_client.get('/media/photo.png', headers={'Range': 'bytes=-100'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.content[-100:])
+
+
+class MetricsTests(SimpleTestCase):
+    def test_stats_count_records_from_many_threads(self):
+        stats = RequestStats()
+
+        def record(_):
+            for _ in range(1000):
+                stats.record_query('SELECT 1', 0.001)
+                stats.record_cache(True)
+                stats.record_timing('serialize', 0.001)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(record, range(8)))
+        self.assertEqual(stats.queries, 8000)
+        self.assertEqual(stats.cache_hits, 8000)
+        self.assertEqual(stats.query_shapes['SELECT 1'], 8000)
+
+    @override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_metrics_without_a_token_answer_allowed_addresses_only(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.5').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_with_a_token_require_it(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
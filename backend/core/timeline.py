@@ -0,0 +1,155 @@
+from django.conf import settings
+from django.db.models import Count, Q, prefetch_related_objects
+
+from .models import FollowersCount, Post, Profile, TimelineEntry
+from .pagination import Page, clamp_page_size, encode_cursor, keyset_filter
+from .projection import feed_columns, project_feed
+
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def celebrity_ids(user_ids):
+    """
+    Returns the subset of `user_ids` whose posts are not fanned out on write
+    because they have too many followers.
+    """
+    return set(
+        Profile.objects.filter(user_id__in=user_ids, followers_count__gte=settings.TIMELINE_FANOUT_THRESHOLD)
+        .values_list('user_id', flat=True)
+    )
+
+
+def trim_timeline(owner_id):
+    """
+    Deletes everything past `TIMELINE_MAX_DEPTH` from one timeline. Returns
+    the number of entries deleted.
+
+    The last entry kept is found with a seek on the timeline index, and
+    everything older than it is deleted, so the cost is that of the depth
+    and the overflow, not of a ranking of the whole timeline.
+    """
+    depth = settings.TIMELINE_MAX_DEPTH
+    last_kept = list(
+        TimelineEntry.objects.filter(owner_id=owner_id).order_by('-created_at', '-post_id')
+        .values_list('created_at', 'post_id')[depth - 1:depth]
+    )
+    if not last_kept:
+        return 0
+    created_at, post_id = last_kept[0]
+    deleted, _ = TimelineEntry.objects.filter(owner_id=owner_id).filter(
+        Q(created_at__lt=created_at) | Q(created_at=created_at, post_id__lt=post_id)
+    ).delete()
+    return deleted
+
+
+def trim_overflowing_timelines():
+    """
+    Trims every timeline that has grown past `TIMELINE_MAX_DEPTH`. Fan-out
+    doesn't trim the timelines it writes to, so this runs periodically (see
+    the `trim_timelines` task). Returns the number of entries deleted.
+    """
+    owner_ids = list(
+        TimelineEntry.objects.values('owner_id').annotate(entries=Count('id'))
+        .filter(entries__gt=settings.TIMELINE_MAX_DEPTH).values_list('owner_id', flat=True)
+    )
+    return sum(trim_timeline(owner_id) for owner_id in owner_ids)
+
+
+def fan_out_post(post):
+    """
+    Writes `post` into the timeline of every follower of its author.
+
+    Posts by celebrity accounts are skipped: writing them to millions of
+    timelines would cost far more than merging them in when a feed is read.
+    Timelines are trimmed later, in bulk, by `trim_overflowing_timelines`:
+    reads never go past the first page or the ranked window anyway.
+    """
+    if post.user_id in celebrity_ids([post.user_id]):
+        return 0
+
+    follower_ids = list(FollowersCount.objects.filter(user_id=post.user_id).values_list('follower_id', flat=True))
+
+    for start in range(0, len(follower_ids), FANOUT_BATCH_SIZE):
+        batch = follower_ids[start:start + FANOUT_BATCH_SIZE]
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=owner_id, post_id=post.id, created_at=post.created_at) for owner_id in batch],
+            ignore_conflicts=True,
+        )
+    return len(follower_ids)
+
+
+def backfill_timeline(owner_id, author_ids):
+    """
+    Copies the latest posts of newly followed authors into the follower's timeline.
+    """
+    celebrities = {str(user_id) for user_id in celebrity_ids(author_ids)}
+    author_ids = [author_id for author_id in author_ids if str(author_id) not in celebrities]
+    if not author_ids:
+        return
+
+    posts = Post.objects.filter(user_id__in=author_ids).order_by('-created_at', '-id')\
+        .values_list('id', 'created_at')[:settings.TIMELINE_MAX_DEPTH]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner_id=owner_id, post_id=post_id, created_at=created_at) for post_id, created_at in posts],
+        ignore_conflicts=True,
+    )
+    trim_timeline(owner_id)
+
+
+def remove_author_from_timeline(owner_id, author_ids):
+    """
+    Drops unfollowed authors' posts from the follower's timeline.
+    """
+    TimelineEntry.objects.filter(owner_id=owner_id, post__user_id__in=author_ids).delete()
+
+
+def rebuild_timeline(owner_id):
+    """
+    Rebuilds a user's timeline from scratch out of the posts of the users they follow.
+    """
+    following_ids = list(FollowersCount.objects.filter(follower_id=owner_id).values_list('user_id', flat=True))
+    fanned_out_ids = set(following_ids) - celebrity_ids(following_ids)
+
+    TimelineEntry.objects.filter(owner_id=owner_id).delete()
+    posts = Post.objects.filter(user_id__in=fanned_out_ids).order_by('-created_at', '-id')\
+        .values_list('id', 'created_at')[:settings.TIMELINE_MAX_DEPTH]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner_id=owner_id, post_id=post_id, created_at=created_at) for post_id, created_at in posts],
+        batch_size=FANOUT_BATCH_SIZE,
+    )
+
+
+def read_timeline(user, limit=None, cursor=None, selected=None):
+    """
+    Reads one page of `user`'s home timeline, restricted to the columns that
+    the GraphQL operation `selected` (or the REST feed) needs.
+
+    The page is the materialized timeline merged with the latest posts of any
+    followed celebrity accounts, so both sources are read with a bounded
+    `limit + 1` keyset query.
+    """
+    limit = clamp_page_size(limit)
+
+    only, joined = feed_columns(selected, prefix='post__')
+    entries = TimelineEntry.objects.filter(owner=user).select_related('post', *joined)
+    if only:
+        entries = entries.only('id', 'post', 'created_at', *only)
+    entries = keyset_filter(entries, cursor, created_field='created_at', id_field='post_id')[:limit + 1]
+    posts = [entry.post for entry in entries]
+
+    following_ids = FollowersCount.objects.filter(follower=user).values_list('user_id', flat=True)
+    celebrities = celebrity_ids(following_ids)
+    if celebrities:
+        celebrity_posts = keyset_filter(
+            project_feed(Post.objects.filter(user_id__in=celebrities), selected), cursor,
+        )[:limit + 1]
+        seen = {post.id for post in posts}
+        posts += [post for post in celebrity_posts if post.id not in seen]
+        posts.sort(key=lambda post: (post.created_at, post.id), reverse=True)
+
+    has_next = len(posts) > limit
+    posts = posts[:limit]
+    prefetch_related_objects(posts, 'likes')
+    next_cursor = encode_cursor(posts[-1].created_at, posts[-1].pk) if has_next else None
+    return Page(posts, has_next, next_cursor)
@@ -0,0 +1,83 @@
+import binascii
+import mimetypes
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+
+
+# Uploaded images are written here as soon as they arrive, and only their path
+# is sent to the image worker. It is outside MEDIA_ROOT, so serve_media never
+# serves an image that hasn't been checked and resized yet.
+staging_storage = FileSystemStorage(location=settings.UPLOAD_STAGING_ROOT)
+# Where earlier versions staged uploads inside MEDIA_ROOT; never served.
+LEGACY_STAGING_DIR = 'staging'
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+# Base64 text decoded per step; a multiple of 4 so every chunk decodes on its own.
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+class InvalidUpload(ValueError):
+    """
+    Raised for uploads that are not a supported image.
+    """
+
+
+def _extension(name=None, content_type=None):
+    ext = ''
+    if name and '.' in name:
+        ext = name.rsplit('.', 1)[-1].lower()
+    elif content_type:
+        ext = (mimetypes.guess_extension(content_type) or '').lstrip('.')
+    ext = 'jpg' if ext in ('jpe', 'jpeg') else ext
+    if ext not in ALLOWED_EXTENSIONS:
+        raise InvalidUpload('Unsupported image format.')
+    return ext
+
+
+def stage_upload(upload):
+    """
+    Saves an uploaded file (e.g. from a multipart `Upload`) to the staging area
+    and returns its path in `staging_storage`.
+
+    Django already streamed large uploads to a temporary file, which the
+    filesystem storage moves into place rather than copying.
+    """
+    ext = _extension(upload.name, getattr(upload, 'content_type', None))
+    return staging_storage.save(f'{uuid.uuid4().hex}.{ext}', upload)
+
+
+def decode_base64(data_url):
+    """
+    Decodes a `data:image/...;base64,` string into a temporary uploaded file,
+    which the caller closes.
+
+    The text is decoded a chunk at a time straight into the file, so the
+    decoded image is never held in memory in one piece.
+    """
+    if ';base64,' not in data_url:
+        raise InvalidUpload('Invalid image format.')
+    header, encoded = data_url.split(';base64,', 1)
+    content_type = header.split(':', 1)[-1]
+    ext = _extension(content_type=content_type)
+
+    decoded = TemporaryUploadedFile(f'upload.{ext}', content_type, None, None)
+    try:
+        for start in range(0, len(encoded), BASE64_CHUNK_SIZE):
+            decoded.write(binascii.a2b_base64(encoded[start:start + BASE64_CHUNK_SIZE]))
+    except binascii.Error:
+        decoded.close()
+        raise InvalidUpload('Invalid image data.')
+    decoded.size = decoded.tell()
+    decoded.seek(0)
+    return decoded
+
+
+def stage_base64(data_url):
+    """
+    Decodes a `data:image/...;base64,` string to the staging area and returns
+    its path in `staging_storage`.
+    """
+    with decode_base64(data_url) as decoded:
+        return stage_upload(decoded)
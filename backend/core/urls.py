@@ -14,6 +14,8 @@ urlpatterns = [
     path('follow', views.FollowAPIView.as_view(), name='follow'),
     path('profile/<str:pk>', views.ProfileAPIView.as_view(), name='profile'),
     path('like-post', views.LikePostAPIView.as_view(), name='like-post'),
+    path('like-posts', views.LikePostsAPIView.as_view(), name='like-posts'),
+    path('follow-users', views.FollowUsersAPIView.as_view(), name='follow-users'),
 
     
     path('create-user', views.CreateUserAPIView.as_view(), name='signup'),
@@ -3,18 +3,39 @@ from rest_framework import viewsets, generics
 from rest_framework.response import Response
 from rest_framework import status
 from .models import Profile, FollowersCount, Post, LikePost, User
+from .concurrency import run_reads
+from .feed import FEED_ORDERS, LATEST, get_home_feed
+from .pagination import InvalidCursor, MAX_PAGE_SIZE, clamp_offset, clamp_page_size
+from .representations import POST, PROFILE, USER, USER_PROFILE
+from .search import cached_search_profiles
+from .suggestions import cached_suggestions
 from .serializers import PostSerializer, FeedSerializer, LikePostResponseSerializer, SignUpResponseSerializer, LikePostSerializer, SignupSerializer,ProfileSerializer, FollowSerializer, ProfileResponseSerializer
+from .serializers import BulkFollowResponseSerializer, BulkFollowSerializer, BulkLikeResponseSerializer, BulkLikeSerializer
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from drf_spectacular.utils import extend_schema, OpenApiParameter
-from django.core.cache import cache
+from .cache import SEARCH_TAG, get_or_refresh, user_tag
 from drf_spectacular.types import OpenApiTypes
-from django.db import IntegrityError
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-from django.utils.decorators import method_decorator
-from django.views.decorators.vary import vary_on_headers
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from .metrics import timed
+from .media import IMMUTABLE_CACHE_CONTROL, MUTABLE_CACHE_CONTROL, file_etag, is_blob, store_upload
+from .uploads import LEGACY_STAGING_DIR
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from functools import partial
+from stat import S_ISREG
+from urllib.parse import quote
+import mimetypes
+import os
 
 
 # Create your views here.
@@ -23,51 +44,74 @@ class FeedAPIView(APIView):
     """
         This Path Shows the feed and the homepage for an authenticated user and it returns user_profile 
         and posts of folowers and suggestions users to follow
+
+        Posts are returned one page at a time: pass `next_cursor` back as `?cursor=`
+        to get the next page.
     """
     permission_classes = [IsAuthenticated]
     serializer_class= [FeedSerializer]
     
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='cursor',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description='Opaque cursor returned as `next_cursor` by the previous page.'
+            ),
+            OpenApiParameter(
+                name='limit',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description=f'Number of posts per page (max {MAX_PAGE_SIZE}).'
+            ),
+            OpenApiParameter(
+                name='order',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                enum=FEED_ORDERS,
+                description='`latest` (newest first, default) or `top` (ranked by engagement).'
+            ),
+        ]
+    )
     def get(self, request, *args, **kwargs):
         current_user = request.user
+        order = request.query_params.get('order', LATEST)
+        if order not in FEED_ORDERS:
+            return Response({'error': 'Invalid order.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 1. Get the current user's profile
+        # 1. The user's profile, 2. one page of posts for the user's feed, and
+        # 3. suggestions of users to follow (precomputed by the suggestions job)
+        # don't depend on each other, so they are read concurrently.
         try:
-            user_profile = Profile.objects.get(user_id=current_user.id)
+            user_profile, page, suggestions_profiles = run_reads(
+                partial(Profile.objects.get, user_id=current_user.id),
+                partial(
+                    get_home_feed,
+                    current_user,
+                    limit=request.query_params.get('limit'),
+                    cursor=request.query_params.get('cursor'),
+                    order=order,
+                ),
+                partial(cached_suggestions, current_user.id),
+            )
         except Profile.DoesNotExist:
             return Response({'error': 'Profile not found.'}, status=status.HTTP_404_NOT_FOUND)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # 2. Get the posts for the user's feed
-        # Efficiently get a list of user IDs that the current user is following
-        following_user_ids = FollowersCount.objects.filter(follower=current_user).values_list('user_id', flat=True)
-        
-        # Get all posts from the users being followed in a single query
-        feed = Post.objects.filter(user__id__in=following_user_ids).order_by('-created_at')
-        
-        # 3. Get suggestions for users to follow
-        # Get all users the current user is following or is the current user
-        followed_users_and_self_ids = list(following_user_ids) + [current_user.id]
-
-        # Get a list of users not followed and not the current user
-        suggestions_users = User.objects.exclude(id__in=followed_users_and_self_ids)
-        
-        # Randomize and limit the suggestions to 4
-        suggestions_list = list(suggestions_users.order_by('?')[:4])
-        
-        # Get the profiles for the suggested users
-        suggestions_profiles = Profile.objects.filter(user__in=suggestions_list)
-        
-        # 4. Serialize the data
-        posts_serializer = PostSerializer(feed, many=True)
-        user_profile_serializer = ProfileSerializer(user_profile)
-        suggestions_serializer = ProfileSerializer(suggestions_profiles, many=True)
-        
+        # 4. Serialize the data (same output as FeedSerializer, without its overhead)
+        with timed('serialize'):
+            data = {
+                'user_profile': PROFILE.one(user_profile),
+                'posts': POST.many(page.items),
+                'next_cursor': page.next_cursor,
+                'has_next': page.has_next,
+                'suggestions': PROFILE.many(suggestions_profiles)
+            }
 
         # 5. Return a JSON response
-        return Response({
-            'user_profile': user_profile_serializer.data,
-            'posts': posts_serializer.data,
-            'suggestions': suggestions_serializer.data
-        }, status=status.HTTP_200_OK)
+        return Response(data, status=status.HTTP_200_OK)
 
 
 class PostViewSet(viewsets.ModelViewSet):
@@ -89,26 +133,33 @@ class SearchAPIView(APIView):
 
 
     
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='limit',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description=f'Number of profiles to return (max {MAX_PAGE_SIZE}).'
+            ),
+            OpenApiParameter(
+                name='offset',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='Number of matches to skip.'
+            ),
+        ]
+    )
     def get(self, request,username, *args, **kwargs):
-         # Cache key based on the search parameter
-        cache_key = f'search_results_{username}'
-
-        # Try to get the cached search results
-        searched_profiles = cache.get(cache_key)
-
-        if not searched_profiles:
-            # If not in cache, perform the expensive query
-            username_objects = User.objects.filter(username__icontains=username)
-            searched_profiles = Profile.objects.filter(user__in=username_objects)
-            
-            # Cache the results for 1 hour
-            cache.set(cache_key, searched_profiles, 60 * 60)
-            print("Fetching from DB and setting cache.")
-      
-        
-        searched_serializer = ProfileSerializer(searched_profiles, many=True)
+        limit = clamp_page_size(request.query_params.get('limit'))
+        offset = clamp_offset(request.query_params.get('offset'))
 
-        return Response({'username_profile_list': searched_serializer.data},status=status.HTTP_200_OK)
+        # Cached for 1 hour, or until a username changes or one of the results is updated
+        searched_profiles = cached_search_profiles(username, limit=limit, offset=offset)
+
+        with timed('serialize'):
+            data = PROFILE.many(searched_profiles)
+
+        return Response({'username_profile_list': data},status=status.HTTP_200_OK)
 
 
 class LikePostAPIView(APIView):
@@ -130,62 +181,90 @@ class LikePostAPIView(APIView):
         parameters=[
             OpenApiParameter(
                 name='post_id', 
-                type=OpenApiTypes.INT, 
+                type=OpenApiTypes.UUID, 
                 location=OpenApiParameter.QUERY,
                 description='ID of the post to like.'
             ),
         ]
     )
-
-    
-    @method_decorator(cache_page(60 * 15))  # Cache for 15 minutes
-    def list(self, request, *args, **kwargs):
-        # The list of posts will be cached
-        return super().list(request, *args, **kwargs)
-    
-    @method_decorator(cache_page(60 * 30))  # Cache for 30 minutes
-    def retrieve(self, request, *args, **kwargs):
-        # A single post will be cached
-        return super().retrieve(request, *args, **kwargs)
-    
     def post(self, request, *args, **kwargs):
         # Extract the post_id from the request body
         post_id = request.data.get('post_id')
         if not post_id:
             return Response({'error': 'post_id is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Get the post object and the current user's username
+        # Toggle the like in place; a missing post surfaces as a foreign key violation.
         try:
-            post = Post.objects.get(id=post_id)
-        except Post.DoesNotExist:
+            liked = LikePost.objects.toggle(post_id, request.user.id)
+        except (IntegrityError, ValidationError):
             return Response({'error': 'Post not found.'}, status=status.HTTP_404_NOT_FOUND)
-        
-        current_user = request.user
-        # Check if the user has already liked the post
-        try:
-            # We filter on the 'post' object directly for better query performance.
-            like = LikePost.objects.get(post=post, user=current_user)
-            like.delete()
-            liked = False
-        except LikePost.DoesNotExist:
-            try:
-                # Create a new like record
-                LikePost.objects.create(post=post, user=current_user)
-                liked = True
-            except IntegrityError:
-                # This handles a race condition where a like might be created just before this code runs.
-                liked = False
 
-        
         data_response = {
             'liked': liked,
-            'likes': LikePostSerializer(LikePost.objects.filter(post_id)).data
+            'likes': Post.objects.values_list('like_count', flat=True).get(id=post_id),
         }
 
         # Return a JSON response with the new like count
         return Response(data_response, status=status.HTTP_200_OK)
     
     
+class LikePostsAPIView(APIView):
+    """
+    API endpoint to like (or unlike) many posts at once, e.g. likes made offline.
+
+    A POST request with `post_ids` (and `liked`, true by default) in the body.
+    Unlike `like-post`, it sets the like rather than toggling it, so sending the
+    same batch twice is harmless. Posts that no longer exist are reported in
+    `not_found`.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(request=BulkLikeSerializer, responses=BulkLikeResponseSerializer)
+    def post(self, request, *args, **kwargs):
+        serializer = BulkLikeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        liked = serializer.validated_data['liked']
+
+        # One transaction, one statement per 500 posts, and counters and
+        # caches updated once for the batch.
+        try:
+            changed, not_found = LikePost.objects.set_many(
+                request.user.id, serializer.validated_data['post_ids'], present=liked
+            )
+        except IntegrityError:
+            # A post was deleted while the batch was being applied.
+            return Response({'error': 'Post not found.'}, status=status.HTTP_409_CONFLICT)
+
+        return Response({'liked': liked, 'changed': changed, 'not_found': not_found}, status=status.HTTP_200_OK)
+
+
+def load_profile_data(username):
+    """
+    Cache loader for `ProfileAPIView`: the viewer-independent part of a profile.
+    """
+    try:
+        user_object = User.objects.select_related('profile').get(username=username)
+    except User.DoesNotExist:
+        # Until a user takes this username
+        return None, [SEARCH_TAG]
+    user_profile = user_object.profile
+    # Only the columns the response shows, as plain rows rather than model instances
+    user_posts = Post.objects.filter(user=user_object).order_by('-created_at').values(*POST.columns)
+
+    # Same output as ProfileResponseSerializer. Follower counts are
+    # denormalized onto the profile row, no COUNT(*) needed.
+    with timed('serialize'):
+        profile_data = {
+            'user_object': USER.one(user_object),
+            'user_profile': USER_PROFILE.one(user_profile),
+            'user_posts': POST.from_rows(user_posts),
+            'followed': False,
+            'user_followers': user_profile.followers_count,
+            'user_following': user_profile.following_count,
+        }
+    return profile_data, [user_tag(user_object.id)]
+
+
 class ProfileAPIView(APIView):
     """
     Retrieve a user's profile information.
@@ -198,32 +277,18 @@ class ProfileAPIView(APIView):
         description="Returns detailed information about a user's profile, including their posts, follower count, and follow status.",
         tags=['Profiles']
     )
-    # With auth: cache requested url for each user for 2 hours
-    @method_decorator(cache_page(60 * 60 * 2))
-    @method_decorator(vary_on_headers("Authorization"))
     def get(self,request,pk,*args, **kwargs):
-        user_object = User.objects.get(username=pk)
-        user_profile = Profile.objects.get(user=user_object)
-        user_posts = Post.objects.filter(user=pk)
-
-        follower = request.user.username
-        followed = False
-
-        if FollowersCount.objects.filter(follower=follower, user=pk).first():
-            followed = True
-
-        user_followers = len(FollowersCount.objects.filter(user=pk))
-        user_following = len(FollowersCount.objects.filter(follower=pk))
-
-        response_data = {
-            'user_object': user_object,
-            'user_profile': user_profile,
-            'user_posts': user_posts,
-            'followed': followed,
-            'user_followers': user_followers,
-            'user_following': user_following,
-        }
-        # serializer = ProfileResponseSerializer(response_data) 
+        # The profile itself is the same for every viewer: cache it for 2 hours,
+        # or until anything about this user changes.
+        profile_data = get_or_refresh(f'rest_profile_{pk}', 'core.views.load_profile_data', (pk,), timeout=60 * 60 * 2)
+        if profile_data is None:
+            return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        # Whether the viewer follows this user is per viewer, so it is never cached.
+        response_data = dict(profile_data)
+        response_data['followed'] = FollowersCount.objects.filter(
+            follower=request.user, user_id=profile_data['user_object']['id']
+        ).exists()
         return Response(response_data,status=status.HTTP_200_OK)
 
 class FollowAPIView(generics.GenericAPIView):
@@ -250,19 +315,46 @@ class FollowAPIView(generics.GenericAPIView):
     )
     def post(self, request, *args, **kwargs):
         # Get the user to be followed from the validated data
-        user_to_follow_username = request.data['user']
-        # The follower is the authenticated user
-        follower_username = request.user.username
-
-         # Check if the follow relationship exists
-        if FollowersCount.objects.filter(follower=follower_username, user=user_to_follow_username).exists():
-            # Unfollow if it exists
-            FollowersCount.objects.get(follower=follower_username, user=user_to_follow_username).delete()
-            return Response({'message': 'Unfollowed successfully', 'followed':False}, status=status.HTTP_200_OK)
-        else:
-            # Follow if it doesn't exist
-            FollowersCount.objects.create(follower=follower_username, user=user_to_follow_username)
+        user_to_follow_id = request.data.get('user')
+        if not user_to_follow_id:
+            return Response({'error': 'user is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Follow or unfollow in place; an unknown user surfaces as a foreign key violation.
+        try:
+            followed = FollowersCount.objects.toggle(request.user.id, user_to_follow_id)
+        except (IntegrityError, ValidationError):
+            return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        if followed:
             return Response({'message': 'Followed successfully', 'followed':True}, status=status.HTTP_201_CREATED)
+        return Response({'message': 'Unfollowed successfully', 'followed':False}, status=status.HTTP_200_OK)
+
+
+class FollowUsersAPIView(APIView):
+    """
+    API endpoint to follow (or unfollow) many users at once, e.g. follows made offline.
+
+    A POST request with `users` (ids, and `followed`, true by default) in the
+    body. It sets the follow rather than toggling it, so sending the same batch
+    twice is harmless. Users that don't exist are reported in `not_found`.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(request=BulkFollowSerializer, responses=BulkFollowResponseSerializer, tags=['Follow'])
+    def post(self, request, *args, **kwargs):
+        serializer = BulkFollowSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        followed = serializer.validated_data['followed']
+
+        try:
+            changed, not_found = FollowersCount.objects.set_many(
+                request.user.id, serializer.validated_data['users'], present=followed
+            )
+        except IntegrityError:
+            # A user was deleted while the batch was being applied.
+            return Response({'error': 'User not found.'}, status=status.HTTP_409_CONFLICT)
+
+        return Response({'followed': followed, 'changed': changed, 'not_found': not_found}, status=status.HTTP_200_OK)
 
 
 class ProfileSettingsAPIView(generics.RetrieveUpdateAPIView):
@@ -281,8 +373,13 @@ class ProfileSettingsAPIView(generics.RetrieveUpdateAPIView):
 
     def perform_update(self, serializer):
         # This method is called when the update is performed
-        # The serializer handles saving the new data, including the image
-        serializer.save()
+        # A new image is stored by content hash, so re-uploading a picture costs no space
+        upload = serializer.validated_data.pop('profileimg', None)
+        with transaction.atomic():
+            if upload is not None:
+                serializer.save(profileimg=store_upload(upload, 'profile_images'))
+            else:
+                serializer.save()
 
 
 class CreateUserAPIView(generics.CreateAPIView):
@@ -302,4 +399,148 @@ class CreateUserAPIView(generics.CreateAPIView):
             {"message": "User registered successfully."},
             status=status.HTTP_201_CREATED,
             headers=headers
-        )
\ No newline at end of file
+        )
+
+def _byte_range(header, size):
+    """
+    Parses a `Range: bytes=...` header into an inclusive `(first, last)`.
+
+    Returns None to serve the whole file (no header, or several ranges, which
+    browsers don't ask for images), and raises ValueError if the range lies
+    outside the file.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if not first:
+            # The last N bytes.
+            first, last = max(size - int(last), 0), size - 1
+        else:
+            first, last = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if first > last or first >= size:
+        raise ValueError(header)
+    return first, last
+
+
+# Bytes read per step when streaming a media file to an ASGI server.
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+
+class _FileRange:
+    """
+    Reads at most `length` bytes of `file` from its current position.
+
+    It keeps `fileno()`, so WSGI servers with sendfile() support (gunicorn's
+    sync workers) still hand the range to the kernel instead of copying it
+    through Python.
+    """
+    def __init__(self, file, length):
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+async def _read_async(file, length):
+    """
+    Yields `length` bytes of `file` from its current position a chunk at a
+    time, reading in a worker thread, then closes it.
+    """
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        while length > 0:
+            chunk = await read(min(MEDIA_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serves a file from `MEDIA_ROOT` with a strong ETag, 304s, byte ranges and
+    far-future caching for content-addressed files.
+
+    With `MEDIA_SENDFILE` set, the web server in front (nginx, Apache) is told
+    to send the file itself, so image traffic doesn't hold an app worker.
+    Otherwise Django streams it: under ASGI (the default uvicorn workers) a
+    chunk at a time through an async iterator, since Django's ASGI handler
+    would read a sync one into memory whole; under WSGI as a FileResponse,
+    which gunicorn's sync workers send with sendfile().
+    """
+    if os.path.normpath(path).startswith(f'{LEGACY_STAGING_DIR}/'):
+        raise Http404('No such media file.')
+    try:
+        full_path = default_storage.path(path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('No such media file.')
+    if not S_ISREG(stat.st_mode):
+        raise Http404('No such media file.')
+
+    etag = file_etag(path, stat)
+    headers = {
+        'ETag': etag,
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if is_blob(path) else MUTABLE_CACHE_CONTROL,
+    }
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        # nginx answers Range and conditional requests for the internal location itself.
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(path)
+        return response
+    if settings.MEDIA_SENDFILE == 'x-sendfile':
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['X-Sendfile'] = full_path
+        return response
+
+    headers['Accept-Ranges'] = 'bytes'
+    headers['Last-Modified'] = http_date(stat.st_mtime)
+    byte_range = None
+    if request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = _byte_range(request.headers.get('Range'), stat.st_size)
+        except ValueError:
+            headers['Content-Range'] = f'bytes */{stat.st_size}'
+            return HttpResponse(status=416, headers=headers)
+
+    file = open(full_path, 'rb')
+    status_code, length = 200, stat.st_size
+    if byte_range is not None:
+        first, last = byte_range
+        file.seek(first)
+        headers['Content-Range'] = f'bytes {first}-{last}/{stat.st_size}'
+        status_code, length = 206, last - first + 1
+
+    if isinstance(request, ASGIRequest):
+        headers['Content-Length'] = length
+        return StreamingHttpResponse(
+            _read_async(file, length), status=status_code, content_type=content_type, headers=headers,
+        )
+    if byte_range is not None:
+        headers['Content-Length'] = length
+        file = _FileRange(file, length)
+    return FileResponse(file, status=status_code, content_type=content_type, headers=headers)
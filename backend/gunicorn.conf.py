@@ -0,0 +1,31 @@
+import multiprocessing
+import os
+
+# gunicorn settings, used by docker-compose and the Kubernetes deployment:
+#   gunicorn social_book.asgi:application -c gunicorn.conf.py
+#
+# By default each worker is a uvicorn (ASGI) worker: it keeps serving other
+# requests while one waits on the database or Redis, since Django runs every
+# request's sync views in a thread of its own. Set GUNICORN_WORKER_CLASS=sync
+# (and serve social_book.wsgi:application) to go back to one request at a
+# time per worker.
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn_worker.UvicornWorker')
+# Seconds a worker may spend on a request before it is restarted.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then, so slow leaks can't build up.
+max_requests = 5000
+max_requests_jitter = 500
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    # Replay messages spooled while RabbitMQ was down (e.g. before a restart)
+    # as soon as the worker starts, and every so often from then on.
+    from social_book.utils.rabbitmq import get_publisher
+
+    get_publisher()
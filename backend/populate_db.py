@@ -1,112 +1,311 @@
 import os
 import django
-import random
+import io
+import json
+import time
 import uuid
+import heapq
+import random
+import argparse
+import itertools
+from array import array
 from faker import Faker
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_book.settings')
 django.setup()
 
-from django.contrib.auth import get_user_model
-from core.models import Profile, Post, LikePost, FollowersCount
-from django.db import IntegrityError
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+from core.models import FollowersCount, LikePost, Post, Profile, TimelineEntry, User
+from core.ranking import hot_score
 
-# Get the User model
-User = get_user_model()
+# Generates a realistic data set for load testing, fast enough for millions of
+# rows: rows are written with COPY on Postgres and batched INSERTs elsewhere
+# (see `write_rows`), every user shares one precomputed password hash, and the same
+# --seed always generates the same users, posts, likes and follows (timestamps
+# are relative to when it runs).
+#
+# Popularity follows a power law, like on real social networks: a few users get
+# most of the follows, and their posts most of the likes, while the number of
+# posts, follows and likes per user is heavy-tailed around the given means.
+#
+# Since rows are inserted in bulk, no signals fire: the counters, scores and
+# home timelines that signals normally maintain are computed here instead.
 
-# Initialize Faker
-fake = Faker()
-
-# --- Configuration ---
-NUM_USERS = 50
+# --- Configuration (defaults, see --help) ---
+NUM_USERS = 1000
 POSTS_PER_USER = 10
+FOLLOWS_PER_USER = 20
+LIKES_PER_USER = 50
+PASSWORD = 'admin123'
 # ---------------------
 
-def run():
+# Shape of the heavy-tailed per-user counts: a Pareto distribution with this
+# index has a mean of PARETO_INDEX / (PARETO_INDEX - 1) = 3.
+PARETO_INDEX = 1.5
+# Sampling pools, so Faker isn't called once per row.
+POOL_SIZE = 1000
+
+
+def heavy_tailed(rng, mean, cap):
+    """
+    A count with the given mean and a long tail, capped at `cap`.
+    """
+    return min(int(rng.paretovariate(PARETO_INDEX) * mean / 3), cap)
+
+
+def zipf_cum_weights(rng, n, exponent):
+    """
+    Cumulative weights giving a random permutation of `range(n)` Zipf-distributed
+    popularity: the k-th most popular item is picked with probability ~ 1/k^exponent.
+    Returns `(weights, cum_weights)`.
+    """
+    ranks = list(range(1, n + 1))
+    rng.shuffle(ranks)
+    weights = [rank ** -exponent for rank in ranks]
+    return weights, list(itertools.accumulate(weights))
+
+
+def sample_distinct(rng, cum_weights, k, exclude=None):
+    """
+    Up to `k` distinct indices picked by weight (fewer if the draws collide).
+    """
+    picks = set(rng.choices(range(len(cum_weights)), cum_weights=cum_weights, k=k))
+    picks.discard(exclude)
+    return sorted(picks)
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+def _copy_text(value):
+    """
+    Formats a value for Postgres' COPY text format.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def write_rows(model, fields, rows, batch_size):
+    """
+    Inserts `rows` (tuples of values for the `fields` attnames) into `model`'s
+    table and returns how many there were.
+
+    Uses COPY on Postgres (psycopg2), and otherwise batched `executemany` INSERTs
+    of the values prepared the way `bulk_create` would, minus building a model
+    instance per row, and without `auto_now_add` overwriting the generated dates.
+    """
+    quote = connection.ops.quote_name
+    model_fields = [model._meta.get_field(name) for name in fields]
+    table = quote(model._meta.db_table)
+    columns = ', '.join(quote(field.column) for field in model_fields)
+    count = 0
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql' and connection.Database.__name__ == 'psycopg2':
+            sql = f'COPY {table} ({columns}) FROM STDIN'
+            for batch in batched(rows, batch_size):
+                buffer = io.StringIO()
+                buffer.writelines('\t'.join(map(_copy_text, row)) + '\n' for row in batch)
+                buffer.seek(0)
+                cursor.cursor.copy_expert(sql, buffer)
+                count += len(batch)
+            return count
+
+        sql = f'INSERT INTO {table} ({columns}) VALUES ({", ".join(["%s"] * len(fields))})'
+        for batch in batched(rows, batch_size):
+            cursor.executemany(sql, [
+                [field.get_db_prep_save(value, connection) for field, value in zip(model_fields, row)]
+                for row in batch
+            ])
+            count += len(batch)
+    return count
+
+
+def clear_data():
+    """
+    Deletes the posts, likes, follows and timelines, and every user who isn't staff.
+
+    Plain DELETEs rather than the ORM's cascade, which would load every row and
+    send its signals.
+    """
+    quote = connection.ops.quote_name
+    regular_users = f'SELECT {quote("id")} FROM {quote(User._meta.db_table)} WHERE NOT is_staff AND NOT is_superuser'
+    with connection.cursor() as cursor:
+        for model in (TimelineEntry, LikePost, FollowersCount, Post):
+            cursor.execute(f'DELETE FROM {quote(model._meta.db_table)}')
+        for model, column in (
+            (Profile, 'user_id'),
+            (User.groups.through, 'user_id'),
+            (User.user_permissions.through, 'user_id'),
+        ):
+            cursor.execute(f'DELETE FROM {quote(model._meta.db_table)} WHERE {quote(column)} IN ({regular_users})')
+        cursor.execute(f'DELETE FROM {quote(User._meta.db_table)} WHERE {quote("id")} IN ({regular_users})')
+
+
+def run(num_users=NUM_USERS, posts_per_user=POSTS_PER_USER, follows_per_user=FOLLOWS_PER_USER,
+        likes_per_user=LIKES_PER_USER, days=30, skew=1.0, seed=0, batch_size=5000,
+        timelines=True, clear=True):
     """
     Main function to populate the database with mock data.
     """
-    print("Starting to populate database with mock data...")
-    print("--- WARNING: This script will delete all existing data from Profile, Post, LikePost, and FollowersCount tables. ---")
-
-    # --- Clean up existing data ---
-    Profile.objects.all().delete()
-    Post.objects.all().delete()
-    LikePost.objects.all().delete()
-    FollowersCount.objects.all().delete()
-    print("Existing data has been cleared from models.")
-
-    # --- Create Users and Profiles ---
-    print(f"Creating {NUM_USERS} users...")
-    users = []
-    for _ in range(NUM_USERS):
-        username = fake.user_name()
-        print(f'username {username}')
-        firstName = fake.first_name_male()
-        lastName = fake.last_name_male()
-        try:
-            user = User.objects.create_user(username=username, password='admin123', first_name=firstName,last_name=lastName)
-            # Profile.objects.create(user=user)
-            users.append(user)
-        except IntegrityError:
-            # Handle cases where a username might already exist
-            continue
-    print(f"Created {len(users)} users and profiles.")
-
-    # --- Create Posts ---
-    print("Creating posts...")
-    posts = []
-    for user in users:
-        for _ in range(POSTS_PER_USER):
-            # Create a realistic creation date within the last 30 days
-            created_at = datetime.now() - timedelta(days=random.randint(1, 30), seconds=random.randint(1, 86400))
-            post = Post.objects.create(
-                user=user,
-                caption=fake.sentence(nb_words=10),
-                created_at=created_at
+    rng = random.Random(seed)
+    fake = Faker()
+    fake.seed_instance(seed)
+    new_id = lambda: uuid.UUID(int=rng.getrandbits(128), version=4)
+    now = timezone.now()
+    started = time.monotonic()
+    written = 0
+
+    def report(label, count):
+        nonlocal written
+        written += count
+        elapsed = time.monotonic() - started
+        print(f"{label}: {count} rows ({written} in {elapsed:.1f}s, {written / elapsed * 60:,.0f} rows/min)")
+
+    first_names = [fake.first_name() for _ in range(POOL_SIZE)]
+    last_names = [fake.last_name() for _ in range(POOL_SIZE)]
+    sentences = [fake.sentence(nb_words=10) for _ in range(POOL_SIZE)]
+    bios = [fake.sentence(nb_words=20) for _ in range(POOL_SIZE)]
+    cities = [fake.city() for _ in range(POOL_SIZE)]
+    password = make_password(PASSWORD)
+
+    with transaction.atomic():
+        if clear:
+            print("--- WARNING: Deleting all posts, likes, follows and non-staff users. ---")
+            clear_data()
+
+        # --- Users ---
+        user_ids = [new_id() for _ in range(num_users)]
+        # Indices are unique per seed; the random prefix keeps runs with different seeds apart.
+        prefix = rng.getrandbits(24)
+
+        def user_rows():
+            for index, user_id in enumerate(user_ids):
+                first, last = rng.choice(first_names), rng.choice(last_names)
+                username = f'{first.lower()}.{last.lower()}.{prefix:x}{index}'
+                joined = now - timedelta(days=days, seconds=rng.randint(0, 86400 * days))
+                yield (user_id, username, password, first, last, None, False, True, False, joined)
+
+        report("Users", write_rows(User, (
+            'id', 'username', 'password', 'first_name', 'last_name', 'email',
+            'is_staff', 'is_active', 'is_superuser', 'date_joined',
+        ), user_rows(), batch_size))
+
+        # --- Follows: the popular users get most of them ---
+        user_weights, user_cum_weights = zipf_cum_weights(rng, num_users, skew)
+        followers_count = array('I', [0]) * num_users
+        following = []
+        for follower in range(num_users):
+            followed = sample_distinct(
+                rng, user_cum_weights, heavy_tailed(rng, follows_per_user, num_users - 1), exclude=follower,
             )
-            posts.append(post)
-    print(f"Created {len(posts)} posts.")
-    
-
-    # --- Create Likes ---
-    print("Creating likes...")
-    all_posts = Post.objects.all()
-    for user in users:
-        # Each user will like a random number of posts
-        num_likes = random.randint(0, len(all_posts) // 5)
-        liked_posts = random.sample(list(all_posts), num_likes)
-        
-        for post in liked_posts:
-            try:
-                LikePost.objects.create(post=post, user=user)
-            except IntegrityError:
-                # Handle cases where a user might like the same post twice
-                continue
-    print("Likes have been created.")
-
-    # --- Create Follows ---
-    print("Creating followers...")
-    for user in users:
-        # A user can follow up to 10 other users
-        num_follows = random.randint(0, 10)
-        users_to_follow = random.sample([u for u in users if u != user], num_follows)
-        for followed_user in users_to_follow:
-            try:
-                # The 'follower' is the one initiating the follow, 'user' is the one being followed.
-                FollowersCount.objects.create(follower=user, user=followed_user)
-            except IntegrityError:
-                # Handle cases where a user might try to follow someone they already follow
-                continue
-    print("Follows have been created.")
+            for user in followed:
+                followers_count[user] += 1
+            following.append(followed)
+
+        report("Follows", write_rows(FollowersCount, ('follower_id', 'user_id'), (
+            (user_ids[follower], user_ids[user]) for follower, followed in enumerate(following) for user in followed
+        ), batch_size))
+
+        report("Profiles", write_rows(Profile, (
+            'user_id', 'bio', 'location', 'profileimg', 'followers_count', 'following_count',
+        ), (
+            (user_id, rng.choice(bios), rng.choice(cities), 'blank-profile-picture.png',
+             followers_count[index], len(following[index]))
+            for index, user_id in enumerate(user_ids)
+        ), batch_size))
+
+        # --- Posts ---
+        post_ids, post_authors, post_times = [], array('I'), []
+        for author in range(num_users):
+            for _ in range(heavy_tailed(rng, posts_per_user, posts_per_user * 50)):
+                post_ids.append(new_id())
+                post_authors.append(author)
+                post_times.append(now - timedelta(seconds=rng.randint(60, 86400 * days)))
+        num_posts = len(post_ids)
 
+        # --- Likes: posts by popular users get more of them ---
+        like_count = array('I', [0]) * num_posts
+        liker, liked = array('I'), array('I')
+        if num_posts:
+            post_cum_weights = list(itertools.accumulate(
+                user_weights[author] * rng.paretovariate(2) for author in post_authors
+            ))
+            for user in range(num_users):
+                for post in sample_distinct(rng, post_cum_weights, heavy_tailed(rng, likes_per_user, num_posts)):
+                    liker.append(user)
+                    liked.append(post)
+                    like_count[post] += 1
+
+        report("Posts", write_rows(Post, (
+            'id', 'user_id', 'image', 'image_variants', 'caption', 'created_at', 'like_count', 'score',
+        ), (
+            (post_ids[post], user_ids[post_authors[post]], '', {}, rng.choice(sentences), post_times[post],
+             like_count[post], hot_score(like_count[post], post_times[post]))
+            for post in range(num_posts)
+        ), batch_size))
+
+        report("Likes", write_rows(LikePost, ('post_id', 'user_id'), (
+            (post_ids[post], user_ids[user]) for user, post in zip(liker, liked)
+        ), batch_size))
+
+        # --- Home timelines (what fan-out-on-write would have built) ---
+        if timelines:
+            posts_by_author = [[] for _ in range(num_users)]
+            for post in sorted(range(num_posts), key=post_times.__getitem__, reverse=True):
+                posts_by_author[post_authors[post]].append(post)
+            celebrities = {user for user in range(num_users) if followers_count[user] >= settings.TIMELINE_FANOUT_THRESHOLD}
+
+            def timeline_rows():
+                for owner, followed in enumerate(following):
+                    merged = heapq.merge(
+                        *(posts_by_author[user] for user in followed if user not in celebrities),
+                        key=post_times.__getitem__, reverse=True,
+                    )
+                    for post in itertools.islice(merged, settings.TIMELINE_MAX_DEPTH):
+                        yield (user_ids[owner], post_ids[post], post_times[post])
+
+            report("Timeline entries", write_rows(
+                TimelineEntry, ('owner_id', 'post_id', 'created_at'), timeline_rows(), batch_size,
+            ))
 
     print("\n--- Population complete! ---")
-    print(f"Total Users: {User.objects.count()}")
-    print(f"Total Posts: {Post.objects.count()}")
-    print(f"Total Likes: {LikePost.objects.count()}")
-    print(f"Total Follows: {FollowersCount.objects.count()}")
+    print(f"Total Users: {num_users}")
+    print(f"Total Posts: {num_posts}")
+    print(f"Total Likes: {len(liker)}")
+    print(f"Total Follows: {sum(map(len, following))}")
+    print(f"Every user's password is '{PASSWORD}'.")
+
 
 if __name__ == '__main__':
-    run()
+    parser = argparse.ArgumentParser(description="Fills the database with generated users, posts, likes and follows.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--posts', type=float, default=POSTS_PER_USER, help="Mean posts per user.")
+    parser.add_argument('--follows', type=float, default=FOLLOWS_PER_USER, help="Mean follows per user.")
+    parser.add_argument('--likes', type=float, default=LIKES_PER_USER, help="Mean likes per user.")
+    parser.add_argument('--days', type=int, default=30, help="Spread the posts over this many past days.")
+    parser.add_argument('--skew', type=float, default=1.0, help="Zipf exponent of user popularity.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--no-timelines', dest='timelines', action='store_false',
+                        help="Don't build the home timelines.")
+    parser.add_argument('--append', dest='clear', action='store_false',
+                        help="Keep the existing data instead of deleting it first.")
+    args = parser.parse_args()
+    run(
+        num_users=args.users, posts_per_user=args.posts, follows_per_user=args.follows,
+        likes_per_user=args.likes, days=args.days, skew=args.skew, seed=args.seed,
+        batch_size=args.batch_size, timelines=args.timelines, clear=args.clear,
+    )
@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     "corsheaders.middleware.CorsMiddleware",
@@ -110,9 +111,15 @@ DATABASES = {
          'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'toor'),
          'HOST': os.getenv('DATABASE_HOST', '127.0.0.1'),
          'PORT': os.getenv('DATABASE_PORT', 5432),
+         # Keep connections open between requests (and in the core.concurrency threads).
+         'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 60)),
+         'CONN_HEALTH_CHECKS': True,
      }
  }
 
+# Threads per process running a request's independent reads concurrently (core.concurrency).
+PARALLEL_READ_THREADS = int(os.getenv('PARALLEL_READ_THREADS', 8))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -161,6 +168,15 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Where uploaded images wait for the image worker: outside MEDIA_ROOT, so
+# unprocessed uploads are never served. Must be shared with the worker.
+UPLOAD_STAGING_ROOT = os.getenv('UPLOAD_STAGING_ROOT', os.path.join(BASE_DIR, 'staging'))
+# How core.views.serve_media hands files to the web server in front of Django:
+# 'x-accel-redirect' (nginx), 'x-sendfile' (Apache/lighttpd), or '' to stream
+# them from Django (in chunks under ASGI, with sendfile() under WSGI workers).
+MEDIA_SENDFILE = os.getenv('MEDIA_SENDFILE', '')
+# The nginx `internal` location that aliases MEDIA_ROOT, for X-Accel-Redirect.
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
 
 
 REST_FRAMEWORK = {
@@ -172,7 +188,12 @@ REST_FRAMEWORK = {
     ),
         'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
-    )
+    ),
+    # Same JSON as DRF's JSONRenderer, encoded with orjson
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
 
@@ -204,6 +225,7 @@ GRAPHENE = {
     "SCHEMA": "social_book.schema.schema",
     "MIDDLEWARE": [
         "graphql_jwt.middleware.JSONWebTokenMiddleware",
+        "core.metrics.GraphQLMetricsMiddleware",
     ],
 
 }
@@ -246,7 +268,58 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+# Periodic jobs, run by `celery -A social_book beat`
+CELERY_BEAT_SCHEDULE = {
+    # Precomputes the "who to follow" candidates of every user.
+    'refresh-suggestions': {
+        'task': 'core.tasks.refresh_all_suggestions',
+        'schedule': timedelta(hours=int(os.environ.get('SUGGESTIONS_REFRESH_HOURS', 24))),
+    },
+    # Recomputes the trending posts shown to users who follow nobody.
+    'refresh-trending': {
+        'task': 'core.tasks.refresh_trending',
+        'schedule': timedelta(minutes=int(os.environ.get('TRENDING_REFRESH_MINUTES', 5))),
+    },
+    # Trims the home timelines that fan-out made longer than TIMELINE_MAX_DEPTH.
+    'trim-timelines': {
+        'task': 'core.tasks.trim_timelines',
+        'schedule': timedelta(minutes=int(os.environ.get('TIMELINE_TRIM_MINUTES', 60))),
+    },
+}
+
 DEFAULT_FROM_EMAIL = 'noreply@localhost.com'
 
 # This tells Django to print emails to the console instead of sending them
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
\ No newline at end of file
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Home timelines (fan-out-on-write)
+# Number of entries kept per user timeline; older posts fall off the end when
+# the trim-timelines job runs (fan-out alone lets a timeline grow past it).
+TIMELINE_MAX_DEPTH = int(os.environ.get('TIMELINE_MAX_DEPTH', 800))
+# Authors with at least this many followers are not fanned out on write;
+# their posts are merged into followers' feeds at read time instead.
+TIMELINE_FANOUT_THRESHOLD = int(os.environ.get('TIMELINE_FANOUT_THRESHOLD', 10000))
+
+# Most likes or follows applied by one bulk request (likePosts/followUsers,
+# /like-posts and /follow-users).
+MAX_BULK_ACTIONS = int(os.environ.get('MAX_BULK_ACTIONS', 500))
+
+# Where the cache invalidations and Celery tasks queued by a transaction run
+# once it commits (core.effects): 'inline' in the committing request, 'thread'
+# on a background thread, or 'celery' in a task. Counters are always updated inline.
+SIDE_EFFECTS = os.environ.get('SIDE_EFFECTS', 'inline')
+
+# User search
+# Longest a search query may run before we give up and answer with a prefix match.
+SEARCH_TIME_BUDGET_MS = int(os.environ.get('SEARCH_TIME_BUDGET_MS', 150))
+
+# Request instrumentation, see core.metrics.
+# Adds a Server-Timing header (DB, cache and serialization time) to every response.
+SERVER_TIMING = os.environ.get('SERVER_TIMING', str(DEBUG)) == 'True'
+# Logs requests that run the same query shape N_PLUS_ONE_THRESHOLD times or more.
+METRICS_DETECT_N_PLUS_ONE = os.environ.get('METRICS_DETECT_N_PLUS_ONE', str(DEBUG)) == 'True'
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+# If set, /metrics requires `Authorization: Bearer <METRICS_TOKEN>`.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Without a token, /metrics only answers these addresses (comma-separated).
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip]
@@ -13,16 +13,19 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
 from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 from djoser.urls import jwt
 from graphene_django.views import GraphQLView
 
 from django.views.decorators.csrf import csrf_exempt
 from graphene_file_upload.django import FileUploadGraphQLView
+from core.metrics import metrics_view
+from core.views import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -41,7 +44,13 @@ urlpatterns = [
     # Optional UI:
     path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+    # Prometheus metrics of this process
+    path('metrics', metrics_view, name='metrics'),
+
+    # Media files, with caching headers and ranges (and in DEBUG off too, unlike static())
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+]
 
 # urlpatterns = urlpatterns+static(settings.MEDIA_URL,
 # document_root=settings.MEDIA_ROOT)
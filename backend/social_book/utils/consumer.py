@@ -3,6 +3,12 @@ import os
 import sys
 import json
 import time
+import signal
+import argparse
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
 # /app is mounted to ./backend, so we add it to sys.path
 sys.path.append('/app')
@@ -30,26 +36,43 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_book.settings')
 import django
 django.setup()
 
+from django.db import close_old_connections, connections
+
 # Now imports from 'core' work
-from core.tasks import process_image_and_update_post
+from core.tasks import process_image_and_update_post, process_staged_image
+
 
+QUEUE_NAME = 'image_processing_queue'
+# Images processed at once by each consumer process.
+CONSUMER_THREADS = int(os.environ.get('CONSUMER_THREADS', os.cpu_count() or 1))
+# Unacknowledged messages the broker sends each process ahead of time.
+CONSUMER_PREFETCH = int(os.environ.get('CONSUMER_PREFETCH', CONSUMER_THREADS * 2))
+# Consumer processes started by `start_consumers`, e.g. one per core of the pod.
+CONSUMER_PROCESSES = int(os.environ.get('CONSUMER_PROCESSES', 1))
+# Times a failed message is queued again before it goes to DEAD_LETTER_QUEUE,
+# where it waits, with its staged image, to be inspected or moved back.
+MAX_RETRIES = int(os.environ.get('CONSUMER_MAX_RETRIES', 3))
+DEAD_LETTER_QUEUE = f'{QUEUE_NAME}.dead'
+RETRIES_HEADER = 'x-retries'
 
-def callback(ch, method, properties, body):
+
+def handle_message(body):
     """
-    Callback function that is executed when a message is received.
+    Processes one message from the image queue. Returns False (or raises) if
+    it failed and should be retried; messages for deleted posts count as done.
     """
-    print(" [x] Received message...")
     payload = json.loads(body)
 
     post_id = payload.get("post_id")
+    staged_path = payload.get("staged_path")
+    # Messages queued before uploads were staged carry the whole image.
     image_data = payload.get("image_base64_data")
 
-    if post_id and image_data:
-        process_image_and_update_post(post_id, image_data)
-
-    # Acknowledge the message to remove it from the queue
-    ch.basic_ack(delivery_tag=method.delivery_tag)
-    print(" [x] Done.")
+    if post_id and staged_path:
+        return process_staged_image(post_id, staged_path) is not False
+    elif post_id and image_data:
+        return process_image_and_update_post(post_id, image_data) is not False
+    return True
 
 
 def connect_rabbitmq(max_retries=0, backoff=5):
@@ -79,29 +102,143 @@ def connect_rabbitmq(max_retries=0, backoff=5):
 
 
 
-def start_consumer():
+def start_consumer(threads=CONSUMER_THREADS, prefetch=CONSUMER_PREFETCH):
     """
-    Connects to RabbitMQ and starts consuming messages.
+    Connects to RabbitMQ and processes up to `threads` messages at once.
+
+    pika channels are not thread-safe: messages are received on this thread,
+    processed on a thread pool, and acknowledged back on this thread through
+    `add_callback_threadsafe` once processing completes. On SIGTERM/SIGINT the
+    consumer stops taking messages, finishes and acknowledges the ones in
+    progress, and leaves the rest to be redelivered.
+
+    A message that fails is published again with its retry count in a
+    header, up to `MAX_RETRIES` times, then moved to `DEAD_LETTER_QUEUE`
+    without it (so it gets its retries again if moved back).
     """
     connection = connect_rabbitmq()
     channel = connection.channel()
-    channel.queue_declare(queue='image_processing_queue', durable=True)
-    channel.basic_consume(
-        queue='image_processing_queue',
-        on_message_callback=callback
-    )
-    print(' [*] Waiting for messages. To exit press CTRL+C')
+    channel.queue_declare(queue=QUEUE_NAME, durable=True)
+    channel.queue_declare(queue=DEAD_LETTER_QUEUE, durable=True)
+    # Retried and dead-lettered messages are acknowledged once the broker has their copy.
+    channel.confirm_delivery()
+    # Don't let the broker push more than we can work through soon.
+    channel.basic_qos(prefetch_count=prefetch)
+
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='image-worker')
+    # `{delivery_tag: future}` of the messages handed to the pool.
+    in_flight = {}
+    in_flight_lock = threading.Lock()
+
+    def settle(delivery_tag, ok, properties, body):
+        # Runs on the connection's thread.
+        with in_flight_lock:
+            in_flight.pop(delivery_tag, None)
+        if not channel.is_open:
+            return
+        if not ok:
+            headers = dict(properties.headers or {})
+            retries = headers.pop(RETRIES_HEADER, 0) + 1
+            if retries <= MAX_RETRIES:
+                print(f" [!] Retrying message ({retries}/{MAX_RETRIES})")
+                queue_name, headers[RETRIES_HEADER] = QUEUE_NAME, retries
+            else:
+                print(f" [!] Giving up on message, moved to {DEAD_LETTER_QUEUE}")
+                queue_name = DEAD_LETTER_QUEUE
+            try:
+                channel.basic_publish(
+                    exchange='',
+                    routing_key=queue_name,
+                    body=body,
+                    properties=pika.BasicProperties(
+                        delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE, headers=headers,
+                    ),
+                )
+            except pika.exceptions.AMQPError as e:
+                # Left unacknowledged: the broker redelivers it after we disconnect.
+                print(f"Error requeueing message: {e!r}")
+                return
+        channel.basic_ack(delivery_tag=delivery_tag)
+
+    def work(delivery_tag, properties, body):
+        close_old_connections()
+        ok = False
+        try:
+            ok = handle_message(body)
+        except Exception as e:
+            print(f"Error processing message: {e}")
+        finally:
+            close_old_connections()
+        connection.add_callback_threadsafe(functools.partial(settle, delivery_tag, ok, properties, body))
+
+    def on_message(ch, method, properties, body):
+        with in_flight_lock:
+            in_flight[method.delivery_tag] = executor.submit(work, method.delivery_tag, properties, body)
+
+    def shutdown(signum, frame):
+        print("Shutting down, finishing messages in progress...")
+        connection.add_callback_threadsafe(channel.stop_consuming)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=on_message)
+    print(f' [*] Waiting for messages ({threads} threads, prefetch {prefetch}).')
     try:
         channel.start_consuming()
-    except KeyboardInterrupt:
-        print("Interrupted, closing connection...")
-        if connection.is_open:
-            connection.close()
     except Exception as e:
         print(f"Unexpected error: {e}")
+    finally:
+        # Messages not started yet are dropped here and redelivered by the
+        # broker: no acknowledgement is coming for them.
+        executor.shutdown(wait=True, cancel_futures=True)
+        with in_flight_lock:
+            for delivery_tag, future in list(in_flight.items()):
+                if future.cancelled():
+                    del in_flight[delivery_tag]
+        # Deliver the acknowledgements of the messages that did finish.
+        while connection.is_open:
+            with in_flight_lock:
+                if not in_flight:
+                    break
+            connection.process_data_events(time_limit=0.1)
         if connection.is_open:
             connection.close()
 
 
+def start_consumers(processes=CONSUMER_PROCESSES, threads=CONSUMER_THREADS, prefetch=CONSUMER_PREFETCH):
+    """
+    Runs `processes` consumers, each with its own connection and thread pool,
+    and forwards SIGTERM/SIGINT to them so they all shut down gracefully.
+    """
+    if processes <= 1:
+        start_consumer(threads, prefetch)
+        return
+
+    # Each child opens its own database and broker connections.
+    connections.close_all()
+    children = [
+        multiprocessing.Process(target=start_consumer, args=(threads, prefetch), name=f'consumer-{index}')
+        for index in range(processes)
+    ]
+    for child in children:
+        child.start()
+
+    def forward(signum, frame):
+        for child in children:
+            if child.is_alive():
+                os.kill(child.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for child in children:
+        child.join()
+
+
 if __name__ == '__main__':
-    start_consumer()
+    parser = argparse.ArgumentParser(description='Consume the image processing queue.')
+    parser.add_argument('--processes', type=int, default=CONSUMER_PROCESSES)
+    parser.add_argument('--threads', type=int, default=CONSUMER_THREADS)
+    parser.add_argument('--prefetch', type=int, default=CONSUMER_PREFETCH)
+    args = parser.parse_args()
+    start_consumers(args.processes, args.threads, args.prefetch)
@@ -1,40 +1,256 @@
 import pika
 import os
 import json
+import time
+import queue
+import fcntl
+import threading
+from contextlib import contextmanager
+from pathlib import Path
 
-def publish_to_queue(queue_name, message):
+# Messages are published through a process-wide pool of connections, each with
+# one channel in publisher-confirm mode, so a request pays for a publish and its
+# confirm instead of a TCP + AMQP handshake. When the broker can't be reached
+# the message is appended to a local spool file instead of being dropped. The
+# spool is replayed by a background thread of every publishing process, right
+# away and then every SPOOL_REPLAY_INTERVAL seconds, and whenever a new
+# connection is opened.
+
+RABBITMQ_HOST = os.environ.get('RABBITMQ_HOST', 'rabbitmq')
+RABBITMQ_PORT = int(os.environ.get('RABBITMQ_PORT', 5672))
+# Connections kept open per process.
+POOL_SIZE = int(os.environ.get('RABBITMQ_POOL_SIZE', 2))
+# Messages that couldn't be published, one JSON object per line. Keep it on
+# storage that survives restarts (docker-compose mounts a volume on backend/var).
+SPOOL_PATH = os.environ.get(
+    'RABBITMQ_SPOOL_PATH', str(Path(__file__).resolve().parents[2] / 'var' / 'rabbitmq_spool.jsonl')
+)
+SPOOL_REPLAY_INTERVAL = float(os.environ.get('RABBITMQ_SPOOL_REPLAY_INTERVAL', 30))
+# Attempts per message before it is spooled, and the delay before the second one.
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 0.1
+# After the broker was found down, skip straight to the spool for this long
+# rather than making every request wait for a connection timeout.
+COOLDOWN = 5.0
+
+# Errors after which a pooled connection is thrown away and the publish retried.
+CONNECTION_ERRORS = (pika.exceptions.AMQPError, OSError)
+
+
+class PooledChannel:
     """
-    Publishes a message to a RabbitMQ queue.
+    A connection with one channel in confirm mode, and the queues already declared on it.
     """
-    connection = None
-    try:
-        # Connect to RabbitMQ using the service name from Docker Compose
-        connection = pika.BlockingConnection(
+    def __init__(self):
+        self.connection = pika.BlockingConnection(
             pika.ConnectionParameters(
-                host=os.environ.get('RABBITMQ_HOST', 'rabbitmq'),
-                port=5672
+                host=RABBITMQ_HOST,
+                port=RABBITMQ_PORT,
+                connection_attempts=1,
+                socket_timeout=2,
+                blocked_connection_timeout=5,
             )
         )
-        channel = connection.channel()
+        self.channel = self.connection.channel()
+        # Every basic_publish now waits for the broker to confirm it has the message.
+        self.channel.confirm_delivery()
+        self.declared = set()
 
-        # Declare the queue. It's idempotent, so it's safe to call.
-        channel.queue_declare(queue=queue_name, durable=True)
+    @property
+    def is_open(self):
+        return self.connection.is_open and self.channel.is_open
 
+    def publish(self, queue_name, body):
+        if queue_name not in self.declared:
+            # Declare the queue. It's idempotent, so it's safe to call.
+            self.channel.queue_declare(queue=queue_name, durable=True)
+            self.declared.add(queue_name)
         # Publish the message using Direct Exchange
-        channel.basic_publish(
+        self.channel.basic_publish(
             exchange='',
             routing_key=queue_name,
-            body=json.dumps(message),
+            body=body,
             properties=pika.BasicProperties(
                 delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE  # Make the message durable
-            )
+            ),
+            mandatory=True,
         )
-        print(f" [x] Sent message to '{queue_name}'")
 
-    except pika.exceptions.AMQPConnectionError as e:
-        print(f"Error connecting to RabbitMQ: {e}")
-        # You could implement retry logic here for a production system.
+    def close(self):
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except CONNECTION_ERRORS:
+            pass
+
+
+class Publisher:
+    """
+    Pool of `PooledChannel`s for one process. Use `get_publisher()` rather
+    than creating one, so a forked worker never reuses its parent's sockets.
+    """
+    def __init__(self, size=POOL_SIZE):
+        self.pid = os.getpid()
+        self.idle = queue.LifoQueue(maxsize=size)
+        self.slots = threading.BoundedSemaphore(size)
+        self.down_until = 0.0
+
+    @contextmanager
+    def channel(self):
+        """
+        Checks a channel out of the pool, connecting (and replaying the spool) if needed.
+        """
+        with self.slots:
+            try:
+                pooled = self.idle.get_nowait()
+            except queue.Empty:
+                pooled = None
+            if pooled is None or not pooled.is_open:
+                if pooled is not None:
+                    pooled.close()
+                pooled = PooledChannel()
+                print(f"[✓] Connected to RabbitMQ at {RABBITMQ_HOST}:{RABBITMQ_PORT}")
+                try:
+                    self._replay_spool(pooled)
+                except BaseException:
+                    pooled.close()
+                    raise
+            try:
+                yield pooled
+            except BaseException:
+                # The channel may be half broken: don't hand it to anyone else.
+                pooled.close()
+                raise
+            self.idle.put_nowait(pooled)
+
+    def publish(self, queue_name, message):
+        """
+        Publishes `message` to `queue_name` over a pooled channel and waits for
+        the broker to confirm it. If that still fails after `MAX_ATTEMPTS`, the
+        message is spooled. Returns whether it was published.
+        """
+        body = json.dumps(message)
+        if time.monotonic() >= self.down_until:
+            for attempt in range(MAX_ATTEMPTS):
+                try:
+                    with self.channel() as pooled:
+                        pooled.publish(queue_name, body)
+                    return True
+                except CONNECTION_ERRORS as e:
+                    print(f"Error publishing to RabbitMQ (attempt {attempt + 1}/{MAX_ATTEMPTS}): {e!r}")
+                    if attempt + 1 < MAX_ATTEMPTS:
+                        time.sleep(RETRY_BACKOFF * 2 ** attempt)
+            self.down_until = time.monotonic() + COOLDOWN
+
+        spool(queue_name, [body])
+        return False
+
+    def replay_spool(self):
+        """
+        Replays the spool now, unless it is empty or the broker was just found down.
+        """
+        if not os.path.exists(SPOOL_PATH) or time.monotonic() < self.down_until:
+            return
+        try:
+            with self.channel() as pooled:
+                self._replay_spool(pooled)
+        except CONNECTION_ERRORS as e:
+            print(f"Error replaying the RabbitMQ spool: {e!r}")
+            self.down_until = time.monotonic() + COOLDOWN
+
+    def start_replaying(self):
+        """
+        Starts the thread replaying the spool every `SPOOL_REPLAY_INTERVAL` seconds, starting now.
+        """
+        thread = threading.Thread(target=self._replay_periodically, name='rabbitmq-spool', daemon=True)
+        thread.start()
+
+    def _replay_periodically(self):
+        while True:
+            try:
+                self.replay_spool()
+            except Exception as e:
+                print(f"Error replaying the RabbitMQ spool: {e!r}")
+            time.sleep(SPOOL_REPLAY_INTERVAL)
+
+    def _replay_spool(self, pooled):
+        """
+        Publishes the messages spooled while the broker was unavailable.
+
+        The spool file is moved aside first, so two processes never replay
+        the same messages; anything that fails to publish is spooled again.
+        """
+        replaying = f'{SPOOL_PATH}.{os.getpid()}.replay'
+        try:
+            os.replace(SPOOL_PATH, replaying)
+        except FileNotFoundError:
+            return
 
-    finally:
-        if connection and connection.is_open:
-            connection.close()
+        with open(replaying) as f:
+            # Wait for anyone still writing to the file we just moved.
+            fcntl.flock(f, fcntl.LOCK_EX)
+            entries = [json.loads(line) for line in f if line.strip()]
+        for index, entry in enumerate(entries):
+            try:
+                pooled.publish(entry['queue'], entry['body'])
+            except CONNECTION_ERRORS:
+                os.remove(replaying)
+                for rest in entries[index:]:
+                    spool(rest['queue'], [rest['body']])
+                raise
+        os.remove(replaying)
+        print(f" [x] Replayed {len(entries)} spooled message(s)")
+
+
+def spool(queue_name, bodies):
+    """
+    Appends messages that couldn't be published to the spool file.
+    """
+    os.makedirs(os.path.dirname(SPOOL_PATH), exist_ok=True)
+    while True:
+        f = open(SPOOL_PATH, 'a')
+        # Several workers may spool at once: keep their lines from interleaving.
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            current = os.stat(SPOOL_PATH).st_ino == os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            current = False
+        if current:
+            break
+        # The file was moved aside for a replay after we opened it: use the new one.
+        f.close()
+
+    with f:
+        for body in bodies:
+            f.write(json.dumps({'queue': queue_name, 'body': body}) + '\n')
+    print(f" [!] RabbitMQ unavailable, spooled {len(bodies)} message(s) for '{queue_name}'")
+
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher():
+    """
+    Returns this process's publisher, creating a new one (and its spool
+    replaying thread) on first use and after a fork.
+    """
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None or _publisher.pid != os.getpid():
+            _publisher = Publisher()
+            _publisher.start_replaying()
+        return _publisher
+
+
+def publish_to_queue(queue_name, message):
+    """
+    Publishes a message to a RabbitMQ queue.
+
+    Returns True once the broker confirmed it, False if it was spooled to be
+    sent when the broker is back.
+    """
+    published = get_publisher().publish(queue_name, message)
+    if published:
+        print(f" [x] Sent message to '{queue_name}'")
+    return published
@@ -8,16 +8,38 @@ import { useQuery } from "@apollo/client";
 import { GET_FEED } from "@/lib/graphQL/queries"
 import { GetFeedDataQuery } from "@/lib/types"
 import { Suspense } from "react"
+import { Button } from "@/components/ui/button"
+
+const PAGE_SIZE = 20
 
 export default function FeedPage() {
 
-    const { data, loading, error } = useQuery<GetFeedDataQuery>(GET_FEED);
+    const { data, loading, error, fetchMore } = useQuery<GetFeedDataQuery>(GET_FEED, {
+        variables: { first: PAGE_SIZE },
+    });
 
     if (loading) return <p>Loading...</p>;
 
 
     if (error) return <p>Error! {error.message}</p>;
 
+    const posts = data?.feed?.edges.map((edge) => edge?.node) ?? []
+    const pageInfo = data?.feed?.pageInfo
+
+    const loadMore = () => fetchMore({
+        variables: { first: PAGE_SIZE, after: pageInfo?.endCursor },
+        updateQuery: (previous, { fetchMoreResult }) => {
+            if (!previous.feed || !fetchMoreResult?.feed) return previous
+            return {
+                ...fetchMoreResult,
+                feed: {
+                    ...fetchMoreResult.feed,
+                    edges: [...previous.feed.edges, ...fetchMoreResult.feed.edges],
+                },
+            }
+        },
+    })
+
     return (
         <Suspense>
             <div className="min-h-screen bg-gray-50">
@@ -29,7 +51,7 @@ export default function FeedPage() {
                             <CreatePost />
 
                             {data?.feed && (
-                                data.feed.length === 0 ? (
+                                posts.length === 0 ? (
                                     <div className="text-center py-12">
                                         <div className="w-16 h-16 bg-gray-100 rounded-full flex items-center justify-center mx-auto mb-4">
                                             <svg className="w-8 h-8 text-gray-400" fill="none" stroke="currentColor" viewBox="0 0 24 24">
@@ -45,7 +67,14 @@ export default function FeedPage() {
                                         <p className="text-gray-600">Follow some users to see their posts in your feed.</p>
                                     </div>
                                 ) : (
-                                    data.feed.map((post) => <PostCard key={post?.id} post={post} />)
+                                    <>
+                                        {posts.map((post) => <PostCard key={post?.id} post={post} />)}
+                                        {pageInfo?.hasNextPage && (
+                                            <div className="flex justify-center">
+                                                <Button variant="outline" onClick={loadMore}>Load more</Button>
+                                            </div>
+                                        )}
+                                    </>
                                 )
 
                             )}
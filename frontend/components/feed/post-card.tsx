@@ -13,10 +13,10 @@ import { useUser } from "../auth/AuthComponent"
 import { LIKE_POST } from "@/lib/graphQL/queries"
 import { BookmarkIcon, CommentIcon, HeartIcon, MoreOptionsIcon, ShareIcon } from "../svg"
 
-type FeedType = GetFeedDataQuery['feed']
+type FeedEdge = NonNullable<GetFeedDataQuery['feed']>['edges'][number]
 
 interface PostCardProps {
-  post: NonNullable<FeedType>[number]
+  post: NonNullable<FeedEdge>['node']
 }
 
 export function PostCard({ post }: PostCardProps) {
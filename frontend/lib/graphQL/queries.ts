@@ -27,30 +27,38 @@ export const REFRESH_MUTATION = gql`
 
 
 export const GET_FEED = gql`
-    query GetFeedData {
-        feed{
-            id
-            user{
-                id
-                username
-                firstName
-                lastName
-                profile{
-                    profileimg
-                }
-            }
-            image
-            caption
-            createdAt
-            likes{
-                user{
-                    username
+    query GetFeedData($first: Int, $after: String) {
+        feed(first: $first, after: $after){
+            edges{
+                node{
                     id
-                    profile{
-                        profileimg
+                    user{
+                        id
+                        username
+                        firstName
+                        lastName
+                        profile{
+                            profileimg
+                        }
+                    }
+                    image
+                    caption
+                    createdAt
+                    likes{
+                        user{
+                            username
+                            id
+                            profile{
+                                profileimg
+                            }
+                        }
                     }
                 }
             }
+            pageInfo{
+                hasNextPage
+                endCursor
+            }
         }
         suggestions {
             id
@@ -104,6 +104,36 @@ export type ObtainJsonWebToken = {
   token: Scalars['String']['output'];
 };
 
+/** The Relay compliant `PageInfo` type, containing data necessary to paginate this connection. */
+export type PageInfo = {
+  __typename?: 'PageInfo';
+  /** When paginating forwards, the cursor to continue. */
+  endCursor?: Maybe<Scalars['String']['output']>;
+  /** When paginating forwards, are there more items? */
+  hasNextPage: Scalars['Boolean']['output'];
+  /** When paginating backwards, are there more items? */
+  hasPreviousPage: Scalars['Boolean']['output'];
+  /** When paginating backwards, the cursor to continue. */
+  startCursor?: Maybe<Scalars['String']['output']>;
+};
+
+export type PostConnection = {
+  __typename?: 'PostConnection';
+  /** Contains the nodes in this connection. */
+  edges: Array<Maybe<PostEdge>>;
+  /** Pagination data for this connection. */
+  pageInfo: PageInfo;
+};
+
+/** A Relay edge containing a `Post` and its cursor. */
+export type PostEdge = {
+  __typename?: 'PostEdge';
+  /** A cursor for use in pagination */
+  cursor: Scalars['String']['output'];
+  /** The item at the end of the edge */
+  node?: Maybe<PostType>;
+};
+
 export type PostType = {
   __typename?: 'PostType';
   caption: Scalars['String']['output'];
@@ -129,7 +159,7 @@ export type ProfileType = {
 
 export type Query = {
   __typename?: 'Query';
-  feed?: Maybe<Array<Maybe<PostType>>>;
+  feed?: Maybe<PostConnection>;
   helloWorld?: Maybe<Scalars['String']['output']>;
   myProfile?: Maybe<ProfileType>;
   profile?: Maybe<ProfileType>;
@@ -138,6 +168,14 @@ export type Query = {
 };
 
 
+export type QueryFeedArgs = {
+  after?: InputMaybe<Scalars['String']['input']>;
+  before?: InputMaybe<Scalars['String']['input']>;
+  first?: InputMaybe<Scalars['Int']['input']>;
+  last?: InputMaybe<Scalars['Int']['input']>;
+};
+
+
 export type QueryProfileArgs = {
   username?: InputMaybe<Scalars['String']['input']>;
 };
@@ -198,10 +236,13 @@ export type RefreshTokenMutationVariables = Exact<{
 
 export type RefreshTokenMutation = { __typename?: 'Mutation', refreshToken?: { __typename?: 'Refresh', token: string, payload: any } | null };
 
-export type GetFeedDataQueryVariables = Exact<{ [key: string]: never; }>;
+export type GetFeedDataQueryVariables = Exact<{
+  first?: InputMaybe<Scalars['Int']['input']>;
+  after?: InputMaybe<Scalars['String']['input']>;
+}>;
 
 
-export type GetFeedDataQuery = { __typename?: 'Query', feed?: Array<{ __typename?: 'PostType', id: any, image: string, caption: string, createdAt: any, user: { __typename?: 'UserType', id: any, username: string, firstName?: string | null, lastName?: string | null, profile?: { __typename?: 'ProfileType', profileimg: string } | null }, likes: Array<{ __typename?: 'LikePostType', user: { __typename?: 'UserType', username: string, id: any, profile?: { __typename?: 'ProfileType', profileimg: string } | null } }> } | null> | null, suggestions?: Array<{ __typename?: 'ProfileType', id: string, bio?: string | null, profileimg: string, followersCount?: number | null, followingCount?: number | null, isFollowing?: boolean | null, user: { __typename?: 'UserType', username: string, email?: string | null, firstName?: string | null, lastName?: string | null } } | null> | null };
+export type GetFeedDataQuery = { __typename?: 'Query', feed?: { __typename?: 'PostConnection', edges: Array<{ __typename?: 'PostEdge', node?: { __typename?: 'PostType', id: any, image: string, caption: string, createdAt: any, user: { __typename?: 'UserType', id: any, username: string, firstName?: string | null, lastName?: string | null, profile?: { __typename?: 'ProfileType', profileimg: string } | null }, likes: Array<{ __typename?: 'LikePostType', user: { __typename?: 'UserType', username: string, id: any, profile?: { __typename?: 'ProfileType', profileimg: string } | null } }> } | null } | null>, pageInfo: { __typename?: 'PageInfo', hasNextPage: boolean, endCursor?: string | null } } | null, suggestions?: Array<{ __typename?: 'ProfileType', id: string, bio?: string | null, profileimg: string, followersCount?: number | null, followingCount?: number | null, isFollowing?: boolean | null, user: { __typename?: 'UserType', username: string, email?: string | null, firstName?: string | null, lastName?: string | null } } | null> | null };
 
 export type GetMyProfileQueryVariables = Exact<{ [key: string]: never; }>;
 
@@ -318,30 +359,38 @@ export type RefreshTokenMutationHookResult = ReturnType<typeof useRefreshTokenMu
 export type RefreshTokenMutationResult = Apollo.MutationResult<RefreshTokenMutation>;
 export type RefreshTokenMutationOptions = Apollo.BaseMutationOptions<RefreshTokenMutation, RefreshTokenMutationVariables>;
 export const GetFeedDataDocument = gql`
-    query GetFeedData {
-  feed {
-    id
-    user {
-      id
-      username
-      firstName
-      lastName
-      profile {
-        profileimg
-      }
-    }
-    image
-    caption
-    createdAt
-    likes {
-      user {
-        username
+    query GetFeedData($first: Int, $after: String) {
+  feed(first: $first, after: $after) {
+    edges {
+      node {
         id
-        profile {
-          profileimg
+        user {
+          id
+          username
+          firstName
+          lastName
+          profile {
+            profileimg
+          }
+        }
+        image
+        caption
+        createdAt
+        likes {
+          user {
+            username
+            id
+            profile {
+              profileimg
+            }
+          }
         }
       }
     }
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
   }
   suggestions {
     id
@@ -372,6 +421,8 @@ export const GetFeedDataDocument = gql`
  * @example
  * const { data, loading, error } = useGetFeedDataQuery({
  *   variables: {
+ *      first: // value for 'first'
+ *      after: // value for 'after'
  *   },
  * });
  */